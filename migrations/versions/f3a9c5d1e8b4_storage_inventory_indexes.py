@@ -0,0 +1,30 @@
+"""Storage inventory indexes
+
+Revision ID: f3a9c5d1e8b4
+Revises: b8e1f4c6d2a7
+Create Date: 2024-03-09 10:17:42.903165
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a9c5d1e8b4'
+down_revision: Union[str, None] = 'b8e1f4c6d2a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keys in the byte order of S3 listings, autogenerate skips
+    # expression indexes
+    op.create_index('ix_blobs_key', 'blobs', [sa.text('(key COLLATE "C")')], unique=False)
+    op.create_index('ix_files_storage_key', 'files', [sa.text('(coalesce(key, path) COLLATE "C")')], unique=False, postgresql_where=sa.text('blob_id IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_files_storage_key', table_name='files')
+    op.drop_index('ix_blobs_key', table_name='blobs')
@@ -1,23 +1,67 @@
 import logging
 from datetime import datetime
 
-from aioredis import Redis
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.responses import PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi_cache.decorator import cache
 from fastapi_login.exceptions import InvalidCredentialsException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from core.config import app_settings
+from core.config import DownloadMode, app_settings
 from core.logger import LOGGING
-from db.db import get_session
-from schemas.file import FileResponse, UserFilesResponse
+from db.db import get_pool_stats, get_session
+from db.redis import get_redis, redis_client
+from schemas.file import (
+    BatchUploadResponse,
+    FileResponse,
+    FilesFilter,
+    FilesMove,
+    FilesSearch,
+    FilesSelection,
+    PresignedUploadComplete,
+    PresignedUploadResponse,
+    UploadSessionResponse,
+    UserFilesResponse,
+)
+from schemas.folder import FolderTreeResponse
+from schemas.operation import OperationResponse
 from schemas.ping import Ping
+from schemas.usage import UsageResponse
 from schemas.user import UserCreate, UserResponse
-from services.file import download_file, file_crud, upload_file
-from services.security import manager, verify_password
-from services.user import create_user, get_user
+from services.archive import ArchiveFormat
+from services.boto3 import get_s3
+from services.bulk import delete_files, get_operation, move_files
+from services.file import (
+    complete_upload,
+    download_file,
+    get_files_page,
+    get_folder_tree,
+    presign_upload,
+    upload_file,
+    upload_file_stream,
+    upload_files_batch,
+)
+from services.metrics import registry
+from services.resumable import (
+    abort_upload_session,
+    complete_upload_session,
+    create_upload_session,
+    get_upload_offset,
+    upload_chunk,
+)
+from services.search import search_files
+from services.security import manager
+from services.usage import get_usage
+from services.user import authenticate_user, create_user, get_user
 
 router = APIRouter()
 
@@ -49,11 +93,9 @@ async def login(
         data: OAuth2PasswordRequestForm = Depends(),
         db: AsyncSession = Depends(get_session)
 ):
-    user = await get_user(email=data.username, db=db)
+    user = await authenticate_user(db, data.username, data.password)
     if user is None:
         raise InvalidCredentialsException
-    elif not verify_password(data.password, user.hashed_password):
-        raise InvalidCredentialsException
 
     access_token = manager.create_access_token(
         data=dict(sub=user.email)
@@ -80,35 +122,83 @@ async def get_ping(db: AsyncSession = Depends(get_session)):
     # Test connection to Redis
     try:
         start_redis = datetime.utcnow()
-        redis_connection = Redis(
-            host=app_settings.redis_host,
-            port=app_settings.redis_port,
-            decode_responses=True
-        )
-        await redis_connection.ping()
+        await redis_client.client.ping()
         time_redis = (datetime.utcnow() - start_redis).total_seconds()
         logger.info('Send ping to Redis.')
     except Exception:
         time_redis = 'Disconnected'
         logger.warning('Redis disconnected')
 
-    return Ping(db=time_db, cache=time_redis)
+    return Ping(
+        db=time_db,
+        cache=time_redis,
+        pools={
+            'db': get_pool_stats(),
+            'cache': redis_client.get_pool_stats(),
+        }
+    )
+
+
+@router.get(
+    '/metrics',
+    response_class=PlainTextResponse,
+    description='Метрики сервиса в формате Prometheus.')
+async def get_metrics():
+    return PlainTextResponse(
+        registry.render(),
+        media_type='text/plain; version=0.0.4; charset=utf-8'
+    )
 
 
 @router.get(
     '/files',
     response_model=UserFilesResponse,
     description='Информация о загруженных файлах текущего пользователя.')
-@cache(expire=30)
 async def get_files_info(
+        filters: FilesFilter = Depends(),
         db: AsyncSession = Depends(get_session),
         user=Depends(manager)
 ):
-    list_file_obj = await file_crud.get_multi_by_user_id(
-        db=db,
-        user_id=user.id
+    return await get_files_page(filters, db, user)
+
+
+@router.get(
+    '/files/search',
+    response_model=UserFilesResponse,
+    description=(
+        'Поиск файлов по подстроке, началу или похожему написанию '
+        'имени или пути вместе с фильтрами /files.'
     )
-    return UserFilesResponse(account_id=user.id, files=list_file_obj)
+)
+async def search_files_info(
+        search: FilesSearch = Depends(),
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager)
+):
+    return await search_files(search, db, user)
+
+
+@router.get(
+    '/files/tree',
+    response_model=FolderTreeResponse,
+    description='Содержимое папки: вложенные папки и файлы с их размерами.')
+async def get_files_tree(
+        path: str = '',
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager)
+):
+    return await get_folder_tree(path, db, user)
+
+
+@router.get(
+    '/files/usage',
+    response_model=UsageResponse,
+    description='Занятое файлами пользователя место и его квота.')
+async def get_files_usage(
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager)
+):
+    return await get_usage(db, user)
 
 
 @router.post(
@@ -121,20 +211,219 @@ async def upload_file_by_path(
         file: UploadFile,
         path: str = '',
         db: AsyncSession = Depends(get_session),
-        user=Depends(manager)
+        user=Depends(manager),
+        s3=Depends(get_s3)
+):
+    return await upload_file(file, path, db, user, s3)
+
+
+@router.post(
+    '/files/upload/batch',
+    response_model=BatchUploadResponse,
+    description='Загрузить несколько файлов в папку.'
+)
+async def upload_files_batch_by_path(
+        files: list[UploadFile],
+        path: str = '',
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3)
+):
+    return await upload_files_batch(files, path, db, user, s3)
+
+
+@router.post(
+    '/files/upload/stream',
+    response_model=FileResponse,
+    status_code=status.HTTP_201_CREATED,
+    description='Загрузить файл потоком из тела запроса по частям.'
+)
+async def upload_file_stream_by_path(
+        request: Request,
+        path: str = '',
+        name: str = '',
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3)
+):
+    return await upload_file_stream(request, path, name, db, user, s3)
+
+
+@router.post(
+    '/files/upload/presigned',
+    response_model=PresignedUploadResponse,
+    description='Получить ссылки для загрузки файла напрямую в хранилище.'
+)
+async def presign_upload_by_path(
+        path: str = '',
+        name: str = '',
+        parts: int = 1,
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3),
+        redis=Depends(get_redis)
 ):
-    return await upload_file(file, path, db, user)
+    return await presign_upload(path, name, parts, db, user, s3, redis)
+
+
+@router.post(
+    '/files/upload/complete',
+    response_model=FileResponse,
+    status_code=status.HTTP_201_CREATED,
+    description='Завершить загрузку файла по ссылкам из хранилища.'
+)
+async def complete_upload_by_path(
+        data: PresignedUploadComplete,
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3),
+        redis=Depends(get_redis)
+):
+    return await complete_upload(data, db, user, s3, redis)
+
+
+@router.post(
+    '/files/uploads',
+    response_model=UploadSessionResponse,
+    status_code=status.HTTP_201_CREATED,
+    description='Начать возобновляемую загрузку файла по частям.'
+)
+async def create_upload_session_by_path(
+        size: int,
+        path: str = '',
+        name: str = '',
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3),
+        redis=Depends(get_redis)
+):
+    return await create_upload_session(path, name, size, db, user, s3, redis)
+
+
+@router.head(
+    '/files/uploads/{upload_id}',
+    description='Узнать, сколько байт файла уже загружено.'
+)
+async def get_upload_offset_by_id(
+        upload_id: str,
+        user=Depends(manager),
+        redis=Depends(get_redis)
+):
+    return await get_upload_offset(upload_id, user, redis)
+
+
+@router.patch(
+    '/files/uploads/{upload_id}',
+    status_code=status.HTTP_204_NO_CONTENT,
+    description=(
+        'Загрузить часть файла со смещения из заголовка Upload-Offset. '
+        'Части можно загружать параллельно и повторно.'
+    )
+)
+async def upload_chunk_by_id(
+        upload_id: str,
+        request: Request,
+        user=Depends(manager),
+        s3=Depends(get_s3),
+        redis=Depends(get_redis)
+):
+    return await upload_chunk(upload_id, request, user, s3, redis)
+
+
+@router.post(
+    '/files/uploads/{upload_id}/complete',
+    response_model=FileResponse,
+    status_code=status.HTTP_201_CREATED,
+    description='Завершить возобновляемую загрузку файла.'
+)
+async def complete_upload_session_by_id(
+        upload_id: str,
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3),
+        redis=Depends(get_redis)
+):
+    return await complete_upload_session(upload_id, db, user, s3, redis)
+
+
+@router.delete(
+    '/files/uploads/{upload_id}',
+    status_code=status.HTTP_204_NO_CONTENT,
+    description='Отменить возобновляемую загрузку файла.'
+)
+async def abort_upload_session_by_id(
+        upload_id: str,
+        user=Depends(manager),
+        s3=Depends(get_s3),
+        redis=Depends(get_redis)
+):
+    return await abort_upload_session(upload_id, user, s3, redis)
+
+
+@router.post(
+    '/files/delete',
+    response_model=OperationResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    description=(
+        'Удалить файлы по идентификаторам, путям или префиксу пути. '
+        'Файлы удаляются в фоне, ход операции доступен по её id.'
+    )
+)
+async def delete_files_by_selection(
+        selection: FilesSelection,
+        user=Depends(manager),
+        redis=Depends(get_redis)
+):
+    return await delete_files(selection, user, redis)
+
+
+@router.post(
+    '/files/move',
+    response_model=OperationResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    description=(
+        'Переместить или переименовать файлы, в том числе папку целиком. '
+        'Файлы перемещаются в фоне, ход операции доступен по её id.'
+    )
+)
+async def move_files_by_selection(
+        data: FilesMove,
+        user=Depends(manager),
+        redis=Depends(get_redis)
+):
+    return await move_files(data, user, redis)
+
+
+@router.get(
+    '/files/operations/{operation_id}',
+    response_model=OperationResponse,
+    description='Состояние фоновой операции над файлами.'
+)
+async def get_operation_by_id(
+        operation_id: str,
+        user=Depends(manager),
+        redis=Depends(get_redis)
+):
+    return await get_operation(operation_id, user, redis)
 
 
 @router.get(
     '/files/download',
     status_code=status.HTTP_200_OK,
-    description='Скачать файл по переданному пути или по идентификатору.'
+    description=(
+        'Скачать файл по переданному пути или по идентификатору. '
+        'Папки и несколько файлов скачиваются одним архивом.'
+    )
 )
-@cache(expire=60)
 async def download_file_by_path_or_id(
-        path: str,
+        request: Request,
+        path: list[str] = Query(),
+        mode: DownloadMode | None = None,
+        compression: ArchiveFormat | None = None,
         db: AsyncSession = Depends(get_session),
-        user=Depends(manager)
+        user=Depends(manager),
+        s3=Depends(get_s3)
 ):
-    return await download_file(path, db, user)
+    return await download_file(
+        request, path, mode, compression, db, user, s3
+    )
@@ -0,0 +1,82 @@
+"""
+Measure how a burst of logins delays other requests served by the same
+event loop: bcrypt inline versus on the bounded hashing pool.
+
+A file transfer is simulated by a task writing a chunk every
+millisecond, its per-chunk latency is reported.
+
+Usage (from the "src" dir):
+    python -m benchmarks.password_hashing --logins 40 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import HTTPException
+
+from benchmarks.s3_client import report
+from services.security import PasswordHasher, pwd_context
+
+TICK = 0.001
+
+
+async def transfer(stop: asyncio.Event) -> list[float]:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def verify_inline(password: str, hashed_password: str):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+async def run(verify, logins: int, concurrency: int, hashed_password: str):
+    semaphore = asyncio.Semaphore(concurrency)
+    rejected = 0
+
+    async def login():
+        nonlocal rejected
+        async with semaphore:
+            try:
+                await verify('password', hashed_password)
+            except HTTPException:
+                rejected += 1
+
+    stop = asyncio.Event()
+    transfer_task = asyncio.create_task(transfer(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return await transfer_task, elapsed, rejected
+
+
+async def main(logins: int, concurrency: int) -> None:
+    hashed_password = pwd_context.hash('password')
+    hasher = PasswordHasher()
+    try:
+        for name, verify in (
+                ('inline', verify_inline),
+                ('pool', hasher.verify_and_update),
+        ):
+            latencies, elapsed, rejected = await run(
+                verify, logins, concurrency, hashed_password
+            )
+            report(f'{name} chunk', latencies)
+            print(
+                f'{name:>12}: {logins} logins in {elapsed:.2f}s, '
+                f'{rejected} rejected'
+            )
+    finally:
+        hasher.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.concurrency))
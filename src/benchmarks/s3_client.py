@@ -0,0 +1,95 @@
+"""
+Compare small-object GET latency of a per-request S3 client
+with the shared pooled client.
+
+Usage (from the "src" dir):
+    python -m benchmarks.s3_client --requests 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from core.config import app_settings
+from services.boto3 import S3Client, get_s3_client
+
+BENCHMARK_KEY = '_benchmarks/s3_client.bin'
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def get_object(client) -> None:
+    response = await client.get_object(
+        Bucket=app_settings.bucket, Key=BENCHMARK_KEY
+    )
+    body = response['Body']
+    async with body:
+        await body.read()
+
+
+async def get_with_new_client() -> None:
+    async with get_s3_client() as client:
+        await get_object(client)
+
+
+async def run(make_request, requests: int, concurrency: int) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            await make_request()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(timed() for _ in range(requests)))
+    return latencies
+
+
+def report(name: str, latencies: list[float]) -> None:
+    print(
+        f'{name:>12}: '
+        f'p50={percentile(latencies, 50) * 1000:.1f}ms '
+        f'p99={percentile(latencies, 99) * 1000:.1f}ms '
+        f'mean={statistics.mean(latencies) * 1000:.1f}ms'
+    )
+
+
+async def main(requests: int, concurrency: int, size: int) -> None:
+    shared = S3Client()
+    await shared.start()
+    try:
+        await shared.client.put_object(
+            Bucket=app_settings.bucket,
+            Key=BENCHMARK_KEY,
+            Body=os.urandom(size)
+        )
+        report(
+            'per-request',
+            await run(get_with_new_client, requests, concurrency)
+        )
+        report(
+            'shared',
+            await run(
+                lambda: get_object(shared.client), requests, concurrency
+            )
+        )
+        await shared.client.delete_object(
+            Bucket=app_settings.bucket, Key=BENCHMARK_KEY
+        )
+    finally:
+        await shared.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--size', type=int, default=4096)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.size))
@@ -1,14 +1,18 @@
 from datetime import timedelta
+from typing import Literal
 
 from pydantic import PostgresDsn
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+DownloadMode = Literal['stream', 'local', 'presigned']
+
 
 class AppSettings(BaseSettings):
     model_config = SettingsConfigDict(env_file='.env.example')
 
     app_title: str = 'Default_title'
-    echo: bool = True
+    # Log every SQL statement
+    echo: bool = False
 
     postgres_db: str = 'postgres'
     postgres_user: str = 'postgres'
@@ -17,26 +21,122 @@ class AppSettings(BaseSettings):
     postgres_host: str = 'localhost'
     postgres_port: int = 5432
     database_dsn: PostgresDsn | None = None
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    # Seconds to wait for a free connection
+    db_pool_timeout: int = 30
+    # Seconds before a connection is replaced, -1 to keep it forever
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # Prepared statements kept per connection, 0 behind pgbouncer
+    db_statement_cache_size: int = 100
 
     project_host: str = '127.0.0.1'
     project_port: int = 8000
 
     redis_host: str = '127.0.0.1'
     redis_port: int = 6379
+    redis_max_connections: int = 50
+    redis_socket_timeout: float = 5
+    redis_health_check_interval: int = 30
+    # Seconds to keep files metadata in Redis and in-process caches
+    metadata_cache_ttl: int = 60
+    metadata_cache_local_size: int = 1024
+    user_cache_ttl: int = 300
+    # Other workers may see a changed user for that long
+    user_cache_local_ttl: int = 10
+    user_cache_local_size: int = 1024
+    # Last part of metadata_cache_ttl in which readers may refresh an
+    # entry early, the chance grows towards its expiry
+    metadata_cache_early_refresh: float = 0.2
+    # Seconds other workers wait for a worker filling the same cache
+    # entry before loading it themselves
+    singleflight_lock_timeout: float = 10
+    singleflight_poll_interval: float = 0.05
 
     secret: str = 'your-secret-key'
     register_url: str = '/register'
     token_url: str = '/auth'
     token_expires: timedelta = timedelta(minutes=30)
+    bcrypt_rounds: int = 12
+    # Threads hashing passwords and logins waiting for them, requests
+    # over that are rejected with HTTP 429
+    password_hash_workers: int = 4
+    password_hash_queue_size: int = 32
 
     s3_service_name: str = 's3'
     s3_endpoint_url: str = 'https://storage.yandexcloud.net'
     aws_access_key_id: str = 'YOUR_KEY'
     aws_secret_access_key: str = 'YOUR_SECRET_KEY'
     bucket: str = 'YOUR_BUCKET'
+    s3_max_pool_connections: int = 50
+    # Seconds to keep idle S3 connections open for reuse
+    s3_keepalive_timeout: int = 30
+    s3_presigned_expires: int = 300
+    # S3 requires parts of at least 5 MiB except the last one
+    s3_multipart_part_size: int = 8 * 1024 * 1024
+    s3_multipart_concurrency: int = 4
+    # Parallel S3 transfers of one batch upload
+    s3_batch_concurrency: int = 8
+    # Chunks of resumable uploads are held in memory before sent as S3
+    # parts, files needing bigger parts are rejected
+    upload_chunk_max_size: int = 64 * 1024 * 1024
+    # Seconds a resumable upload is kept since its last chunk, expired
+    # multipart uploads are left to the bucket lifecycle rules
+    upload_session_ttl: int = 24 * 60 * 60
 
     local_download_dir: str = '/app/downloads'
     # local_download_dir: str = 'downloads'
+    # Bytes of files cached in local_download_dir for "local" mode
+    local_cache_size: int = 10 * 1024 ** 3
+    # stream: pipe S3 object to the client, local: serve it from the disk
+    # cache filled from S3 on a miss,
+    # presigned: redirect the client to a short-lived S3 URL
+    download_mode: DownloadMode = 'stream'
+    download_chunk_size: int = 1024 * 1024
+    # Files fetched from S3 ahead of the one written into an archive
+    archive_read_ahead: int = 4
+    # Compress stored objects of text types or when a sample of the
+    # first bytes shrinks to the ratio
+    storage_compression: bool = True
+    storage_compression_level: int = 6
+    storage_compression_min_size: int = 1024
+    storage_compression_sample_size: int = 64 * 1024
+    storage_compression_ratio: float = 0.8
+
+    # Bytes per user unless set for the user, 0 is unlimited
+    storage_quota: int = 0
+    # Users recounted by one job of usage reconciliation
+    usage_reconcile_batch_size: int = 500
+    # Files deleted or moved by one job of a bulk operation
+    bulk_batch_size: int = 500
+    # Seconds the status of a bulk operation is kept
+    bulk_operation_ttl: int = 24 * 60 * 60
+    # Seconds between scheduled runs of the bucket inventory, 0 disables
+    inventory_interval: int = 0
+    # Delete orphan objects and fail files missing theirs on schedule
+    inventory_fix: bool = False
+    # Objects newer than this are left alone, their upload may be running
+    inventory_grace_period: int = 24 * 60 * 60
+    # Keys read from the database by one query
+    inventory_batch_size: int = 1000
+
+    # Jobs run at once by each worker process
+    jobs_concurrency: int = 8
+    # Seconds a job may run before it's given to another worker
+    jobs_visibility_timeout: int = 300
+    jobs_max_attempts: int = 5
+    # Seconds before the first retry, doubled for every next one
+    jobs_retry_delay: float = 10
+    jobs_poll_interval: float = 1
+    # Dead jobs kept for inspection, the oldest are dropped over that
+    jobs_dead_max: int = 1000
+    jobs_dead_ttl: int = 7 * 24 * 60 * 60
+    # Seconds between sweeps queueing processing of files again if
+    # they're still "pending" after processing_pending_timeout, 0
+    # disables them
+    processing_sweep_interval: int = 60 * 60
+    processing_pending_timeout: int = 60 * 60
 
 
 app_settings = AppSettings()
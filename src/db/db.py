@@ -1,12 +1,23 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from core.config import app_settings
 
 engine = create_async_engine(
     str(app_settings.database_dsn),
-    echo=app_settings.echo | False,
-    future=True
+    echo=app_settings.echo,
+    future=True,
+    pool_size=app_settings.db_pool_size,
+    max_overflow=app_settings.db_max_overflow,
+    pool_timeout=app_settings.db_pool_timeout,
+    pool_recycle=app_settings.db_pool_recycle,
+    pool_pre_ping=app_settings.db_pool_pre_ping,
+    connect_args={
+        'prepared_statement_cache_size': (
+            app_settings.db_statement_cache_size
+        ),
+    },
 )
 
 async_session = sessionmaker(
@@ -19,3 +30,15 @@ async_session = sessionmaker(
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
+
+
+def get_pool_stats() -> dict[str, int]:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+    }
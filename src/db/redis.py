@@ -0,0 +1,66 @@
+import logging
+
+import aioredis
+from fastapi import HTTPException, status
+
+from core.config import app_settings
+from core.logger import LOGGING
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+
+class RedisClient:
+    """
+    Redis client with one connection pool for the whole application.
+
+    Started on application startup and closed on shutdown.
+    """
+
+    def __init__(self):
+        self.client = None
+
+    async def start(self):
+        self.client = aioredis.from_url(
+            f'redis://{app_settings.redis_host}:{app_settings.redis_port}',
+            encoding='utf8',
+            decode_responses=True,
+            max_connections=app_settings.redis_max_connections,
+            socket_timeout=app_settings.redis_socket_timeout,
+            socket_connect_timeout=app_settings.redis_socket_timeout,
+            health_check_interval=app_settings.redis_health_check_interval,
+        )
+        logger.info('Redis client started.')
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.close()
+            await self.client.connection_pool.disconnect()
+            self.client = None
+            logger.info('Redis client stopped.')
+
+    def get_pool_stats(self) -> dict[str, int]:
+        if self.client is None:
+            return {}
+        pool = self.client.connection_pool
+        return {
+            'max': pool.max_connections,
+            'created': pool._created_connections,
+            'idle': len(pool._available_connections),
+            'in_use': len(pool._in_use_connections),
+        }
+
+
+redis_client = RedisClient()
+
+
+async def get_redis():
+    """
+    Return the shared Redis client.
+    """
+    if redis_client.client is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Redis is not available'
+        )
+    return redis_client.client
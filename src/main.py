@@ -1,29 +1,41 @@
-import aioredis
 import uvicorn
 from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
 
 from api.v1 import base
 from core import logger
 from core.config import app_settings
+from db.redis import redis_client
+from services.boto3 import s3_client
+from services.cache import metadata_cache, user_cache
+from services.disk_cache import disk_cache
+from services.jobs import job_queue
+from services.metrics import MetricsMiddleware
+from services.security import password_hasher
 
 app = FastAPI(
     title=app_settings.app_title,
     default_response_class=ORJSONResponse,
 )
+app.add_middleware(MetricsMiddleware)
 app.include_router(base.router)
 
 
 @app.on_event("startup")
 async def startup():
-    redis = aioredis.from_url(
-        f'redis://{app_settings.redis_host}:{app_settings.redis_port}',
-        encoding='utf8',
-        decode_responses=True
-    )
-    FastAPICache.init(RedisBackend(redis), prefix='fastapi-cache')
+    await redis_client.start()
+    metadata_cache.init(redis_client.client)
+    user_cache.init(redis_client.client)
+    job_queue.init(redis_client.client)
+    await s3_client.start()
+    await disk_cache.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await s3_client.stop()
+    password_hasher.shutdown()
+    await redis_client.stop()
 
 
 if __name__ == '__main__':
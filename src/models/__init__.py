@@ -1,8 +1,11 @@
 __all__ = [
     "Base",
+    "Blob",
     "User",
     "File",
+    "Folder",
+    "Usage",
 ]
 
 from .base import Base
-from .models import File, User
+from .models import Blob, File, Folder, Usage, User
@@ -1,10 +1,13 @@
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
+    collate,
     func,
 )
 from sqlalchemy.orm import relationship
@@ -23,8 +26,98 @@ class User(Base):
     files = relationship('File', backref='user')
 
 
+class Usage(Base):
+    """
+    Totals of all user files kept with the files rows.
+    """
+    __tablename__ = 'usages'
+
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    files_count = Column(Integer, nullable=False, default=0)
+    size = Column(BigInteger, nullable=False, default=0)
+    # Bytes, "storage_quota" setting is used if not set
+    quota = Column(BigInteger)
+
+
+class Blob(Base):
+    """
+    Stored object shared by all files with the same content.
+    """
+    __tablename__ = 'blobs'
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), nullable=False, unique=True)
+    key = Column(String(255), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    # Compression of the stored object, see "services.codecs"
+    codec = Column(String(10))
+    stored_size = Column(BigInteger)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class Folder(Base):
+    """
+    Folder of user files with totals of all nested files.
+    """
+    __tablename__ = 'folders'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False
+    )
+    parent_id = Column(
+        Integer,
+        ForeignKey('folders.id', ondelete='CASCADE'),
+        index=True
+    )
+    # Sized as the path, the name may take most of it
+    name = Column(String(255), nullable=False)
+    # Folder path always ends with "/": <email>/a/b/
+    path = Column(String(255), nullable=False, unique=True)
+    files_count = Column(Integer, nullable=False, default=0)
+    size = Column(BigInteger, nullable=False, default=0)
+
+
 class File(Base):
     __tablename__ = 'files'
+    __table_args__ = (
+        # Keyset pagination of "/files" by each sort option
+        Index('ix_files_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        Index('ix_files_user_id_name_id', 'user_id', 'name', 'id'),
+        Index('ix_files_user_id_size_id', 'user_id', 'size', 'id'),
+        # Path prefix filter with LIKE 'prefix%'
+        Index(
+            'ix_files_user_id_path',
+            'user_id',
+            'path',
+            postgresql_ops={'path': 'varchar_pattern_ops'}
+        ),
+        # Folder listing of "/files/tree"
+        Index('ix_files_folder_id_name', 'folder_id', 'name'),
+        # Substring and fuzzy matching of "/files/search" by trigrams,
+        # needs pg_trgm and btree_gin extensions
+        Index(
+            'ix_files_user_id_name_trgm',
+            'user_id',
+            'name',
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'}
+        ),
+        Index(
+            'ix_files_user_id_path_trgm',
+            'user_id',
+            'path',
+            postgresql_using='gin',
+            postgresql_ops={'path': 'gin_trgm_ops'}
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(
@@ -32,9 +125,38 @@ class File(Base):
         ForeignKey('users.id', ondelete='CASCADE'),
         nullable=False
     )
+    folder_id = Column(
+        Integer,
+        ForeignKey('folders.id', ondelete='SET NULL')
+    )
     name = Column(String(150), nullable=False)
     created_at = Column(DateTime, server_default=func.now())
 
     path = Column(String(255), nullable=False, unique=True)
-    size = Column(Integer, nullable=False)
+    size = Column(BigInteger, nullable=False)
     is_downloadable = Column(Boolean, default=True)
+
+    # S3 key of the content, files without it are stored by their path
+    key = Column(String(255))
+    sha256 = Column(String(64))
+    blob_id = Column(Integer, ForeignKey('blobs.id'), index=True)
+    # Codec and size of the stored object, "size" is the original one
+    codec = Column(String(10))
+    stored_size = Column(BigInteger)
+
+    # pending, processing, ready or failed, see "services.processing"
+    processing_status = Column(
+        String(20), nullable=False, default='pending', server_default='ready'
+    )
+
+
+# Storage inventory reads the keys in the byte order of S3 listings,
+# the "C" collation, see "services.inventory"
+Index(
+    'ix_blobs_key', collate(Blob.key, 'C')
+).ddl_if(dialect='postgresql')
+Index(
+    'ix_files_storage_key',
+    collate(func.coalesce(File.key, File.path), 'C'),
+    postgresql_where=File.blob_id.is_(None)
+).ddl_if(dialect='postgresql')
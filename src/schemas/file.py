@@ -1,7 +1,14 @@
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Literal
 
+from fastapi import Query
 from pydantic import BaseModel, ConfigDict
 
+ProcessingStatus = Literal['pending', 'processing', 'ready', 'failed']
+# Compression of stored objects, see "services.codecs"
+Codec = Literal['gzip']
+
 
 class FileUpload(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -10,6 +17,10 @@ class FileUpload(BaseModel):
     name: str
     path: str
     size: int
+    sha256: str | None = None
+    key: str | None = None
+    codec: Codec | None = None
+    stored_size: int | None = None
 
 
 class FileResponse(BaseModel):
@@ -21,8 +32,89 @@ class FileResponse(BaseModel):
     path: str
     size: int
     is_downloadable: bool
+    sha256: str | None = None
+    processing_status: ProcessingStatus = 'ready'
 
 
 class UserFilesResponse(BaseModel):
     account_id: int
     files: list[FileResponse]
+    next_cursor: str | None = None
+
+
+@dataclass
+class FilesFilter:
+    limit: int = Query(100, ge=1, le=1000)
+    cursor: str | None = Query(None, description='"next_cursor" value')
+    path_prefix: str | None = None
+    name: str | None = Query(None, description='Pattern with * and ?')
+    size_min: int | None = None
+    size_max: int | None = None
+    created_from: datetime | None = None
+    created_to: datetime | None = None
+    order_by: Literal['created_at', 'name', 'size'] = 'created_at'
+    order: Literal['asc', 'desc'] = 'asc'
+
+
+@dataclass
+class FilesSearch(FilesFilter):
+    q: str = Query(min_length=1, max_length=255, description='Text to find')
+    # Fuzzy matches are ordered by similarity, not by "order_by"
+    match: Literal['substring', 'prefix', 'fuzzy'] = 'substring'
+    field: Literal['name', 'path'] = 'name'
+
+
+class BatchUploadResult(BaseModel):
+    name: str
+    path: str
+    status: int
+    detail: str | None = None
+    file: FileResponse | None = None
+
+
+class BatchUploadResponse(BaseModel):
+    files: list[BatchUploadResult]
+
+
+class PresignedUploadResponse(BaseModel):
+    # Upload to complete, "upload_id" is the one of S3 multipart upload
+    id: str
+    path: str
+    upload_id: str | None = None
+    urls: list[str]
+    expires_in: int
+
+
+class UploadedPart(BaseModel):
+    part_number: int
+    etag: str
+
+
+class PresignedUploadComplete(BaseModel):
+    # "id" of the presigned upload
+    id: str
+    parts: list[UploadedPart] = []
+
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    path: str
+    size: int
+    # Length of the uploaded prefix of the file
+    offset: int
+    # Every chunk but the last one must be of this size
+    part_size: int
+    expires_in: int
+
+
+class FilesSelection(BaseModel):
+    ids: list[int] = []
+    # Full paths as in "/files/download"
+    paths: list[str] = []
+    # All files under the path, e.g. of a folder "<email>/a/"
+    prefix: str | None = None
+
+
+class FilesMove(FilesSelection):
+    # Folder path ending with "/" or the new path of one file
+    to: str
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, ConfigDict
+
+from schemas.file import FileResponse
+
+
+class FolderResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: str
+    path: str
+    files_count: int
+    size: int
+
+
+class FolderTreeResponse(BaseModel):
+    folder: FolderResponse
+    folders: list[FolderResponse]
+    files: list[FileResponse]
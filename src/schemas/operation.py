@@ -0,0 +1,16 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+OperationAction = Literal['delete', 'move']
+OperationStatus = Literal['pending', 'running', 'done', 'failed']
+
+
+class OperationResponse(BaseModel):
+    id: str
+    action: OperationAction
+    status: OperationStatus
+    # Files deleted or moved so far
+    processed: int = 0
+    # Files not moved as their new paths are taken
+    skipped: int = 0
@@ -4,3 +4,5 @@ from pydantic import BaseModel
 class Ping(BaseModel):
     db: float | str
     cache: float | str
+    # Connections usage of the pools by service
+    pools: dict[str, dict[str, int]] = {}
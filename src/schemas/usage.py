@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+
+
+class UsageResponse(BaseModel):
+    files_count: int
+    size: int
+    # Bytes, None if unlimited
+    quota: int | None = None
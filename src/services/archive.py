@@ -0,0 +1,107 @@
+import asyncio
+import io
+import tarfile
+import zipfile
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Literal, NamedTuple
+
+ArchiveFormat = Literal['zip', 'tar', 'tgz']
+
+ARCHIVE_MEDIA_TYPES = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+    'tgz': 'application/gzip',
+}
+ARCHIVE_EXTENSIONS = {'zip': '.zip', 'tar': '.tar', 'tgz': '.tar.gz'}
+
+
+class ArchiveEntry(NamedTuple):
+    name: str
+    size: int
+    modified: datetime
+    chunks: AsyncIterator[bytes]
+
+
+class _StreamWriter(io.RawIOBase):
+    """
+    Unseekable sink collecting everything "zipfile" writes.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+async def iter_zip(entries: AsyncIterator[ArchiveEntry]):
+    """
+    Stream entries as a zip archive.
+
+    The output is not seekable, so "zipfile" writes sizes and CRC after
+    each entry data and nothing is buffered beyond a single chunk.
+    """
+    writer = _StreamWriter()
+    with zipfile.ZipFile(
+            writer, mode='w', compression=zipfile.ZIP_DEFLATED
+    ) as archive:
+        async for entry in entries:
+            # Zip dates can't be older than 1980
+            modified = max(entry.modified, datetime(1980, 1, 1))
+            info = zipfile.ZipInfo(
+                entry.name, date_time=modified.timetuple()[:6]
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.file_size = entry.size
+            with archive.open(info, mode='w') as dest:
+                async for chunk in entry.chunks:
+                    # Deflate off the event loop
+                    await asyncio.to_thread(dest.write, chunk)
+                    if data := writer.drain():
+                        yield data
+            if data := writer.drain():
+                yield data
+    yield writer.drain()
+
+
+async def iter_tar(entries: AsyncIterator[ArchiveEntry], compress=False):
+    """
+    Stream entries as a tar archive, gzip compressed if requested.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor else data
+
+    async for entry in entries:
+        info = tarfile.TarInfo(entry.name)
+        info.size = entry.size
+        info.mtime = int(entry.modified.timestamp())
+        info.mode = 0o644
+        yield encode(info.tobuf(format=tarfile.PAX_FORMAT))
+        async for chunk in entry.chunks:
+            yield encode(chunk)
+        yield encode(tarfile.NUL * (-entry.size % tarfile.BLOCKSIZE))
+
+    # End of archive: two empty blocks
+    yield encode(tarfile.NUL * 2 * tarfile.BLOCKSIZE)
+    if compressor:
+        yield compressor.flush()
+
+
+def iter_archive(
+        entries: AsyncIterator[ArchiveEntry], archive_format: ArchiveFormat
+):
+    if archive_format == 'zip':
+        return iter_zip(entries)
+    return iter_tar(entries, compress=archive_format == 'tgz')
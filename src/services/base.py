@@ -1,16 +1,62 @@
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from sqlalchemy import select, update
+from sqlalchemy import event, insert, literal, select, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
 
+from db.db import async_session
 from models.base import Base
+from services.singleflight import SingleFlight
 
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
+# Lookups of all repositories in flight, keyed by table, column, value
+lookups = SingleFlight()
+# Session info key set while its transaction has written something
+WRITES_KEY = 'has_writes'
+
+
+@event.listens_for(Session, 'after_flush')
+def _flushed(session: Session, flush_context) -> None:
+    session.info[WRITES_KEY] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _executed(orm_execute_state) -> None:
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info[WRITES_KEY] = True
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _ended(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        session.info.pop(WRITES_KEY, None)
+
+
+def has_changes(db: AsyncSession) -> bool:
+    """
+    Check if the session has changes others must not see.
+
+    Flushed and executed writes count until the transaction ends.
+    """
+    return bool(
+        db.new or db.dirty or db.deleted or db.info.get(WRITES_KEY)
+    )
+
 
 class Repository:
 
@@ -37,19 +83,51 @@ class RepositoryDB(
     def __init__(self, model: Type[ModelType]):
         self._model = model
 
+    async def get_one_by(
+            self, db: AsyncSession, name: str, value: Any
+    ) -> Optional[ModelType]:
+        """
+        Return the object by a unique column.
+
+        Identical lookups in flight share one query on a session of its
+        own, so it outlives any caller, each session gets its own
+        instance of the row. Sessions with changes query alone, they
+        must see them and others must not.
+        """
+        column = getattr(self._model, name)
+        if has_changes(db):
+            statement = select(self._model).where(column == value)
+            results = await db.execute(statement=statement)
+            return results.scalar_one_or_none()
+
+        async def load():
+            statement = (
+                select(*self._model.__table__.columns).
+                where(column == value)
+            )
+            async with async_session() as session:
+                results = await session.execute(statement=statement)
+                row = results.mappings().one_or_none()
+            return dict(row) if row is not None else None
+
+        values = await lookups.do(
+            (self._model.__tablename__, name, value), load
+        )
+        if values is None:
+            return None
+        db_obj = self._model(**values)
+        make_transient_to_detached(db_obj)
+        return await db.merge(db_obj, load=False)
+
     async def get(
             self, db: AsyncSession, id: Any
     ) -> Optional[ModelType]:
-        statement = select(self._model).where(self._model.id == id)
-        results = await db.execute(statement=statement)
-        return results.scalar_one_or_none()
+        return await self.get_one_by(db, 'id', id)
 
     async def get_by_path(
             self, db: AsyncSession, path: Any
     ) -> Optional[ModelType]:
-        statement = select(self._model).where(self._model.path == path)
-        results = await db.execute(statement=statement)
-        return results.scalar_one_or_none()
+        return await self.get_one_by(db, 'path', path)
 
     async def get_multi_by_user_id(
             self, db: AsyncSession, user_id: Any, *, skip=0, limit=100
@@ -63,8 +141,74 @@ class RepositoryDB(
         results = await db.execute(statement=statement)
         return results.scalars().all()
 
+    async def get_page_by_user_id(
+            self,
+            db: AsyncSession,
+            user_id: Any,
+            *clauses,
+            order_by: str = 'created_at',
+            descending: bool = False,
+            after: Optional[tuple] = None,
+            limit: int = 100
+    ) -> List[ModelType]:
+        """
+        Return a page of user objects with the keyset pagination.
+
+        "after" is the (order_by, id) key of the last row of the previous
+        page, so any page costs the same as the first one.
+        """
+        column = getattr(self._model, order_by)
+        key = tuple_(column, self._model.id)
+        statement = (
+            select(self._model).
+            where(self._model.user_id == user_id, *clauses)
+        )
+        if after is not None:
+            after_key = tuple_(
+                literal(after[0], column.type),
+                literal(after[1], self._model.id.type)
+            )
+            statement = statement.where(
+                key < after_key if descending else key > after_key
+            )
+        if descending:
+            statement = statement.order_by(
+                column.desc(), self._model.id.desc()
+            )
+        else:
+            statement = statement.order_by(column, self._model.id)
+        results = await db.execute(statement=statement.limit(limit))
+        return results.scalars().all()
+
+    async def iter_by_user_id(
+            self, db: AsyncSession, user_id: Any, *clauses, batch_size=500
+    ) -> AsyncIterator[ModelType]:
+        """
+        Iterate over user objects by batches ordered by id.
+        """
+        last_id = 0
+        while True:
+            statement = (
+                select(self._model).
+                where(self._model.user_id == user_id,
+                      self._model.id > last_id,
+                      *clauses).
+                order_by(self._model.id).
+                limit(batch_size)
+            )
+            results = await db.execute(statement=statement)
+            db_objs = results.scalars().all()
+            for db_obj in db_objs:
+                yield db_obj
+            if len(db_objs) < batch_size:
+                return
+            last_id = db_objs[-1].id
+
     async def create(
-            self, db: AsyncSession, *, obj_in: CreateSchemaType
+            self,
+            db: AsyncSession,
+            *,
+            obj_in: Union[CreateSchemaType, Dict[str, Any]]
     ) -> ModelType:
         obj_in_data = jsonable_encoder(obj_in)
         db_obj = self._model(**obj_in_data)
@@ -73,6 +217,32 @@ class RepositoryDB(
         await db.refresh(db_obj)
         return db_obj
 
+    async def create_multi(
+            self,
+            db: AsyncSession,
+            *,
+            objs_in: List[Union[CreateSchemaType, Dict[str, Any]]]
+    ) -> List[ModelType]:
+        if not objs_in:
+            return []
+        statement = insert(self._model).returning(self._model)
+        results = await db.scalars(
+            statement, [jsonable_encoder(obj_in) for obj_in in objs_in]
+        )
+        db_objs = results.all()
+        await db.commit()
+        return db_objs
+
+    async def get_existing_paths(
+            self, db: AsyncSession, paths: List[str]
+    ) -> List[str]:
+        statement = (
+            select(self._model.path).
+            where(self._model.path.in_(paths))
+        )
+        results = await db.execute(statement=statement)
+        return results.scalars().all()
+
     async def update(
             self,
             db: AsyncSession,
@@ -80,17 +250,25 @@ class RepositoryDB(
             db_obj: ModelType,
             obj_in: Union[UpdateSchemaType, Dict[str, Any]]
     ) -> ModelType:
+        if isinstance(obj_in, dict):
+            obj_in_data = obj_in
+        else:
+            obj_in_data = obj_in.model_dump(exclude_unset=True)
         statement = (
             update(self._model).
             where(self._model.id == db_obj.id).
-            values(obj_in.model_dump(exclude_unset=True)).
+            values(obj_in_data).
             returning(self._model)
         )
         await db.execute(statement=statement)
         await db.commit()
         return db_obj
 
-    async def delete(self, db: AsyncSession, *, id: int) -> ModelType:
-        db_obj = db.get(self._model, id)
-        await db.delete(db_obj)
+    async def delete(
+            self, db: AsyncSession, *, id: int
+    ) -> Optional[ModelType]:
+        db_obj = await db.get(self._model, id)
+        if db_obj is not None:
+            await db.delete(db_obj)
+            await db.commit()
         return db_obj
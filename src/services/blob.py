@@ -0,0 +1,151 @@
+import hashlib
+import uuid
+from typing import Any, AsyncIterator, List, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import Blob as BlobModel
+
+from .base import RepositoryDB
+
+
+def get_blob_key(sha256: str) -> str:
+    """
+    Return a new S3 key for an upload of the content.
+
+    Each upload writes its own object, so concurrent uploads of the
+    same content with different codecs can't overwrite each other and
+    a blob key always holds the object its codec was chosen for.
+    """
+    return f'blobs/{sha256[:2]}/{sha256}/{uuid.uuid4().hex}'
+
+
+def get_sha256(file: Any, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Return SHA-256 of a file object and rewind it.
+    """
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    while chunk := file.read(chunk_size):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+async def hash_chunks(
+        chunks: AsyncIterator[bytes], sha256
+) -> AsyncIterator[bytes]:
+    """
+    Pass chunks through, updating the hash object with them.
+    """
+    async for chunk in chunks:
+        sha256.update(chunk)
+        yield chunk
+
+
+class RepositoryBlob(RepositoryDB[BlobModel, Any, Any]):
+    """
+    Content-addressed blobs with reference counts.
+
+    References are changed in the caller transaction together with
+    the files rows.
+    """
+
+    async def get_multi_by_sha256(
+            self, db: AsyncSession, sha256_list: List[str]
+    ) -> List[BlobModel]:
+        """
+        Return the blobs of the contents.
+
+        A concurrent delete may release them until they're acquired.
+        """
+        statement = (
+            select(self._model).
+            where(self._model.sha256.in_(sha256_list))
+        )
+        results = await db.execute(statement=statement)
+        return results.scalars().all()
+
+    async def _add_refs(
+            self, db: AsyncSession, sha256: str, count: int
+    ) -> Optional[BlobModel]:
+        statement = (
+            update(self._model).
+            where(self._model.sha256 == sha256).
+            values(ref_count=self._model.ref_count + count).
+            returning(self._model)
+        )
+        results = await db.execute(statement=statement)
+        return results.scalar_one_or_none()
+
+    async def acquire(
+            self,
+            db: AsyncSession,
+            *,
+            sha256: str,
+            size: int,
+            key: Optional[str],
+            count: int = 1,
+            codec: Optional[str] = None,
+            stored_size: Optional[int] = None
+    ) -> BlobModel:
+        """
+        Reference the blob with the content, creating it if missing.
+
+        The returned blob key and codec differ from the passed ones when
+        the same content is already stored under another key. Without
+        a key the blob must exist, LookupError is raised otherwise.
+        """
+        blob = await self._add_refs(db, sha256, count)
+        if blob is not None:
+            return blob
+        if key is None:
+            raise LookupError(f'Blob {sha256} is not stored')
+        blob = self._model(
+            sha256=sha256,
+            size=size,
+            key=key,
+            ref_count=count,
+            codec=codec,
+            stored_size=stored_size
+        )
+        try:
+            async with db.begin_nested():
+                db.add(blob)
+        except IntegrityError:
+            # Created by a concurrent upload
+            blob = await self._add_refs(db, sha256, count)
+        return blob
+
+    async def release(
+            self, db: AsyncSession, *, id: int, count: int = 1
+    ) -> Optional[BlobModel]:
+        """
+        Drop references to the blob, return it if it's no longer used.
+        """
+        statement = (
+            update(self._model).
+            where(self._model.id == id).
+            values(ref_count=self._model.ref_count - count).
+            returning(self._model)
+        )
+        results = await db.execute(statement=statement)
+        blob = results.scalar_one_or_none()
+        if blob is not None and blob.ref_count <= 0:
+            return blob
+        return None
+
+    async def delete_unused(self, db: AsyncSession, ids: List[int]) -> None:
+        """
+        Delete the blobs left without references, without commit.
+        """
+        statement = (
+            delete(self._model).
+            where(self._model.id.in_(ids), self._model.ref_count <= 0)
+        )
+        await db.execute(statement=statement)
+
+
+blob_crud = RepositoryBlob(BlobModel)
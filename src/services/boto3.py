@@ -1,6 +1,7 @@
 import logging
 
 import aioboto3
+from aiobotocore.config import AioConfig
 from fastapi import HTTPException, status
 
 from core.config import app_settings
@@ -10,14 +11,27 @@ logging.basicConfig = LOGGING
 logger = logging.getLogger()
 
 
-def get_s3_client():
-    session = aioboto3.session.Session()
+def get_s3_config() -> AioConfig:
+    return AioConfig(
+        max_pool_connections=app_settings.s3_max_pool_connections,
+        connector_args={
+            'keepalive_timeout': app_settings.s3_keepalive_timeout
+        },
+    )
+
+
+def get_s3_client(session: aioboto3.Session | None = None):
+    """
+    Return a new S3 client context manager.
+    """
+    session = session or aioboto3.Session()
     try:
         return session.client(
             service_name=app_settings.s3_service_name,
             endpoint_url=app_settings.s3_endpoint_url,
             aws_access_key_id=app_settings.aws_access_key_id,
             aws_secret_access_key=app_settings.aws_secret_access_key,
+            config=get_s3_config(),
         )
     except Exception as err:
         logger.error(err)
@@ -25,3 +39,44 @@ def get_s3_client():
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f'Error: {err}'
         )
+
+
+class S3Client:
+    """
+    Long-lived S3 client with a shared connection pool.
+
+    Started on application startup and closed on shutdown, so requests
+    reuse credentials, endpoint setup and open connections.
+    """
+
+    def __init__(self):
+        self._session = aioboto3.Session()
+        self._context = None
+        self.client = None
+
+    async def start(self):
+        self._context = get_s3_client(self._session)
+        self.client = await self._context.__aenter__()
+        logger.info('S3 client started.')
+
+    async def stop(self):
+        if self._context is not None:
+            await self._context.__aexit__(None, None, None)
+            self._context = None
+            self.client = None
+            logger.info('S3 client stopped.')
+
+
+s3_client = S3Client()
+
+
+async def get_s3():
+    """
+    Return the shared S3 client.
+    """
+    if s3_client.client is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='S3 storage is not available'
+        )
+    return s3_client.client
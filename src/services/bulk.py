@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import uuid
+
+from fastapi import HTTPException, status
+from sqlalchemy import or_, select, union
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import app_settings
+from core.logger import LOGGING
+from db.db import async_session
+from models.models import Blob as BlobModel
+from models.models import File as FileModel
+from schemas.file import FilesMove, FilesSelection
+from schemas.operation import OperationAction, OperationResponse
+from services.boto3 import s3_client
+from services.cache import metadata_cache
+from services.file import file_crud
+from services.folder import folder_crud
+from services.jobs import job_queue
+from services.metrics import S3_ERRORS
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+# S3 limit of keys deleted by one request
+DELETE_OBJECTS_LIMIT = 1000
+
+
+def get_operation_key(operation_id: str) -> str:
+    return f'operations:{operation_id}'
+
+
+def get_pending_key(operation_id: str) -> str:
+    return f'operations:{operation_id}:keys'
+
+
+def get_batches_key(operation_id: str) -> str:
+    return f'operations:{operation_id}:batches'
+
+
+def get_selection_clause(payload: dict):
+    """
+    Return filter of the files selected by ids, paths or path prefix.
+    """
+    clauses = []
+    if payload.get('ids'):
+        clauses.append(FileModel.id.in_(payload['ids']))
+    if payload.get('paths'):
+        clauses.append(FileModel.path.in_(payload['paths']))
+    if payload.get('prefix'):
+        clauses.append(
+            FileModel.path.startswith(payload['prefix'], autoescape=True)
+        )
+    return or_(*clauses)
+
+
+def get_new_path(file_obj: FileModel, payload: dict) -> str:
+    to = payload['to']
+    if payload.get('prefix'):
+        return to + file_obj.path[len(payload['prefix']):]
+    if to.endswith('/'):
+        return to + file_obj.name
+    return to
+
+
+def check_selection(selection: FilesSelection) -> None:
+    if not (selection.ids or selection.paths or selection.prefix):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Files are not selected'
+        )
+
+
+def check_move(data: FilesMove, user) -> None:
+    """
+    Reject moves out of the user root and ambiguous ones.
+    """
+    check_selection(data)
+    root = f'{user.email}/'
+    if not data.to.startswith(root):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Path must start with {root}'
+        )
+    if data.prefix is None:
+        if not data.to.endswith('/') and len(data.ids + data.paths) > 1:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Several files can only be moved to a folder'
+            )
+        return
+    if data.ids or data.paths:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Move either a folder or files'
+        )
+    if not data.prefix.endswith('/') or not data.to.endswith('/'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Folder paths must end with "/"'
+        )
+    if data.to.startswith(data.prefix):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Folder cannot be moved into itself'
+        )
+
+
+async def start_operation(
+        action: OperationAction, payload: dict, user, redis
+) -> OperationResponse:
+    operation_id = uuid.uuid4().hex
+    key = get_operation_key(operation_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={
+            'user_id': user.id,
+            'action': action,
+            'status': 'pending',
+        })
+        pipe.expire(key, app_settings.bulk_operation_ttl)
+        await pipe.execute()
+
+    payload = {**payload, 'operation_id': operation_id, 'user_id': user.id}
+    if await job_queue.enqueue(f'{action}_files', payload) is None:
+        await redis.delete(key)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Job queue is not available'
+        )
+    logger.info(f'Start {action} operation {operation_id} of {user.email}')
+    return OperationResponse(id=operation_id, action=action, status='pending')
+
+
+async def delete_files(
+        selection: FilesSelection, user, redis
+) -> OperationResponse:
+    """
+    Start deleting the selected files in background jobs.
+    """
+    check_selection(selection)
+    return await start_operation('delete', selection.model_dump(), user, redis)
+
+
+async def move_files(data: FilesMove, user, redis) -> OperationResponse:
+    """
+    Start moving the selected files in background jobs.
+    """
+    check_move(data, user)
+    return await start_operation('move', data.model_dump(), user, redis)
+
+
+async def get_operation(
+        operation_id: str, user, redis
+) -> OperationResponse:
+    operation = await redis.hgetall(get_operation_key(operation_id))
+    if not operation or int(operation['user_id']) != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Operation not found'
+        )
+    processed = skipped = 0
+    for counts in await redis.hvals(get_batches_key(operation_id)):
+        batch_processed, batch_skipped = counts.split(':')
+        processed += int(batch_processed)
+        skipped += int(batch_skipped)
+    return OperationResponse(
+        id=operation_id, **operation, processed=processed, skipped=skipped
+    )
+
+
+async def select_batch(db: AsyncSession, payload: dict) -> list[FileModel]:
+    statement = (
+        select(FileModel).
+        where(FileModel.user_id == payload['user_id'],
+              FileModel.id > payload.get('after', 0),
+              get_selection_clause(payload)).
+        order_by(FileModel.id).
+        limit(app_settings.bulk_batch_size).
+        with_for_update()
+    )
+    return (await db.scalars(statement)).all()
+
+
+async def get_used_keys(db: AsyncSession, keys: list[str]) -> set[str]:
+    """
+    Return the S3 keys still referenced by files or blobs.
+    """
+    statement = union(
+        select(FileModel.key).where(FileModel.key.in_(keys)),
+        select(FileModel.path).
+        where(FileModel.key.is_(None), FileModel.path.in_(keys)),
+        select(BlobModel.key).where(BlobModel.key.in_(keys)),
+    )
+    return set((await db.scalars(statement)).all())
+
+
+async def delete_s3_objects(s3, keys: list[str]) -> None:
+    """
+    Delete the objects by requests of up to 1000 keys, concurrently.
+
+    Raise if any of them is not deleted.
+    """
+    semaphore = asyncio.Semaphore(app_settings.s3_batch_concurrency)
+
+    async def delete_batch(batch: list[str]) -> None:
+        async with semaphore:
+            response = await s3.delete_objects(
+                Bucket=app_settings.bucket,
+                Delete={
+                    'Objects': [{'Key': key} for key in batch],
+                    'Quiet': True,
+                }
+            )
+        if errors := response.get('Errors'):
+            S3_ERRORS.inc(operation='delete')
+            raise RuntimeError(
+                f'{len(errors)} objects are not deleted: {errors[0]}'
+            )
+
+    await asyncio.gather(*(
+        delete_batch(keys[i:i + DELETE_OBJECTS_LIMIT])
+        for i in range(0, len(keys), DELETE_OBJECTS_LIMIT)
+    ))
+
+
+async def delete_unused_objects(pending_key: str) -> None:
+    """
+    Delete S3 objects of the pending set no longer referenced in DB.
+
+    Keys of a rolled back batch are still referenced and only dropped
+    from the set, the batch adds them again on retry.
+    """
+    keys = list(await job_queue.redis.smembers(pending_key))
+    if not keys:
+        return
+    async with async_session() as db:
+        used_keys = await get_used_keys(db, keys)
+    await delete_s3_objects(
+        s3_client.client, [key for key in keys if key not in used_keys]
+    )
+    await job_queue.redis.srem(pending_key, *keys)
+
+
+def count_batch(
+        pipe, payload: dict, file_objs: list[FileModel], skipped: int = 0
+) -> None:
+    """
+    Save the counts of the batch in the pipeline, call before commit.
+
+    Batches are keyed by their last file, so a batch retried before or
+    after its commit overwrites its counts instead of adding them twice.
+    """
+    if not file_objs:
+        return
+    key = get_batches_key(payload['operation_id'])
+    pipe.hset(
+        key, str(file_objs[-1].id), f'{len(file_objs) - skipped}:{skipped}'
+    )
+    pipe.expire(key, app_settings.bulk_operation_ttl)
+
+
+async def continue_operation(
+        name: str, payload: dict, file_objs: list[FileModel]
+) -> None:
+    """
+    Queue the next batch or finish the operation.
+    """
+    done = len(file_objs) < app_settings.bulk_batch_size
+    await job_queue.redis.hset(
+        get_operation_key(payload['operation_id']),
+        'status', 'done' if done else 'running'
+    )
+    if done:
+        logger.info(f'Operation {payload["operation_id"]} is done')
+        return
+    payload = {**payload, 'after': file_objs[-1].id}
+    if await job_queue.enqueue(name, payload) is None:
+        # Retried from the same batch, which is idempotent
+        raise RuntimeError(f'Job {name} is not queued')
+
+
+async def mark_operation_failed(payload: dict) -> None:
+    await job_queue.redis.hset(
+        get_operation_key(payload['operation_id']), 'status', 'failed'
+    )
+
+
+@job_queue.handler('delete_files', on_dead=mark_operation_failed)
+async def run_delete(payload: dict) -> None:
+    """
+    Delete a batch of the selected files and queue the next one.
+    """
+    pending_key = get_pending_key(payload['operation_id'])
+    # Objects of a batch committed before the job failed
+    await delete_unused_objects(pending_key)
+
+    async with async_session() as db:
+        file_objs = await select_batch(db, payload)
+        keys = await file_crud.delete_multi(db, db_objs=file_objs)
+        if payload.get('prefix'):
+            await folder_crud.delete_empty(
+                db, payload['user_id'], payload['prefix']
+            )
+        # Saved before commit, so a failure can't leave them behind
+        async with job_queue.redis.pipeline(transaction=True) as pipe:
+            if keys:
+                pipe.sadd(pending_key, *keys)
+                pipe.expire(pending_key, app_settings.bulk_operation_ttl)
+            count_batch(pipe, payload, file_objs)
+            await pipe.execute()
+        await db.commit()
+    await metadata_cache.invalidate(payload['user_id'])
+
+    await delete_unused_objects(pending_key)
+    await continue_operation('delete_files', payload, file_objs)
+
+
+@job_queue.handler('move_files', on_dead=mark_operation_failed)
+async def run_move(payload: dict) -> None:
+    """
+    Move a batch of the selected files and queue the next one.
+
+    Files whose new paths are taken are skipped.
+    """
+    async with async_session() as db:
+        file_objs = await select_batch(db, payload)
+        new_paths = [get_new_path(file_obj, payload) for file_obj in file_objs]
+        taken_paths = set(
+            await file_crud.get_existing_paths(db=db, paths=new_paths)
+        )
+        moves = []
+        skipped = 0
+        for file_obj, path in zip(file_objs, new_paths):
+            if path == file_obj.path:
+                # Moved by a failed run of the job
+                continue
+            if path in taken_paths:
+                skipped += 1
+                continue
+            taken_paths.add(path)
+            moves.append((file_obj, path))
+        await file_crud.move_multi(db, moves=moves)
+        if payload.get('prefix'):
+            await folder_crud.delete_empty(
+                db, payload['user_id'], payload['prefix']
+            )
+        async with job_queue.redis.pipeline(transaction=True) as pipe:
+            count_batch(pipe, payload, file_objs, skipped)
+            await pipe.execute()
+        await db.commit()
+    await metadata_cache.invalidate(payload['user_id'])
+
+    await continue_operation('move_files', payload, file_objs)
@@ -0,0 +1,314 @@
+import json
+import logging
+import random
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import DateTime
+
+from core.config import app_settings
+from core.logger import LOGGING
+from models.base import Base
+from services.metrics import CACHE_REQUESTS
+from services.singleflight import RedisSingleFlight
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+
+def dump_row(obj: Base) -> dict:
+    """
+    Return JSON-ready column values of the model instance.
+    """
+    return jsonable_encoder({
+        column.name: getattr(obj, column.name)
+        for column in obj.__table__.columns
+    })
+
+
+def load_row(model: Type[Base], data: dict) -> Base:
+    """
+    Build a detached model instance from "dump_row" values.
+    """
+    values = dict(data)
+    for column in model.__table__.columns:
+        if isinstance(column.type, DateTime) and values.get(column.name):
+            values[column.name] = datetime.fromisoformat(values[column.name])
+    return model(**values)
+
+
+class LRUCache:
+    """
+    In-process least recently used cache, entries expire after ttl.
+
+    With jitter entries live up to that part of ttl less, so entries
+    set at once don't expire at once.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, jitter: float = 0):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._jitter = jitter
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        ttl = self._ttl * (1 - self._jitter * random.random())
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class MetadataCache:
+    """
+    Two-tier cache of user files metadata: in-process LRU over Redis.
+
+    Keys include the version of the user files. Any write replaces the
+    version, so entries loaded before the write are never read again
+    and simply expire. The version is always read from Redis, which
+    keeps the local tiers of all processes consistent.
+
+    A miss is loaded once by all processes. Readers refresh entries
+    before they expire, so popular ones never miss.
+    """
+
+    def __init__(
+            self,
+            *,
+            ttl: int = app_settings.metadata_cache_ttl,
+            local_size: int = app_settings.metadata_cache_local_size,
+            early_refresh: float = app_settings.metadata_cache_early_refresh
+    ):
+        self.redis = None
+        self._ttl = ttl
+        self._early_refresh = early_refresh
+        self._local = LRUCache(local_size, ttl, jitter=early_refresh)
+        self._flight = RedisSingleFlight('singleflight:metadata')
+
+    def init(self, redis) -> None:
+        self.redis = redis
+        self._local.clear()
+        self._flight.init(redis)
+
+    @staticmethod
+    def _version_key(user_id: int) -> str:
+        return f'metadata:{user_id}:version'
+
+    async def _get_version(self, user_id: int) -> str:
+        key = self._version_key(user_id)
+        version = await self.redis.get(key)
+        if version is None:
+            # Never reuse a version, even when its key was evicted
+            version = uuid.uuid4().hex
+            if not await self.redis.set(key, version, nx=True):
+                version = await self.redis.get(key)
+        return version
+
+    def _should_refresh(self, pttl: int) -> bool:
+        """
+        Decide if the entry expiring in pttl ms is refreshed now.
+
+        The chance grows from zero at the start of the early refresh
+        window to one at the expiry.
+        """
+        window = self._ttl * self._early_refresh * 1000
+        return 0 <= pttl < window * random.random()
+
+    async def _fill(
+            self, key: str, load: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Optional[Any]:
+        value = await load()
+        if value is None:
+            return None
+        try:
+            await self.redis.set(key, json.dumps(value), ex=self._ttl)
+        except Exception as err:
+            logger.error(f'{err}')
+        return value
+
+    async def _refresh(
+            self,
+            key: str,
+            value: Any,
+            load: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Optional[Any]:
+        """
+        Reload the entry in one process, others keep the current value.
+        """
+        window_ms = int(self._ttl * self._early_refresh * 1000)
+        try:
+            refreshing = await self.redis.set(
+                f'{key}:refresh', 1, nx=True, px=max(window_ms, 1)
+            )
+        except Exception as err:
+            logger.error(f'{err}')
+            refreshing = False
+        if not refreshing:
+            CACHE_REQUESTS.inc(cache='metadata', tier='redis')
+            return value
+        CACHE_REQUESTS.inc(cache='metadata', tier='refresh')
+        return await self._fill(key, load)
+
+    async def get_or_load(
+            self,
+            user_id: int,
+            name: str,
+            load: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Optional[Any]:
+        """
+        Return cached JSON-ready value or the one returned by "load".
+
+        None values are not cached, without Redis nothing is cached.
+        """
+        if self.redis is None:
+            return await load()
+        try:
+            version = await self._get_version(user_id)
+            key = f'metadata:{user_id}:{version}:{name}'
+            value = self._local.get(key)
+            if value is not None:
+                CACHE_REQUESTS.inc(cache='metadata', tier='local')
+                return value
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                data, pttl = await pipe.execute()
+        except Exception as err:
+            logger.error(f'{err}')
+            return await load()
+
+        if data is not None:
+            value = json.loads(data)
+            if self._should_refresh(pttl):
+                value = await self._refresh(key, value, load)
+            else:
+                CACHE_REQUESTS.inc(cache='metadata', tier='redis')
+        else:
+            CACHE_REQUESTS.inc(cache='metadata', tier='miss')
+            value = await self._flight.do(key, lambda: self._fill(key, load))
+        if value is None:
+            return None
+        self._local.set(key, value)
+        return value
+
+    async def invalidate(self, user_id: int) -> None:
+        """
+        Drop cached metadata of the user, call after commit.
+        """
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(
+                self._version_key(user_id), uuid.uuid4().hex
+            )
+        except Exception as err:
+            logger.error(f'{err}')
+
+
+class UserCache:
+    """
+    Principals of authenticated users: in-process LRU over Redis.
+
+    In-process entries live only local_ttl seconds, which bounds how
+    long other workers may see a user after "invalidate".
+    """
+
+    def __init__(
+            self,
+            *,
+            ttl: int = app_settings.user_cache_ttl,
+            local_ttl: int = app_settings.user_cache_local_ttl,
+            local_size: int = app_settings.user_cache_local_size
+    ):
+        self.redis = None
+        self._ttl = ttl
+        self._local = LRUCache(local_size, local_ttl)
+        self._flight = RedisSingleFlight('singleflight:user')
+
+    def init(self, redis) -> None:
+        self.redis = redis
+        self._local.clear()
+        self._flight.init(redis)
+
+    @staticmethod
+    def _key(email: str) -> str:
+        return f'user:{email}'
+
+    async def _fill(
+            self, key: str, load: Callable[[], Awaitable[Optional[dict]]]
+    ) -> Optional[dict]:
+        value = await load()
+        if value is None or self.redis is None:
+            return value
+        try:
+            await self.redis.set(key, json.dumps(value), ex=self._ttl)
+        except Exception as err:
+            logger.error(f'{err}')
+        return value
+
+    async def get_or_load(
+            self, email: str, load: Callable[[], Awaitable[Optional[dict]]]
+    ) -> Optional[dict]:
+        """
+        Return the cached principal or the one returned by "load".
+        """
+        key = self._key(email)
+        value = self._local.get(key)
+        if value is not None:
+            CACHE_REQUESTS.inc(cache='user', tier='local')
+            return value
+
+        data = None
+        if self.redis is not None:
+            try:
+                data = await self.redis.get(key)
+            except Exception as err:
+                logger.error(f'{err}')
+        if data is not None:
+            CACHE_REQUESTS.inc(cache='user', tier='redis')
+            value = json.loads(data)
+        else:
+            CACHE_REQUESTS.inc(cache='user', tier='miss')
+            value = await self._flight.do(key, lambda: self._fill(key, load))
+            if value is None:
+                return None
+        self._local.set(key, value)
+        return value
+
+    async def invalidate(self, email: str) -> None:
+        """
+        Drop the cached principal, call after the user change commit.
+        """
+        key = self._key(email)
+        self._local.delete(key)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.delete(key)
+        except Exception as err:
+            logger.error(f'{err}')
+
+
+metadata_cache = MetadataCache()
+user_cache = UserCache()
@@ -0,0 +1,146 @@
+import asyncio
+import mimetypes
+import zlib
+from typing import AsyncIterator, Optional
+
+from core.config import app_settings
+from schemas.file import Codec
+
+# Already compressed formats are never worth another pass
+INCOMPRESSIBLE_TYPES = (
+    'image/', 'video/', 'audio/', 'font/woff',
+    'application/zip', 'application/gzip', 'application/x-gzip',
+    'application/x-7z-compressed', 'application/x-rar-compressed',
+    'application/x-bzip2', 'application/x-xz', 'application/zstd',
+    'application/pdf', 'application/vnd.openxmlformats-officedocument',
+)
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/x-ndjson', 'application/xml',
+    'application/javascript', 'application/x-yaml', 'application/yaml',
+    'application/sql', 'image/svg+xml',
+)
+
+
+def get_content_type(content_type: Optional[str], filename: str) -> str:
+    """
+    Return the declared content type or the one guessed by file name.
+    """
+    if content_type and content_type != 'application/octet-stream':
+        return content_type
+    return mimetypes.guess_type(filename or '')[0] or ''
+
+
+def choose_codec(
+        content_type: Optional[str], filename: str, sample: bytes
+) -> Optional[Codec]:
+    """
+    Pick the storage codec by content type, or by compressing a sample.
+    """
+    if not app_settings.storage_compression:
+        return None
+    if len(sample) < app_settings.storage_compression_min_size:
+        return None
+    content_type = get_content_type(content_type, filename)
+    # Compressible types are checked first for "image/svg+xml"
+    if content_type.startswith(COMPRESSIBLE_TYPES):
+        return 'gzip'
+    if content_type.startswith(INCOMPRESSIBLE_TYPES):
+        return None
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+    if ratio <= app_settings.storage_compression_ratio:
+        return 'gzip'
+    return None
+
+
+def accepts_encoding(header: Optional[str], codec: Codec) -> bool:
+    """
+    Check "Accept-Encoding" header for the codec.
+    """
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding.strip().lower() not in (codec, '*'):
+            continue
+        quality = params.strip().removeprefix('q=')
+        try:
+            return not params or float(quality) > 0
+        except ValueError:
+            return False
+    return False
+
+
+class StreamEncoder:
+    """
+    Compress a stream of chunks when it pays off.
+
+    The codec is chosen when the first `sample_size` bytes are read,
+    `size` counts the original bytes.
+    """
+
+    def __init__(
+            self,
+            content_type: Optional[str] = None,
+            filename: str = '',
+            *,
+            sample_size: int = app_settings.storage_compression_sample_size
+    ):
+        self._content_type = content_type
+        self._filename = filename
+        self._sample_size = sample_size
+        self._compressor = None
+        self.codec: Optional[Codec] = None
+        self.size = 0
+
+    def _choose_codec(self, sample: bytes) -> None:
+        self.codec = choose_codec(self._content_type, self._filename, sample)
+        if self.codec == 'gzip':
+            self._compressor = zlib.compressobj(
+                app_settings.storage_compression_level, zlib.DEFLATED, 31
+            )
+
+    async def _encode(self, chunk: bytes) -> bytes:
+        if self._compressor is None:
+            return chunk
+        return await asyncio.to_thread(self._compressor.compress, chunk)
+
+    async def encode(
+            self, chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        sample = bytearray()
+        sampling = True
+        async for chunk in chunks:
+            self.size += len(chunk)
+            if sampling:
+                sample += chunk
+                if len(sample) < self._sample_size:
+                    continue
+                sampling = False
+                chunk = bytes(sample)
+                self._choose_codec(chunk)
+            if data := await self._encode(chunk):
+                yield data
+
+        if sampling:
+            # Short stream: all of it is the sample
+            self._choose_codec(bytes(sample))
+            if data := await self._encode(bytes(sample)):
+                yield data
+        if self._compressor is not None:
+            yield self._compressor.flush()
+
+
+async def decode_chunks(
+        chunks: AsyncIterator[bytes], codec: Optional[Codec]
+) -> AsyncIterator[bytes]:
+    """
+    Decompress stored chunks, pass them through without a codec.
+    """
+    if codec is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+    decompressor = zlib.decompressobj(wbits=31)
+    async for chunk in chunks:
+        if data := await asyncio.to_thread(decompressor.decompress, chunk):
+            yield data
+    if data := decompressor.flush():
+        yield data
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable
+
+from aiofiles.os import makedirs, remove, replace, stat
+
+from core.config import app_settings
+from core.logger import LOGGING
+from services.metrics import CACHE_REQUESTS
+from services.singleflight import SingleFlight
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+ENTRY_NAME = re.compile('[0-9a-f]{64}')
+TMP_SUFFIX = '.tmp'
+
+Fetch = Callable[[str], Awaitable[None]]
+
+
+class DiskCache:
+    """
+    Size-bounded LRU cache of S3 objects in a local directory.
+
+    Entries are immutable files named by the key hash, so the key must
+    change with the content. Concurrent misses of a key share one fetch.
+    Files being sent are pinned and not evicted until released.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._fetches = SingleFlight()
+        self._pins: Counter[str] = Counter()
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.directory, name[:2], name)
+
+    def _scan(self) -> list[tuple[float, str, int]]:
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(TMP_SUFFIX):
+                    # Left by an interrupted fetch
+                    os.remove(path)
+                elif ENTRY_NAME.fullmatch(name):
+                    info = os.stat(path)
+                    found.append((info.st_mtime, name, info.st_size))
+        return sorted(found)
+
+    async def start(self) -> None:
+        """
+        Index files cached before restart, the oldest are evicted first.
+        """
+        try:
+            await makedirs(self.directory, exist_ok=True)
+            entries = await asyncio.to_thread(self._scan)
+        except OSError as err:
+            # Other download modes still work
+            logger.error(f'{err}')
+            return
+        for _, name, size in entries:
+            self._entries[name] = size
+            self.size += size
+        await self._evict()
+        logger.info(
+            f'Disk cache started with {len(self._entries)} files, '
+            f'{self.size} bytes.'
+        )
+
+    async def _evict(self) -> None:
+        for name in list(self._entries):
+            if self.size <= self.max_size:
+                return
+            if self._pins[name]:
+                continue
+            self.size -= self._entries.pop(name)
+            try:
+                await remove(self.get_path(name))
+            except OSError as err:
+                logger.error(f'{err}')
+
+    async def _fetch(self, name: str, fetch: Fetch) -> None:
+        path = self.get_path(name)
+        await makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}{TMP_SUFFIX}'
+        try:
+            await fetch(tmp_path)
+            size = (await stat(tmp_path)).st_size
+            await replace(tmp_path, path)
+        except BaseException:
+            try:
+                await remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._entries[name] = size
+        self.size += size
+
+    async def get(self, key: str, fetch: Fetch) -> str:
+        """
+        Return path of the cached file, fetching it on a miss.
+
+        `fetch(path)` writes the content to the path. The file is pinned
+        until `release(path)` is called.
+        """
+        name = hashlib.sha256(key.encode()).hexdigest()
+        # Pinned before the fetch adds it, others evict while we wait
+        self._pins[name] += 1
+        try:
+            if name in self._entries:
+                CACHE_REQUESTS.inc(cache='disk', tier='local')
+                self._entries.move_to_end(name)
+            else:
+                CACHE_REQUESTS.inc(cache='disk', tier='miss')
+                await self._fetches.do(
+                    name, lambda: self._fetch(name, fetch)
+                )
+            await self._evict()
+        except BaseException:
+            self._unpin(name)
+            raise
+        return self.get_path(name)
+
+    def _unpin(self, name: str) -> None:
+        self._pins[name] -= 1
+        if self._pins[name] <= 0:
+            del self._pins[name]
+
+    def release(self, path: str) -> None:
+        self._unpin(os.path.basename(path))
+
+
+# Own subdirectory keeps files staged by older versions out of it
+disk_cache = DiskCache(
+    os.path.join(app_settings.local_download_dir, 'cache'),
+    app_settings.local_cache_size
+)
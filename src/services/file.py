@@ -1,24 +1,303 @@
+import asyncio
+import dataclasses
+import hashlib
+import json
 import logging
 import os
+import secrets
+import uuid
+from collections import Counter, deque
+from typing import AsyncIterator, NamedTuple, Optional
+from urllib.parse import quote
 
-from aiofiles.os import makedirs
-from fastapi import Depends, HTTPException, UploadFile, status
+import aiofiles
+from fastapi import Depends, HTTPException, Request, UploadFile, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import FileResponse as FastapiFileResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from sqlalchemy import (
+    Float,
+    bindparam,
+    delete,
+    func,
+    literal,
+    or_,
+    select,
+    tuple_,
+    update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.background import BackgroundTask
 
-from core.config import app_settings
+from core.config import DownloadMode, app_settings
 from core.logger import LOGGING
 from db.db import get_session
+from db.redis import get_redis
+from models.models import Blob as BlobModel
 from models.models import File as FileModel
-from schemas.file import FileUpload
-from services.boto3 import get_s3_client
+from schemas.file import (
+    BatchUploadResponse,
+    BatchUploadResult,
+    FileResponse,
+    FilesFilter,
+    FileUpload,
+    PresignedUploadComplete,
+    PresignedUploadResponse,
+    UserFilesResponse,
+)
+from schemas.folder import FolderTreeResponse
+from services.archive import (
+    ARCHIVE_EXTENSIONS,
+    ARCHIVE_MEDIA_TYPES,
+    ArchiveEntry,
+    ArchiveFormat,
+    iter_archive,
+)
+from services.blob import blob_crud, get_blob_key, get_sha256, hash_chunks
+from services.boto3 import get_s3
+from services.cache import dump_row, load_row, metadata_cache
+from services.codecs import StreamEncoder, accepts_encoding, decode_chunks
+from services.disk_cache import disk_cache
+from services.folder import folder_crud
+from services.jobs import job_queue
+from services.metrics import (
+    FILE_BYTES,
+    FILE_STAGE_SECONDS,
+    S3_ERRORS,
+    timed_chunks,
+)
+from services.multipart import MultipartUploader
+from services.pagination import decode_cursor, encode_cursor, glob_to_like
+from services.ranges import (
+    format_http_date,
+    is_not_modified,
+    is_range_fresh,
+    parse_range_header,
+)
 from services.security import manager
+from services.usage import check_quota, usage_crud
 
 from .base import RepositoryDB
 
 
 class RepositoryFile(RepositoryDB[FileModel, FileUpload, FileUpload]):
-    pass
+    """
+    Files repository keeping folders and blobs in the same transaction.
+    """
+
+    @staticmethod
+    async def _acquire_blobs(
+            db: AsyncSession, objs_in: list[FileUpload]
+    ) -> dict[str, BlobModel]:
+        objs_by_sha256: dict[str, list[FileUpload]] = {}
+        for obj_in in objs_in:
+            if obj_in.sha256:
+                objs_by_sha256.setdefault(obj_in.sha256, []).append(obj_in)
+        # Same lock order for every transaction
+        return {
+            sha256: await blob_crud.acquire(
+                db,
+                sha256=sha256,
+                size=objs[0].size,
+                key=objs[0].key,
+                count=len(objs),
+                codec=objs[0].codec,
+                stored_size=objs[0].stored_size
+            )
+            for sha256, objs in sorted(objs_by_sha256.items())
+        }
+
+    async def _prepare(
+            self, db: AsyncSession, objs_in: list[FileUpload]
+    ) -> list[dict]:
+        folder_ids = await folder_crud.add_files(
+            db,
+            objs_in[0].user_id,
+            [(obj_in.path, obj_in.size) for obj_in in objs_in]
+        )
+        blobs = await self._acquire_blobs(db, objs_in)
+        # Concurrent uploads can't overrun the quota together
+        usage = await usage_crud.add(
+            db,
+            objs_in[0].user_id,
+            count=len(objs_in),
+            size=sum(obj_in.size for obj_in in objs_in)
+        )
+        check_quota(usage)
+        objs_in_data = []
+        for obj_in, folder_id in zip(objs_in, folder_ids):
+            obj_in_data = jsonable_encoder(obj_in)
+            obj_in_data['folder_id'] = folder_id
+            if obj_in.sha256:
+                blob = blobs[obj_in.sha256]
+                obj_in_data['blob_id'] = blob.id
+                obj_in_data['key'] = blob.key
+                obj_in_data['codec'] = blob.codec
+                obj_in_data['stored_size'] = blob.stored_size
+            objs_in_data.append(obj_in_data)
+        return objs_in_data
+
+    async def create(
+            self, db: AsyncSession, *, obj_in: FileUpload
+    ) -> FileModel:
+        objs_in_data = await self._prepare(db, [obj_in])
+        db_obj = await super().create(db, obj_in=objs_in_data[0])
+        await metadata_cache.invalidate(obj_in.user_id)
+        return db_obj
+
+    async def create_multi(
+            self, db: AsyncSession, *, objs_in: list[FileUpload]
+    ) -> list[FileModel]:
+        if not objs_in:
+            return []
+        objs_in_data = await self._prepare(db, objs_in)
+        db_objs = await super().create_multi(db, objs_in=objs_in_data)
+        await metadata_cache.invalidate(objs_in[0].user_id)
+        return db_objs
+
+    async def update(
+            self,
+            db: AsyncSession,
+            *,
+            db_obj: FileModel,
+            obj_in: FileUpload | dict
+    ) -> FileModel:
+        db_obj = await super().update(db, db_obj=db_obj, obj_in=obj_in)
+        await metadata_cache.invalidate(db_obj.user_id)
+        return db_obj
+
+    async def delete_multi(
+            self, db: AsyncSession, *, db_objs: list[FileModel]
+    ) -> list[str]:
+        """
+        Delete files of one user without commit.
+
+        Their folders and user totals and blobs change in the same
+        transaction. Return S3 keys no files refer to any longer.
+        """
+        if not db_objs:
+            return []
+        statement = (
+            delete(self._model).
+            where(self._model.id.in_([db_obj.id for db_obj in db_objs]))
+        )
+        await db.execute(statement=statement)
+        # Folders before blobs, as uploads lock them
+        await folder_crud.remove_files(
+            db, [(db_obj.path, db_obj.size) for db_obj in db_objs]
+        )
+
+        keys = {
+            get_storage_key(db_obj)
+            for db_obj in db_objs
+            if db_obj.blob_id is None
+        }
+        refs = Counter(
+            db_obj.blob_id for db_obj in db_objs if db_obj.blob_id
+        )
+        unused_ids = []
+        # Same lock order for every transaction
+        for blob_id, count in sorted(refs.items()):
+            blob = await blob_crud.release(db, id=blob_id, count=count)
+            if blob is not None:
+                keys.add(blob.key)
+                unused_ids.append(blob.id)
+        if unused_ids:
+            await blob_crud.delete_unused(db, unused_ids)
+
+        await usage_crud.add(
+            db,
+            db_objs[0].user_id,
+            count=-len(db_objs),
+            size=-sum(db_obj.size for db_obj in db_objs)
+        )
+        return sorted(keys)
+
+    async def move_multi(
+            self, db: AsyncSession, *, moves: list[tuple[FileModel, str]]
+    ) -> None:
+        """
+        Move files of one user to new paths without commit.
+
+        Contents stay under their S3 keys, files stored by path keep
+        the old one as the key. Uploads only write to keys of their own,
+        never to a path, so a new file at the old path can't replace
+        the moved content.
+        """
+        if not moves:
+            return
+        folder_ids = await folder_crud.move_files(
+            db,
+            moves[0][0].user_id,
+            [(db_obj.path, path, db_obj.size) for db_obj, path in moves]
+        )
+        table = self._model.__table__
+        statement = (
+            update(table).
+            where(table.c.id == bindparam('file_id')).
+            values(path=bindparam('new_path'),
+                   name=bindparam('new_name'),
+                   folder_id=bindparam('new_folder_id'),
+                   key=func.coalesce(table.c.key, table.c.path))
+        )
+        await db.execute(statement, [
+            {
+                'file_id': db_obj.id,
+                'new_path': path,
+                'new_name': os.path.basename(path),
+                'new_folder_id': folder_id,
+            }
+            for (db_obj, path), folder_id in zip(moves, folder_ids)
+        ])
+
+    async def get_page_by_similarity(
+            self,
+            db: AsyncSession,
+            user_id: int,
+            name: str,
+            text: str,
+            *clauses,
+            after: Optional[tuple[float, int]] = None,
+            limit: int = 100
+    ) -> list[tuple[FileModel, float]]:
+        """
+        Return a page of user files with the column similar to the text.
+
+        Files with a word similar to the text are matched by pg_trgm,
+        the most similar first. "after" is the (score, id) key of the
+        last row of the previous page.
+        """
+        column = getattr(self._model, name)
+        score = func.word_similarity(text, column, type_=Float)
+        statement = (
+            select(self._model, score).
+            where(self._model.user_id == user_id,
+                  literal(text).op('<%')(column),
+                  *clauses)
+        )
+        if after is not None:
+            statement = statement.where(
+                tuple_(score, self._model.id)
+                < tuple_(literal(after[0], Float), literal(after[1]))
+            )
+        statement = (
+            statement.
+            order_by(score.desc(), self._model.id.desc()).
+            limit(limit)
+        )
+        results = await db.execute(statement=statement)
+        return [tuple(row) for row in results.all()]
+
+    async def get_multi_by_folder_id(
+            self, db: AsyncSession, folder_id: int
+    ) -> list[FileModel]:
+        statement = (
+            select(self._model).
+            where(self._model.folder_id == folder_id).
+            order_by(self._model.name)
+        )
+        results = await db.execute(statement=statement)
+        return results.scalars().all()
 
 
 file_crud = RepositoryFile(FileModel)
@@ -27,11 +306,10 @@ logging.basicConfig = LOGGING
 logger = logging.getLogger()
 
 
-def get_file_params(file: UploadFile, prefix_path: str = '', path: str = ''):
+def get_file_params(file_name: str, prefix_path: str = '', path: str = ''):
     """
     Prepare "file_name" and "path" params.
     """
-    file_name = file.filename
     if not path:
         path = prefix_path + file_name
     elif path[-1] == '/':
@@ -44,84 +322,1166 @@ def get_file_params(file: UploadFile, prefix_path: str = '', path: str = ''):
     return file_name, path
 
 
+def get_storage_key(file_obj: FileModel) -> str:
+    """
+    Return S3 key of the file content.
+    """
+    return file_obj.key or file_obj.path
+
+
+async def delete_s3_object(s3, key: str) -> None:
+    try:
+        await s3.delete_object(Bucket=app_settings.bucket, Key=key)
+    except Exception as err:
+        logger.error(f'{err}')
+
+
+async def delete_uploaded_objects(s3, keys: list[str]) -> None:
+    """
+    Delete objects of a request no files refer to, logging failures.
+    """
+    await asyncio.gather(*(delete_s3_object(s3, key) for key in keys))
+
+
+class StoredContent(NamedTuple):
+    codec: str | None
+    # Original and stored sizes
+    size: int
+    stored_size: int
+
+
+async def iter_upload_file(file: UploadFile) -> AsyncIterator[bytes]:
+    """
+    Read the spooled upload file by chunks off the event loop.
+    """
+    file.file.seek(0)
+    while chunk := await asyncio.to_thread(
+            file.file.read, app_settings.s3_multipart_part_size
+    ):
+        yield chunk
+
+
+async def put_content(
+        s3,
+        key: str,
+        chunks: AsyncIterator[bytes],
+        content_type: str | None,
+        file_name: str
+) -> StoredContent:
+    """
+    Upload the content to S3 storage, compressed if it pays off.
+    """
+    encoder = StreamEncoder(content_type, file_name)
+    uploader = MultipartUploader(s3, app_settings.bucket, key)
+    stored_size = await uploader.upload(encoder.encode(chunks))
+    return StoredContent(encoder.codec, encoder.size, stored_size)
+
+
+async def upload_content(
+        s3, key: str, file: UploadFile, name: str, operation: str
+) -> StoredContent:
+    try:
+        with FILE_STAGE_SECONDS.time(operation=operation, stage='s3'):
+            return await put_content(
+                s3, key, iter_upload_file(file), file.content_type, name
+            )
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='upload')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
+        )
+
+
+async def enqueue_processing(file_objs: list[FileModel]) -> None:
+    """
+    Queue processing of new files, failures leave them "pending".
+    """
+    for file_obj in file_objs:
+        await job_queue.enqueue('process_file', {'file_id': file_obj.id})
+
+
+async def create_uploaded_file(
+        db: AsyncSession,
+        s3,
+        obj_in: FileUpload,
+        key: str | None,
+        operation: str
+) -> FileModel:
+    """
+    Write the file in DB, its content uploaded under the key if any.
+
+    The uploaded object is deleted when the file is not created or the
+    same content got stored concurrently, keeping its own object.
+    Without the key LookupError is raised if the content is released
+    since it was found stored, the caller uploads it then.
+    """
+    try:
+        with FILE_STAGE_SECONDS.time(operation=operation, stage='db_insert'):
+            file_obj = await file_crud.create(db=db, obj_in=obj_in)
+    except LookupError:
+        raise
+    except HTTPException:
+        if key is not None:
+            await delete_s3_object(s3, key)
+        raise
+    except Exception as err:
+        logger.error(f'{err}')
+        if key is not None:
+            await delete_s3_object(s3, key)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f'Error: {err}'
+        )
+    if key is not None and file_obj.key != key:
+        logger.info(f'Drop stored content {file_obj.sha256} copy')
+        await delete_s3_object(s3, key)
+    return file_obj
+
+
+def get_filter_clauses(filters: FilesFilter) -> list:
+    clauses = []
+    if filters.path_prefix:
+        clauses.append(
+            FileModel.path.startswith(filters.path_prefix, autoescape=True)
+        )
+    if filters.name:
+        clauses.append(
+            FileModel.name.like(glob_to_like(filters.name), escape='\\')
+        )
+    if filters.size_min is not None:
+        clauses.append(FileModel.size >= filters.size_min)
+    if filters.size_max is not None:
+        clauses.append(FileModel.size <= filters.size_max)
+    if filters.created_from is not None:
+        clauses.append(FileModel.created_at >= filters.created_from)
+    if filters.created_to is not None:
+        clauses.append(FileModel.created_at <= filters.created_to)
+    return clauses
+
+
+def get_cache_name(prefix: str, filters) -> str:
+    """
+    Return metadata cache name of the query with the filters dataclass.
+    """
+    filters_data = json.dumps(
+        dataclasses.asdict(filters), sort_keys=True, default=str
+    )
+    return f'{prefix}:' + hashlib.sha1(filters_data.encode()).hexdigest()
+
+
+async def get_files_page(
+        filters: FilesFilter,
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager)
+) -> UserFilesResponse:
+    name = get_cache_name('files', filters)
+
+    async def load():
+        files_page = await load_files_page(filters, db, user)
+        return files_page.model_dump(mode='json')
+
+    return UserFilesResponse.model_validate(
+        await metadata_cache.get_or_load(user.id, name, load)
+    )
+
+
+async def load_files_page(
+        filters: FilesFilter, db: AsyncSession, user, *clauses
+) -> UserFilesResponse:
+    after = None
+    if filters.cursor:
+        after = decode_cursor(filters.cursor, filters.order_by)
+
+    # One extra row tells whether there is a next page
+    file_objs = await file_crud.get_page_by_user_id(
+        db,
+        user.id,
+        *get_filter_clauses(filters),
+        *clauses,
+        order_by=filters.order_by,
+        descending=filters.order == 'desc',
+        after=after,
+        limit=filters.limit + 1
+    )
+    next_cursor = None
+    if len(file_objs) > filters.limit:
+        file_objs = file_objs[:filters.limit]
+        last = file_objs[-1]
+        next_cursor = encode_cursor(
+            filters.order_by, getattr(last, filters.order_by), last.id
+        )
+    return UserFilesResponse(
+        account_id=user.id, files=file_objs, next_cursor=next_cursor
+    )
+
+
+async def get_folder_tree(
+        path: str = '',
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager)
+) -> FolderTreeResponse:
+    # Root folder of the user by default
+    path = path or f'{user.email}/'
+    if path[-1] != '/':
+        path += '/'
+
+    folder_obj = await folder_crud.get_by_path(db=db, path=path)
+    if folder_obj is None or folder_obj.user_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Folder not found'
+        )
+    return FolderTreeResponse(
+        folder=folder_obj,
+        folders=await folder_crud.get_children(db, folder_obj.id),
+        files=await file_crud.get_multi_by_folder_id(db, folder_obj.id)
+    )
+
+
 async def upload_file(
         file: UploadFile,
         path: str = '',
         db: AsyncSession = Depends(get_session),
-        user=Depends(manager)
+        user=Depends(manager),
+        s3=Depends(get_s3)
 ):
     # Prepare "file_name" and "path" params
-    file_name, path = get_file_params(file, f'{user.email}/', path)
+    file_name, path = get_file_params(file.filename, f'{user.email}/', path)
+    if await file_crud.get_by_path(db=db, path=path):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='File already exists'
+        )
+    with FILE_STAGE_SECONDS.time(operation='upload', stage='hash'):
+        sha256 = await asyncio.to_thread(get_sha256, file.file)
+    check_quota(await usage_crud.get_by_user_id(db, user.id), file.size)
+    stored = await blob_crud.get_multi_by_sha256(db, [sha256])
+    # Don't keep a connection in transaction during the transfer
+    await db.commit()
+
+    async def create(key: str | None, content: StoredContent) -> FileModel:
+        return await create_uploaded_file(
+            db,
+            s3,
+            FileUpload(user_id=user.id,
+                       path=path,
+                       name=file_name,
+                       size=file.size,
+                       sha256=sha256,
+                       key=key,
+                       codec=content.codec,
+                       stored_size=content.stored_size),
+            key,
+            'upload'
+        )
+
+    async def upload_and_create() -> FileModel:
+        key = get_blob_key(sha256)
+        content = await upload_content(s3, key, file, file_name, 'upload')
+        logger.info(f'Upload file {path} from {user.email}')
+        return await create(key, content)
+
+    # Upload file in S3 storage unless the same content is stored
+    if not stored:
+        file_obj = await upload_and_create()
+    else:
+        logger.info(f'Skip upload of stored content {sha256}')
+        try:
+            file_obj = await create(
+                None, StoredContent(None, file.size, file.size)
+            )
+        except LookupError:
+            # Released by a delete since it was found
+            await db.rollback()
+            file_obj = await upload_and_create()
+    FILE_BYTES.inc(file.size, operation='upload')
+    await enqueue_processing([file_obj])
+    return file_obj
+
+
+def get_batch_results(
+        files: list[UploadFile], path: str, user
+) -> list[BatchUploadResult]:
+    # All files of the batch go to one folder
+    if path and path[-1] != '/':
+        path += '/'
+    results = []
+    for file in files:
+        file_name, file_path = get_file_params(
+            file.filename, f'{user.email}/', path
+        )
+        results.append(
+            BatchUploadResult(name=file_name, path=file_path, status=0)
+        )
+    return results
+
+
+async def check_batch(
+        db: AsyncSession,
+        user,
+        files: list[UploadFile],
+        results: list[BatchUploadResult]
+) -> None:
+    """
+    Reject files already stored, repeated in the batch or over quota.
+    """
+    existing_paths = set(await file_crud.get_existing_paths(
+        db=db, paths=[result.path for result in results]
+    ))
+    for result in results:
+        if result.path in existing_paths:
+            result.status = status.HTTP_409_CONFLICT
+            result.detail = 'File already exists'
+        existing_paths.add(result.path)
+
+    # Files over the quota are rejected before any upload
+    usage = await usage_crud.get_by_user_id(db, user.id)
+    size = 0
+    for file, result in zip(files, results):
+        if result.status:
+            continue
+        try:
+            check_quota(usage, size + file.size)
+        except HTTPException as err:
+            result.status = err.status_code
+            result.detail = err.detail
+        else:
+            size += file.size
+
+
+async def upload_batch_contents(
+        s3,
+        user,
+        to_upload: dict[str, tuple[UploadFile, list[BatchUploadResult]]],
+        keys: dict[str, str],
+        semaphore: asyncio.Semaphore
+) -> dict[str, StoredContent]:
+    """
+    Upload the contents concurrently, return the uploaded ones.
+
+    Results of the files with a failed upload get HTTP 500.
+    """
+    contents: dict[str, StoredContent] = {}
+
+    async def upload(sha256: str, file: UploadFile, same_results: list):
+        async with semaphore:
+            try:
+                contents[sha256] = await put_content(
+                    s3,
+                    keys[sha256],
+                    iter_upload_file(file),
+                    file.content_type,
+                    file.filename
+                )
+                logger.info(f'Upload file {file.filename} from {user.email}')
+            except Exception as err:
+                logger.error(f'{err}')
+                S3_ERRORS.inc(operation='upload')
+                for result in same_results:
+                    result.status = status.HTTP_500_INTERNAL_SERVER_ERROR
+                    result.detail = 'Something went wrong'
+
+    with FILE_STAGE_SECONDS.time(operation='upload_batch', stage='s3'):
+        await asyncio.gather(*(
+            upload(sha256, file, same_results)
+            for sha256, (file, same_results) in to_upload.items()
+        ))
+    return contents
+
+
+async def create_batch_files(
+        db: AsyncSession,
+        s3,
+        user,
+        uploaded: list[tuple[UploadFile, BatchUploadResult, str,
+                             StoredContent]],
+        keys: dict[str, str],
+        contents: dict[str, StoredContent]
+) -> None:
+    """
+    Write all uploaded files in DB at once and set their results.
+
+    Uploaded objects no file refers to are deleted. LookupError is
+    raised if a content found stored is released meanwhile.
+    """
+    try:
+        with FILE_STAGE_SECONDS.time(
+                operation='upload_batch', stage='db_insert'
+        ):
+            file_objs = await file_crud.create_multi(
+                db=db,
+                objs_in=[
+                    FileUpload(user_id=user.id,
+                               path=result.path,
+                               name=result.name,
+                               size=file.size,
+                               sha256=sha256,
+                               key=keys.get(sha256),
+                               codec=content.codec,
+                               stored_size=content.stored_size)
+                    for file, result, sha256, content in uploaded
+                ]
+            )
+    except LookupError:
+        raise
+    except Exception as err:
+        if not isinstance(err, HTTPException):
+            logger.error(f'{err}')
+            err = HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail=f'Error: {err}'
+            )
+        await delete_uploaded_objects(
+            s3, [keys[sha256] for sha256 in contents]
+        )
+        for _, result, _, _ in uploaded:
+            result.status = err.status_code
+            result.detail = err.detail
+        return
+
+    FILE_BYTES.inc(
+        sum(file.size for file, _, _, _ in uploaded), operation='upload'
+    )
+    # Contents stored concurrently keep their own objects and codecs
+    stored_keys = {file_obj.key for file_obj in file_objs}
+    await delete_uploaded_objects(s3, [
+        keys[sha256] for sha256 in contents
+        if keys[sha256] not in stored_keys
+    ])
+    await enqueue_processing(file_objs)
+    files_by_path = {file_obj.path: file_obj for file_obj in file_objs}
+    for _, result, _, _ in uploaded:
+        result.status = status.HTTP_201_CREATED
+        result.file = FileResponse.model_validate(files_by_path[result.path])
+
+
+async def upload_files_batch(
+        files: list[UploadFile],
+        path: str = '',
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3)
+) -> BatchUploadResponse:
+    results = get_batch_results(files, path, user)
+    await check_batch(db, user, files, results)
+    pending = [
+        (file, result)
+        for file, result in zip(files, results)
+        if not result.status
+    ]
+    semaphore = asyncio.Semaphore(app_settings.s3_batch_concurrency)
+
+    async def hash_file(file: UploadFile) -> str:
+        async with semaphore:
+            return await asyncio.to_thread(get_sha256, file.file)
+
+    # Skip contents already stored and upload repeated ones once
+    sha256_list = await asyncio.gather(*(
+        hash_file(file) for file, _ in pending
+    ))
+    stored = {
+        blob.sha256 for blob in await blob_crud.get_multi_by_sha256(
+            db, list(set(sha256_list))
+        )
+    }
+    # Don't keep a connection in transaction during the transfer
+    await db.commit()
+    keys: dict[str, str] = {}
+    contents: dict[str, StoredContent] = {}
+    while True:
+        to_upload: dict[
+            str, tuple[UploadFile, list[BatchUploadResult]]
+        ] = {}
+        for (file, result), sha256 in zip(pending, sha256_list):
+            if sha256 not in stored and sha256 not in keys:
+                to_upload.setdefault(sha256, (file, []))[1].append(result)
+        keys.update({sha256: get_blob_key(sha256) for sha256 in to_upload})
+        contents.update(await upload_batch_contents(
+            s3, user, to_upload, keys, semaphore
+        ))
+
+        # Contents stored before keep the codec of their blob
+        uploaded = [
+            (file, result, sha256, contents.get(
+                sha256, StoredContent(None, file.size, file.size)
+            ))
+            for (file, result), sha256 in zip(pending, sha256_list)
+            if not result.status
+        ]
+        try:
+            await create_batch_files(db, s3, user, uploaded, keys, contents)
+        except LookupError:
+            # Released by a delete since found, upload all of them
+            await db.rollback()
+            stored = set()
+        else:
+            break
+    return BatchUploadResponse(files=results)
+
+
+async def upload_file_stream(
+        request: Request,
+        path: str = '',
+        name: str = '',
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3)
+):
+    # Prepare "file_name" and "path" params
+    file_name, path = get_file_params(name, f'{user.email}/', path)
+    if not file_name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='File name is required'
+        )
+    if await file_crud.get_by_path(db=db, path=path):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='File already exists'
+        )
+
+    # Reject before reading the body, chunked one is checked in DB
+    content_length = request.headers.get('content-length', '')
+    check_quota(
+        await usage_crud.get_by_user_id(db, user.id),
+        int(content_length) if content_length.isdigit() else 0
+    )
+    # Don't keep a connection in transaction during the transfer
+    await db.commit()
+
+    # Upload request body in S3 storage by parts, content hash is
+    # known only at the end, so upload under a unique key
+    key = f'blobs/uploads/{uuid.uuid4().hex}'
+    sha256 = hashlib.sha256()
+    try:
+        with FILE_STAGE_SECONDS.time(operation='upload_stream', stage='s3'):
+            content = await put_content(
+                s3,
+                key,
+                hash_chunks(request.stream(), sha256),
+                request.headers.get('content-type'),
+                file_name
+            )
+        logger.info(f'Upload file {path} from {user.email}')
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='upload')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
+        )
+
+    file_obj = await create_uploaded_file(
+        db,
+        s3,
+        FileUpload(user_id=user.id,
+                   path=path,
+                   name=file_name,
+                   size=content.size,
+                   sha256=sha256.hexdigest(),
+                   key=key,
+                   codec=content.codec,
+                   stored_size=content.stored_size),
+        key,
+        'upload_stream'
+    )
+    FILE_BYTES.inc(content.size, operation='upload')
+    await enqueue_processing([file_obj])
+    return file_obj
+
+
+def get_presigned_key(upload_id: str) -> str:
+    return f'presigned:{upload_id}'
+
+
+async def presign_upload(
+        path: str = '',
+        name: str = '',
+        parts: int = 1,
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3),
+        redis=Depends(get_redis)
+) -> PresignedUploadResponse:
+    # Prepare "file_name" and "path" params
+    file_name, path = get_file_params(name, f'{user.email}/', path)
+    if not file_name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='File name is required'
+        )
+    if not 1 <= parts <= 10000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Number of parts must be between 1 and 10000'
+        )
+    if await file_crud.get_by_path(db=db, path=path):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='File already exists'
+        )
 
-    # Write file in DB
+    # Every upload gets its own key, so it can't overwrite any file,
+    # the path is taken when the upload is completed
+    upload_id = uuid.uuid4().hex
+    key = f'blobs/uploads/{upload_id}'
+    expires_in = app_settings.s3_presigned_expires
+    params = {'Bucket': app_settings.bucket, 'Key': key}
+    s3_upload_id = None
     try:
-        file_obj = await file_crud.create(
-            db=db,
-            obj_in=FileUpload(user_id=user.id,
-                              path=path,
-                              name=file_name,
-                              size=file.size)
+        if parts == 1:
+            urls = [await s3.generate_presigned_url(
+                'put_object', Params=params, ExpiresIn=expires_in
+            )]
+        else:
+            response = await s3.create_multipart_upload(**params)
+            s3_upload_id = response['UploadId']
+            urls = [
+                await s3.generate_presigned_url(
+                    'upload_part',
+                    Params={
+                        **params,
+                        'UploadId': s3_upload_id,
+                        'PartNumber': number
+                    },
+                    ExpiresIn=expires_in
+                )
+                for number in range(1, parts + 1)
+            ]
+    except Exception as err:
+        logger.error(f'{err}')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
         )
+
+    session_key = get_presigned_key(upload_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(session_key, mapping={
+            'user_id': user.id,
+            'path': path,
+            'name': file_name,
+            'key': key,
+            's3_upload_id': s3_upload_id or '',
+        })
+        pipe.expire(session_key, app_settings.upload_session_ttl)
+        await pipe.execute()
+    return PresignedUploadResponse(
+        id=upload_id,
+        path=path,
+        upload_id=s3_upload_id,
+        urls=urls,
+        expires_in=expires_in
+    )
+
+
+async def complete_upload(
+        data: PresignedUploadComplete,
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager),
+        s3=Depends(get_s3),
+        redis=Depends(get_redis)
+):
+    session_key = get_presigned_key(data.id)
+    session = await redis.hgetall(session_key)
+    if not session or int(session['user_id']) != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Upload not found'
+        )
+
+    # Check uploaded object in S3 storage
+    key = session['key']
+    params = {'Bucket': app_settings.bucket, 'Key': key}
+    try:
+        if session['s3_upload_id']:
+            await s3.complete_multipart_upload(
+                **params,
+                UploadId=session['s3_upload_id'],
+                MultipartUpload={'Parts': [
+                    {'PartNumber': part.part_number, 'ETag': part.etag}
+                    for part in data.parts
+                ]}
+            )
+        s3_obj = await s3.head_object(**params)
     except Exception as err:
         logger.error(f'{err}')
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='File is not uploaded'
+        )
+    # Only one of concurrent requests creates the file
+    if not await redis.delete(session_key):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
-            detail=f'Error: {err}'
+            detail='Upload is already completed'
         )
+    logger.info(f'Upload file {session["path"]} from {user.email}')
+
+    # Its checksum is computed by processing job
+    file_obj = await create_uploaded_file(
+        db,
+        s3,
+        FileUpload(user_id=user.id,
+                   path=session['path'],
+                   name=session['name'],
+                   size=s3_obj['ContentLength'],
+                   key=key),
+        key,
+        'upload_presigned'
+    )
+    await enqueue_processing([file_obj])
+    return file_obj
+
 
-    # Upload file in S3 storage
-    s3 = get_s3_client()
-    async with s3:
+def get_content_disposition(file_name: str) -> str:
+    """
+    Prepare "Content-Disposition" header for the file attachment.
+    """
+    quoted_name = quote(file_name)
+    if quoted_name != file_name:
+        return f"attachment; filename*=utf-8''{quoted_name}"
+    return f'attachment; filename="{file_name}"'
+
+
+async def download_decoded(s3, file_obj: FileModel, local_path: str) -> None:
+    """
+    Download the compressed S3 object to a local file decompressing it.
+    """
+    s3_obj = await s3.get_object(
+        Bucket=app_settings.bucket, Key=get_storage_key(file_obj)
+    )
+    body = s3_obj['Body']
+    chunks = body.iter_chunks(app_settings.download_chunk_size)
+    async with body, aiofiles.open(local_path, 'wb') as file:
+        async for chunk in decode_chunks(chunks, file_obj.codec):
+            await file.write(chunk)
+
+
+class CachedFileResponse(FastapiFileResponse):
+    """
+    Response of a disk cache file, unpinned once sent or failed.
+    """
+    async def __call__(self, scope, receive, send) -> None:
         try:
-            await s3._client.upload_fileobj(
-                file.file, app_settings.bucket, path
+            await super().__call__(scope, receive, send)
+        finally:
+            disk_cache.release(self.path)
+
+
+async def stage_file(file_obj: FileModel, s3) -> FastapiFileResponse:
+    """
+    Serve file from the local disk cache, fetching it from S3 on a miss.
+    """
+    async def fetch(local_path: str) -> None:
+        if file_obj.codec:
+            await download_decoded(s3, file_obj, local_path)
+        else:
+            await s3.download_file(
+                app_settings.bucket, get_storage_key(file_obj), local_path
             )
-            logger.info(f'Upload file {path} from {user.email}')
-        except Exception as err:
-            logger.error(f'{err}')
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail='Something went wrong'
+
+    # Files with the same content share the cached copy
+    etag = get_file_etag(file_obj)
+    try:
+        with FILE_STAGE_SECONDS.time(operation='download', stage='local'):
+            local_path = await disk_cache.get(
+                f'{get_storage_key(file_obj)}:{etag}', fetch
             )
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='download')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
+        )
+    FILE_BYTES.inc(file_obj.size, operation='download')
+    try:
+        return CachedFileResponse(
+            path=local_path,
+            media_type='application/octet-stream',
+            filename=file_obj.name,
+            headers={
+                'ETag': etag,
+                'Last-Modified': format_http_date(file_obj.created_at),
+            },
+        )
+    except BaseException:
+        disk_cache.release(local_path)
+        raise
+
+
+def get_content_encoding(
+        file_obj: FileModel, request_headers
+) -> str | None:
+    """
+    Return the codec of the stored file if the client accepts it as is.
+    """
+    if file_obj.codec and accepts_encoding(
+            request_headers.get('accept-encoding'), file_obj.codec
+    ):
+        return file_obj.codec
+    return None
+
+
+def get_file_etag(file_obj: FileModel, encoding: str | None = None) -> str:
+    """
+    Return ETag of the file built from its DB row.
+    """
+    if file_obj.sha256:
+        tag = file_obj.sha256
+    else:
+        created_at = int(file_obj.created_at.timestamp())
+        tag = f'{file_obj.id}-{file_obj.size}-{created_at}'
+    # Compressed response is another representation of the file
+    if encoding:
+        tag += f'-{encoding}'
+    return f'"{tag}"'
+
+
+def get_validators(file_obj: FileModel, encoding: str | None = None) -> dict:
+    """
+    Prepare headers for conditional and range requests.
+    """
+    headers = {
+        'ETag': get_file_etag(file_obj, encoding),
+        'Last-Modified': format_http_date(file_obj.created_at),
+        'Accept-Ranges': 'bytes',
+    }
+    if file_obj.codec:
+        # Offsets of the original content are unknown in S3 storage
+        headers['Accept-Ranges'] = 'none'
+        headers['Vary'] = 'Accept-Encoding'
+    return headers
+
+
+async def get_s3_object(
+        s3, path: str, byte_range: tuple[int, int] | None = None
+) -> dict:
+    params = {'Bucket': app_settings.bucket, 'Key': path}
+    if byte_range is not None:
+        params['Range'] = 'bytes={}-{}'.format(*byte_range)
+    try:
+        with FILE_STAGE_SECONDS.time(operation='download', stage='s3'):
+            return await s3.get_object(**params)
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='download')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
+        )
+
+
+async def iter_s3_body(body):
+    async for chunk in body.iter_chunks(app_settings.download_chunk_size):
+        FILE_BYTES.inc(len(chunk), operation='download')
+        yield chunk
 
-    return file_obj
+
+def stream_file_ranges(
+        file_obj: FileModel, s3, ranges: list[tuple[int, int]], headers: dict
+) -> StreamingResponse:
+    """
+    Stream several ranges of the file as "multipart/byteranges".
+    """
+    boundary = secrets.token_hex(16)
+    part_headers = [
+        (
+            f'--{boundary}\r\n'
+            'Content-Type: application/octet-stream\r\n'
+            f'Content-Range: bytes {first}-{last}/{file_obj.size}\r\n\r\n'
+        ).encode()
+        for first, last in ranges
+    ]
+    closing = f'--{boundary}--\r\n'.encode()
+    headers['Content-Length'] = str(sum(
+        len(part_header) + last - first + 1 + 2
+        for part_header, (first, last) in zip(part_headers, ranges)
+    ) + len(closing))
+
+    async def iter_parts():
+        for part_header, byte_range in zip(part_headers, ranges):
+            yield part_header
+            s3_obj = await get_s3_object(
+                s3, get_storage_key(file_obj), byte_range
+            )
+            body = s3_obj['Body']
+            async with body:
+                async for chunk in iter_s3_body(body):
+                    yield chunk
+            yield b'\r\n'
+        yield closing
+
+    return StreamingResponse(
+        timed_chunks(iter_parts(), operation='download', stage='send'),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=f'multipart/byteranges; boundary={boundary}',
+        headers=headers
+    )
+
+
+async def stream_file(
+        file_obj: FileModel, s3, request_headers
+) -> StreamingResponse:
+    """
+    Stream file (or requested ranges of it) from S3 storage by chunks.
+
+    Compressed files are sent whole, as stored if the client accepts
+    their encoding or decompressed on the fly.
+    """
+    encoding = get_content_encoding(file_obj, request_headers)
+    headers = get_validators(file_obj, encoding)
+    headers['Content-Disposition'] = get_content_disposition(file_obj.name)
+
+    ranges = []
+    range_header = request_headers.get('range')
+    if range_header and not file_obj.codec and is_range_fresh(
+            request_headers, headers['ETag'], file_obj.created_at
+    ):
+        ranges = parse_range_header(range_header, file_obj.size)
+    if len(ranges) > 1:
+        return stream_file_ranges(file_obj, s3, ranges, headers)
+
+    status_code = status.HTTP_200_OK
+    s3_obj = await get_s3_object(
+        s3, get_storage_key(file_obj), ranges[0] if ranges else None
+    )
+    headers['Content-Length'] = str(s3_obj['ContentLength'])
+    if ranges:
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers['Content-Range'] = s3_obj['ContentRange']
+    body = s3_obj['Body']
+    chunks = iter_s3_body(body)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    elif file_obj.codec:
+        headers['Content-Length'] = str(file_obj.size)
+        chunks = decode_chunks(chunks, file_obj.codec)
+
+    # Release S3 connection to the pool even if the client is gone
+    return StreamingResponse(
+        timed_chunks(chunks, operation='download', stage='send'),
+        status_code=status_code,
+        media_type='application/octet-stream',
+        headers=headers,
+        background=BackgroundTask(body.__aexit__, None, None, None)
+    )
+
+
+async def presign_download(file_obj: FileModel, s3) -> RedirectResponse:
+    """
+    Redirect the client to a short-lived S3 URL of the file.
+    """
+    params = {
+        'Bucket': app_settings.bucket,
+        'Key': get_storage_key(file_obj),
+        'ResponseContentDisposition': get_content_disposition(file_obj.name),
+    }
+    if file_obj.codec:
+        params['ResponseContentEncoding'] = file_obj.codec
+    try:
+        url = await s3.generate_presigned_url(
+            'get_object',
+            Params=params,
+            ExpiresIn=app_settings.s3_presigned_expires
+        )
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='presign')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
+        )
+    return RedirectResponse(
+        url, status_code=status.HTTP_307_TEMPORARY_REDIRECT
+    )
+
+
+async def fetch_archive_object(s3, file_obj: FileModel):
+    """
+    Return S3 object of the file, None if it can't be fetched.
+    """
+    try:
+        return await s3.get_object(
+            Bucket=app_settings.bucket, Key=get_storage_key(file_obj)
+        )
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='download')
+
+
+async def read_archive_body(body) -> AsyncIterator[bytes]:
+    async with body:
+        async for chunk in iter_s3_body(body):
+            yield chunk
+
+
+def get_archive_entry(
+        file_obj: FileModel, s3_obj, prefix_path: str
+) -> ArchiveEntry:
+    size = s3_obj['ContentLength']
+    if file_obj.codec:
+        size = file_obj.size
+    return ArchiveEntry(
+        name=file_obj.path.removeprefix(prefix_path),
+        size=size,
+        modified=file_obj.created_at,
+        chunks=decode_chunks(
+            read_archive_body(s3_obj['Body']), file_obj.codec
+        )
+    )
+
+
+async def pop_archive_entry(
+        pending: deque, prefix_path: str
+) -> ArchiveEntry | None:
+    file_obj, task = pending.popleft()
+    if s3_obj := await task:
+        return get_archive_entry(file_obj, s3_obj, prefix_path)
+    return None
+
+
+def drop_fetched(pending: deque) -> None:
+    for _, task in pending:
+        task.cancel()
+        if task.done() and not task.cancelled() and task.result():
+            task.result()['Body'].close()
+
+
+async def iter_archive_entries(
+        file_objs: AsyncIterator[FileModel], prefix_path: str, s3
+) -> AsyncIterator[ArchiveEntry]:
+    """
+    Fetch S3 objects a few files ahead of the archive writer.
+    """
+    pending = deque()
+    try:
+        async for file_obj in file_objs:
+            pending.append((file_obj, asyncio.create_task(
+                fetch_archive_object(s3, file_obj)
+            )))
+            if len(pending) > app_settings.archive_read_ahead:
+                if entry := await pop_archive_entry(pending, prefix_path):
+                    yield entry
+        while pending:
+            if entry := await pop_archive_entry(pending, prefix_path):
+                yield entry
+    finally:
+        # Client is gone: drop objects fetched ahead
+        drop_fetched(pending)
+
+
+async def download_archive(
+        paths: list[str],
+        archive_format: ArchiveFormat,
+        db: AsyncSession,
+        user,
+        s3
+) -> StreamingResponse:
+    """
+    Stream files and folders as a single archive.
+    """
+    conditions = []
+    ids = [int(path) for path in paths if path.isnumeric()]
+    if ids:
+        conditions.append(FileModel.id.in_(ids))
+    file_paths = [
+        path for path in paths
+        if not path.isnumeric() and not path.endswith('/')
+    ]
+    if file_paths:
+        conditions.append(FileModel.path.in_(file_paths))
+    for folder in (path for path in paths if path.endswith('/')):
+        conditions.append(FileModel.path.startswith(folder, autoescape=True))
+
+    file_objs = file_crud.iter_by_user_id(
+        db,
+        user.id,
+        or_(*conditions),
+        FileModel.is_downloadable.is_not(False)
+    )
+    archive_name = 'files'
+    if len(paths) == 1 and not paths[0].isnumeric():
+        archive_name = os.path.basename(paths[0].rstrip('/')) or archive_name
+    archive_name += ARCHIVE_EXTENSIONS[archive_format]
+
+    chunks = iter_archive(
+        iter_archive_entries(file_objs, f'{user.email}/', s3), archive_format
+    )
+    return StreamingResponse(
+        timed_chunks(chunks, operation='download_archive', stage='send'),
+        media_type=ARCHIVE_MEDIA_TYPES[archive_format],
+        headers={
+            'Content-Disposition': get_content_disposition(archive_name)
+        }
+    )
+
+
+async def get_user_file(
+        path: str, db: AsyncSession, user
+) -> FileModel | None:
+    """
+    Return the user file by path or id through the metadata cache.
+    """
+    async def load():
+        if path.isnumeric():
+            file_obj = await file_crud.get(db=db, id=int(path))
+        else:
+            file_obj = await file_crud.get_by_path(db=db, path=path)
+        # Files of other users are never cached nor returned
+        if file_obj is None or file_obj.user_id != user.id:
+            return None
+        return dump_row(file_obj)
+
+    data = await metadata_cache.get_or_load(user.id, f'file:{path}', load)
+    return load_row(FileModel, data) if data else None
 
 
 async def download_file(
-        path: str,
+        request: Request,
+        path: list[str],
+        mode: DownloadMode | None = None,
+        compression: ArchiveFormat | None = None,
         db: AsyncSession = Depends(get_session),
-        user=Depends(manager)
+        user=Depends(manager),
+        s3=Depends(get_s3)
 ):
-    # Get file_obj from DB
-    if path.isnumeric():
-        file_obj = await file_crud.get(db=db, id=int(path))
-    else:
-        file_obj = await file_crud.get_by_path(db=db, path=path)
+    mode = mode or app_settings.download_mode
+    paths = [item for item in path if item]
+    if not paths:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Path is required'
+        )
 
+    # Folders and several files are downloaded as one archive
+    if compression or len(paths) > 1 or paths[0].endswith('/'):
+        return await download_archive(
+            paths, compression or 'zip', db, user, s3
+        )
+    with FILE_STAGE_SECONDS.time(operation='download', stage='db_lookup'):
+        file_obj = await get_user_file(paths[0], db, user)
     if file_obj:
         if file_obj.is_downloadable:
-            # Create dirs by full_local_path
-            full_local_path = '/'.join(
-                [app_settings.local_download_dir, user.email]
-            )
-            await makedirs(full_local_path, exist_ok=True)
-
-            # Download file from S3 storage
-            s3 = get_s3_client()
-            full_local_path_to_file = '/'.join(
-                [full_local_path, file_obj.name]
-            )
-            async with s3:
-                await s3._client.download_file(
-                    app_settings.bucket,
-                    file_obj.path,
-                    full_local_path_to_file
-                )
-                return FastapiFileResponse(
-                    path=full_local_path_to_file,
-                    media_type='application/octet-stream',
-                    filename=file_obj.name
+            # Answer conditional GET without touching S3 storage
+            encoding = get_content_encoding(file_obj, request.headers)
+            if is_not_modified(
+                    request.headers,
+                    get_file_etag(file_obj, encoding),
+                    file_obj.created_at
+            ):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers=get_validators(file_obj, encoding)
                 )
+            # Clients not accepting the codec get decompressed stream
+            if mode == 'presigned' and encoding == file_obj.codec:
+                return await presign_download(file_obj, s3)
+            if mode == 'local':
+                return await stage_file(file_obj, s3)
+            return await stream_file(file_obj, s3, request.headers)
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='File is not downloadable'
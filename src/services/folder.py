@@ -0,0 +1,191 @@
+import os
+from typing import Any, Dict, List
+
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import Folder as FolderModel
+from schemas.folder import FolderResponse
+
+from .base import RepositoryDB
+
+
+def get_ancestors(path: str) -> List[str]:
+    """
+    Return paths of all folders containing the path, from the root.
+    """
+    parts = path.rstrip('/').split('/')[:-1]
+    return ['/'.join(parts[:i]) + '/' for i in range(1, len(parts) + 1)]
+
+
+def get_parent(path: str) -> str | None:
+    ancestors = get_ancestors(path)
+    return ancestors[-1] if ancestors else None
+
+
+class RepositoryFolder(
+    RepositoryDB[FolderModel, FolderResponse, FolderResponse]
+):
+    """
+    Folders index with file counts and sizes of all nested files.
+
+    Totals are changed in the caller transaction, so they are committed
+    or rolled back together with the files rows.
+    """
+
+    async def _get_ids(
+            self, db: AsyncSession, paths: List[str]
+    ) -> Dict[str, int]:
+        statement = (
+            select(self._model.path, self._model.id).
+            where(self._model.path.in_(paths))
+        )
+        return dict((await db.execute(statement=statement)).all())
+
+    async def _get_or_create(
+            self, db: AsyncSession, user_id: Any, paths: List[str]
+    ) -> Dict[str, int]:
+        ids = await self._get_ids(db, paths)
+
+        # Sorted paths put parents before their children
+        for path in sorted(paths):
+            if path in ids:
+                continue
+            folder = self._model(
+                user_id=user_id,
+                parent_id=ids.get(get_parent(path)),
+                name=os.path.basename(path.rstrip('/')),
+                path=path,
+                files_count=0,
+                size=0
+            )
+            try:
+                async with db.begin_nested():
+                    db.add(folder)
+                ids[path] = folder.id
+            except IntegrityError:
+                # Created by a concurrent upload
+                ids[path] = await db.scalar(
+                    select(self._model.id).where(self._model.path == path)
+                )
+        return ids
+
+    async def _change_totals(
+            self,
+            db: AsyncSession,
+            ids: Dict[str, int],
+            totals: Dict[str, List[int]]
+    ) -> None:
+        table = self._model.__table__
+        statement = (
+            update(table).
+            where(table.c.id == bindparam('folder_id')).
+            values(files_count=table.c.files_count + bindparam('count'),
+                   size=table.c.size + bindparam('delta'))
+        )
+        # Same lock order for every transaction
+        params = [
+            {'folder_id': ids[path], 'count': count, 'delta': size}
+            for path, (count, size) in sorted(totals.items())
+            if path in ids
+        ]
+        if params:
+            await db.execute(statement, params)
+
+    @staticmethod
+    def _get_totals(files: List[tuple[str, int]], sign: int = 1):
+        totals: Dict[str, List[int]] = {}
+        for path, size in files:
+            for folder_path in get_ancestors(path):
+                folder_totals = totals.setdefault(folder_path, [0, 0])
+                folder_totals[0] += sign
+                folder_totals[1] += sign * size
+        return totals
+
+    async def add_files(
+            self,
+            db: AsyncSession,
+            user_id: Any,
+            files: List[tuple[str, int]]
+    ) -> List[int]:
+        """
+        Count (path, size) files in all their folders without commit.
+
+        Missing folders are created. Return folder id for each file.
+        """
+        totals = self._get_totals(files)
+        ids = await self._get_or_create(db, user_id, list(totals))
+        await self._change_totals(db, ids, totals)
+        return [ids[get_parent(path)] for path, _ in files]
+
+    async def remove_files(
+            self, db: AsyncSession, files: List[tuple[str, int]]
+    ) -> None:
+        """
+        Subtract (path, size) files from all their folders without commit.
+        """
+        totals = self._get_totals(files, sign=-1)
+        ids = await self._get_ids(db, list(totals))
+        await self._change_totals(db, ids, totals)
+
+    async def move_files(
+            self,
+            db: AsyncSession,
+            user_id: Any,
+            files: List[tuple[str, str, int]]
+    ) -> List[int]:
+        """
+        Move (old path, new path, size) files between folders without
+        commit.
+
+        Missing folders are created. Return new folder id for each file.
+        """
+        totals = self._get_totals(
+            [(old_path, size) for old_path, _, size in files], sign=-1
+        )
+        new_totals = self._get_totals(
+            [(new_path, size) for _, new_path, size in files]
+        )
+        for path, (count, size) in new_totals.items():
+            folder_totals = totals.setdefault(path, [0, 0])
+            folder_totals[0] += count
+            folder_totals[1] += size
+        ids = await self._get_ids(db, list(totals))
+        ids.update(await self._get_or_create(db, user_id, list(new_totals)))
+        # Common ancestors of old and new paths don't change
+        await self._change_totals(db, ids, {
+            path: folder_totals
+            for path, folder_totals in totals.items()
+            if folder_totals != [0, 0]
+        })
+        return [ids[get_parent(new_path)] for _, new_path, _ in files]
+
+    async def delete_empty(
+            self, db: AsyncSession, user_id: Any, prefix: str
+    ) -> None:
+        """
+        Delete folders under the path prefix left without files, without
+        commit.
+        """
+        statement = (
+            delete(self._model).
+            where(self._model.user_id == user_id,
+                  self._model.path.startswith(prefix, autoescape=True),
+                  self._model.files_count == 0)
+        )
+        await db.execute(statement=statement)
+
+    async def get_children(
+            self, db: AsyncSession, folder_id: int
+    ) -> List[FolderModel]:
+        statement = (
+            select(self._model).
+            where(self._model.parent_id == folder_id).
+            order_by(self._model.name)
+        )
+        results = await db.execute(statement=statement)
+        return results.scalars().all()
+
+
+folder_crud = RepositoryFolder(FolderModel)
@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, NamedTuple, Optional
+
+from botocore.exceptions import ClientError
+from sqlalchemy import and_, func, or_, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import app_settings
+from core.logger import LOGGING
+from db.db import async_session
+from models.models import Blob as BlobModel
+from models.models import File as FileModel
+from services.boto3 import s3_client
+from services.bulk import delete_s3_objects, get_used_keys
+from services.cache import metadata_cache
+from services.jobs import job_queue
+from services.metrics import S3_ERRORS
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+# S3 limit of keys listed by one request
+LIST_OBJECTS_LIMIT = 1000
+SCHEDULE_KEY = 'inventory:scheduled'
+REPORT_KEY = 'inventory:report'
+
+
+class StoredObject(NamedTuple):
+    key: str
+    size: int
+    # Set for the bucket objects only
+    last_modified: Optional[datetime] = None
+
+
+def get_stored_keys():
+    """
+    Return S3 keys the database refers to with the stored sizes.
+    """
+    blob_keys = select(
+        BlobModel.key.label('key'),
+        func.coalesce(BlobModel.stored_size, BlobModel.size).label('size')
+    )
+    file_keys = select(
+        func.coalesce(FileModel.key, FileModel.path).label('key'),
+        func.coalesce(FileModel.stored_size, FileModel.size).label('size')
+    ).where(FileModel.blob_id.is_(None))
+    return union_all(blob_keys, file_keys).subquery('keys')
+
+
+async def iter_bucket_pages(
+        s3, after: str = ''
+) -> AsyncIterator[list[StoredObject]]:
+    """
+    Yield pages of the bucket objects with keys after `after`.
+
+    S3 lists them in the byte order of the keys.
+    """
+    kwargs = {'Bucket': app_settings.bucket, 'MaxKeys': LIST_OBJECTS_LIMIT}
+    if after:
+        kwargs['StartAfter'] = after
+    while True:
+        response = await s3.list_objects_v2(**kwargs)
+        page = [
+            StoredObject(item['Key'], item['Size'], item['LastModified'])
+            for item in response.get('Contents', [])
+        ]
+        if page:
+            yield page
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+async def iter_db_pages(
+        db: AsyncSession, after: str = ''
+) -> AsyncIterator[list[StoredObject]]:
+    """
+    Yield pages of the keys in the database after `after`.
+
+    Keys are read in the byte order of S3 listings by keyset pagination,
+    a key shared by several rows is yielded once.
+    """
+    keys = get_stored_keys()
+    key = keys.c.key
+    if db.get_bind().dialect.name == 'postgresql':
+        key = key.collate('C')
+    batch_size = app_settings.inventory_batch_size
+    while True:
+        statement = (
+            select(keys.c.key, keys.c.size).
+            where(key > after).
+            order_by(key).
+            limit(batch_size)
+        )
+        rows = (await db.execute(statement)).all()
+        # Don't keep a snapshot open for the whole scan
+        await db.commit()
+        page = []
+        for row in rows:
+            if row.key != after:
+                page.append(StoredObject(row.key, row.size))
+            after = row.key
+        if page:
+            yield page
+        if len(rows) < batch_size:
+            return
+
+
+async def read_ahead(pages: AsyncIterator[list]) -> AsyncIterator:
+    """
+    Yield items of the pages while the next page is fetched.
+    """
+    next_page = asyncio.ensure_future(anext(pages))
+    try:
+        while True:
+            try:
+                page = await next_page
+            except StopAsyncIteration:
+                return
+            next_page = asyncio.ensure_future(anext(pages))
+            for item in page:
+                yield item
+    finally:
+        next_page.cancel()
+        await asyncio.gather(next_page, return_exceptions=True)
+        await pages.aclose()
+
+
+async def merge_keys(
+        objects: AsyncIterator[StoredObject],
+        rows: AsyncIterator[StoredObject]
+) -> AsyncIterator[tuple[Optional[StoredObject], Optional[StoredObject]]]:
+    """
+    Merge-join the bucket objects and database keys ordered by keys.
+
+    Yield (object, row) pairs, one of them is None if the key is
+    missing on its side.
+    """
+    obj = await anext(objects, None)
+    row = await anext(rows, None)
+    while obj is not None or row is not None:
+        if row is None or obj is not None and obj.key < row.key:
+            yield obj, None
+            obj = await anext(objects, None)
+        elif obj is None or row.key < obj.key:
+            yield None, row
+            row = await anext(rows, None)
+        else:
+            yield obj, row
+            obj = await anext(objects, None)
+            row = await anext(rows, None)
+
+
+async def get_missing_keys(s3, keys: list[str]) -> list[str]:
+    """
+    Return the keys without objects, rechecked one by one.
+
+    An object listed before its key was read from the database may be
+    uploaded in between.
+    """
+    semaphore = asyncio.Semaphore(app_settings.s3_batch_concurrency)
+
+    async def is_missing(key: str) -> bool:
+        try:
+            async with semaphore:
+                await s3.head_object(Bucket=app_settings.bucket, Key=key)
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return True
+            S3_ERRORS.inc(operation='head')
+            raise
+        return False
+
+    missing = await asyncio.gather(*(is_missing(key) for key in keys))
+    return [key for key, is_absent in zip(keys, missing) if is_absent]
+
+
+async def get_stale_keys(
+        s3, keys: list[str], before: datetime
+) -> list[str]:
+    """
+    Return the keys with objects last modified before `before`,
+    rechecked one by one.
+
+    An orphan may be uploaded again since it was listed, its new
+    upload may be running.
+    """
+    semaphore = asyncio.Semaphore(app_settings.s3_batch_concurrency)
+
+    async def is_stale(key: str) -> bool:
+        try:
+            async with semaphore:
+                response = await s3.head_object(
+                    Bucket=app_settings.bucket, Key=key
+                )
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            S3_ERRORS.inc(operation='head')
+            raise
+        return response['LastModified'] < before
+
+    stale = await asyncio.gather(*(is_stale(key) for key in keys))
+    return [key for key, is_old in zip(keys, stale) if is_old]
+
+
+async def fail_files(db: AsyncSession, keys: list[str]) -> int:
+    """
+    Mark files stored under the keys as failed and commit.
+
+    Return the number of files marked.
+    """
+    statement = (
+        update(FileModel).
+        where(or_(FileModel.key.in_(keys),
+                  and_(FileModel.key.is_(None), FileModel.path.in_(keys))),
+              FileModel.processing_status != 'failed').
+        values(processing_status='failed').
+        returning(FileModel.user_id)
+    )
+    user_ids = (await db.scalars(statement)).all()
+    await db.commit()
+    for user_id in set(user_ids):
+        await metadata_cache.invalidate(user_id)
+    return len(user_ids)
+
+
+async def check_keys(
+        orphans: list[str], missing: list[str], counts: Counter, fix: bool,
+        recent: datetime
+) -> None:
+    """
+    Report the orphan objects and missing ones, fix them if asked.
+
+    Orphans are deleted once they're still not referenced and not
+    modified since `recent`, files missing their objects are marked
+    as failed.
+    """
+    s3 = s3_client.client
+    missing = await get_missing_keys(s3, missing)
+    async with async_session() as db:
+        used_keys = await get_used_keys(db, orphans) if orphans else set()
+        orphans = [key for key in orphans if key not in used_keys]
+        for key in orphans:
+            logger.warning(f'Object {key} is not referenced')
+        for key in missing:
+            logger.warning(f'Object {key} is missing')
+        counts['orphan_objects'] += len(orphans)
+        counts['missing_objects'] += len(missing)
+        if not fix:
+            return
+        if missing:
+            counts['failed_files'] += await fail_files(db, missing)
+    if orphans:
+        orphans = await get_stale_keys(s3, orphans, recent)
+    if orphans:
+        await delete_s3_objects(s3, orphans)
+        counts['deleted_objects'] += len(orphans)
+
+
+async def schedule(delay: float) -> bool:
+    """
+    Queue a scheduled run unless one is already queued or running.
+    """
+    run_id = uuid.uuid4().hex
+    ttl = int(delay) + 2 * job_queue.visibility_timeout
+    if not await job_queue.redis.set(SCHEDULE_KEY, run_id, nx=True, ex=ttl):
+        return False
+    payload = {
+        'run_id': run_id, 'scheduled': True, 'fix': app_settings.inventory_fix
+    }
+    return await job_queue.enqueue(
+        'reconcile_storage', payload, delay=delay
+    ) is not None
+
+
+async def claim_schedule(run_id: str) -> bool:
+    """
+    Hold the schedule for the run, False if another run holds it.
+    """
+    ttl = 2 * job_queue.visibility_timeout
+    redis = job_queue.redis
+    # Expired while the workers were stopped
+    await redis.set(SCHEDULE_KEY, run_id, nx=True, ex=ttl)
+    if await redis.get(SCHEDULE_KEY) != run_id:
+        return False
+    await redis.expire(SCHEDULE_KEY, ttl)
+    return True
+
+
+async def finish_run(payload: dict, counts: Counter) -> None:
+    logger.info(f'Storage inventory is done: {dict(counts)}')
+    async with job_queue.redis.pipeline(transaction=True) as pipe:
+        pipe.delete(REPORT_KEY)
+        pipe.hset(REPORT_KEY, mapping={
+            **{name: 0 for name in ('objects', 'rows', 'orphan_objects',
+                                    'missing_objects', 'size_mismatches')},
+            **counts,
+            'fix': int(payload.get('fix', False)),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+        })
+        await pipe.execute()
+    if payload.get('scheduled'):
+        await job_queue.redis.delete(SCHEDULE_KEY)
+        if app_settings.inventory_interval:
+            await schedule(app_settings.inventory_interval)
+
+
+def compare_pair(
+        obj: Optional[StoredObject],
+        row: Optional[StoredObject],
+        orphans: list[str],
+        missing: list[str],
+        counts: Counter,
+        recent: datetime
+) -> None:
+    """
+    Count the merged pair, collect the key if one side is missing.
+    """
+    if obj is not None:
+        counts['objects'] += 1
+    if row is not None:
+        counts['rows'] += 1
+    if row is None:
+        # Its upload may be running
+        if obj.last_modified < recent:
+            orphans.append(obj.key)
+        else:
+            counts['recent_objects'] += 1
+    elif obj is None:
+        missing.append(row.key)
+    elif obj.size != row.size:
+        logger.warning(
+            f'Object {obj.key} has {obj.size} bytes, {row.size} expected'
+        )
+        counts['size_mismatches'] += 1
+
+
+@job_queue.handler('reconcile_storage')
+async def reconcile_storage(payload: dict) -> None:
+    """
+    Compare the bucket with the database from the checkpoint key on.
+
+    Runs for half of the job timeout, then queues the next job with
+    the last compared key and the counts so far.
+    """
+    if payload.get('scheduled') and not await claim_schedule(
+            payload['run_id']
+    ):
+        logger.info(f'Skip superseded storage inventory {payload["run_id"]}')
+        return
+    deadline = time.monotonic() + job_queue.visibility_timeout / 2
+    recent = datetime.now(timezone.utc) - timedelta(
+        seconds=app_settings.inventory_grace_period
+    )
+    fix = payload.get('fix', False)
+    after = payload.get('after', '')
+    counts = Counter(payload.get('counts', {}))
+    orphans = []
+    missing = []
+    async with async_session() as db:
+        objects = read_ahead(iter_bucket_pages(s3_client.client, after))
+        rows = read_ahead(iter_db_pages(db, after))
+        try:
+            async for obj, row in merge_keys(objects, rows):
+                after = (obj or row).key
+                compare_pair(obj, row, orphans, missing, counts, recent)
+                if len(orphans) + len(missing) >= LIST_OBJECTS_LIMIT:
+                    await check_keys(orphans, missing, counts, fix, recent)
+                    orphans, missing = [], []
+                if time.monotonic() > deadline:
+                    break
+            else:
+                after = None
+        finally:
+            await objects.aclose()
+            await rows.aclose()
+    await check_keys(orphans, missing, counts, fix, recent)
+
+    if after is None:
+        await finish_run(payload, counts)
+        return
+    payload = {**payload, 'after': after, 'counts': dict(counts)}
+    if await job_queue.enqueue('reconcile_storage', payload) is None:
+        # Retried from the same checkpoint
+        raise RuntimeError('Job reconcile_storage is not queued')
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from core.config import app_settings
+from core.logger import LOGGING
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+Handler = Callable[[dict], Awaitable[Any]]
+
+
+class JobHandler(NamedTuple):
+    run: Handler
+    # Called once the job is out of attempts
+    on_dead: Optional[Handler] = None
+
+
+# Pop a ready job, hide it for the visibility timeout and count attempt
+RESERVE_SCRIPT = """
+local id = redis.call('RPOP', KEYS[1])
+if not id then
+    return nil
+end
+redis.call('ZADD', KEYS[2], ARGV[1], id)
+local key = ARGV[2] .. id
+if redis.call('EXISTS', key) == 0 then
+    return {id}
+end
+redis.call('HINCRBY', key, 'attempts', 1)
+return {id, redis.call('HGET', key, 'name'),
+        redis.call('HGET', key, 'payload'),
+        redis.call('HGET', key, 'attempts')}
+"""
+
+# Move jobs with a score in the past from a sorted set to the queue
+REQUEUE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+                       'LIMIT', 0, ARGV[2])
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('LPUSH', KEYS[2], id)
+end
+return #ids
+"""
+
+
+class Job(NamedTuple):
+    id: str
+    name: str
+    payload: dict
+    attempts: int
+
+
+class JobQueue:
+    """
+    Reliable job queue in Redis.
+
+    A reserved job stays in the "processing" set until it's acked.
+    Jobs of a crashed worker reappear after the visibility timeout,
+    failed ones are retried with exponential backoff and moved to the
+    "dead" list after max_attempts, so handlers must be idempotent.
+    The list keeps the last `dead_max` jobs for `dead_ttl` seconds.
+    """
+
+    def __init__(
+            self,
+            name: str = 'jobs',
+            *,
+            visibility_timeout: int = app_settings.jobs_visibility_timeout,
+            max_attempts: int = app_settings.jobs_max_attempts,
+            retry_delay: float = app_settings.jobs_retry_delay,
+            dead_max: int = app_settings.jobs_dead_max,
+            dead_ttl: int = app_settings.jobs_dead_ttl
+    ):
+        self.redis = None
+        self.visibility_timeout = visibility_timeout
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._dead_max = dead_max
+        self._dead_ttl = dead_ttl
+        self._handlers: dict[str, JobHandler] = {}
+        self._ready_key = f'{name}:ready'
+        self._processing_key = f'{name}:processing'
+        self._delayed_key = f'{name}:delayed'
+        self._dead_key = f'{name}:dead'
+        self._job_prefix = f'{name}:job:'
+        self._reserve = None
+        self._requeue = None
+
+    def init(self, redis) -> None:
+        self.redis = redis
+        self._reserve = redis.register_script(RESERVE_SCRIPT)
+        self._requeue = redis.register_script(REQUEUE_SCRIPT)
+
+    def handler(self, name: str, on_dead: Optional[Handler] = None):
+        """
+        Register the coroutine function running jobs with the name.
+        """
+        def decorator(func: Handler) -> Handler:
+            self._handlers[name] = JobHandler(func, on_dead)
+            return func
+        return decorator
+
+    def get_handler(self, name: str) -> Optional[JobHandler]:
+        return self._handlers.get(name)
+
+    async def enqueue(
+            self, name: str, payload: dict, *, delay: float = 0
+    ) -> Optional[str]:
+        """
+        Add the job, return its id or None if Redis is not available.
+
+        The job is run not earlier than `delay` seconds later.
+        """
+        if self.redis is None:
+            logger.warning(f'Job queue is not started, skip job {name}')
+            return None
+        job_id = uuid.uuid4().hex
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(self._job_prefix + job_id, mapping={
+                    'name': name,
+                    'payload': json.dumps(payload),
+                    'attempts': 0,
+                })
+                if delay:
+                    pipe.zadd(self._delayed_key, {job_id: time.time() + delay})
+                else:
+                    pipe.lpush(self._ready_key, job_id)
+                await pipe.execute()
+        except Exception as err:
+            logger.error(f'{err}')
+            return None
+        return job_id
+
+    async def requeue_due(self, batch_size: int = 100) -> int:
+        """
+        Return expired and delayed jobs to the queue.
+        """
+        now = time.time()
+        count = 0
+        for key in (self._processing_key, self._delayed_key):
+            count += await self._requeue(
+                keys=[key, self._ready_key], args=[now, batch_size]
+            )
+        return count
+
+    async def reserve(self) -> Optional[Job]:
+        result = await self._reserve(
+            keys=[self._ready_key, self._processing_key],
+            args=[time.time() + self.visibility_timeout, self._job_prefix]
+        )
+        if not result:
+            return None
+        if len(result) == 1:
+            # Job data is gone, nothing to run
+            await self.redis.zrem(self._processing_key, result[0])
+            return None
+        job_id, name, payload, attempts = result
+        return Job(job_id, name, json.loads(payload), int(attempts))
+
+    async def ack(self, job: Job) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._processing_key, job.id)
+            pipe.delete(self._job_prefix + job.id)
+            await pipe.execute()
+
+    async def fail(self, job: Job) -> bool:
+        """
+        Schedule a retry of the job, return True if it's out of attempts.
+        """
+        dead = job.attempts >= self._max_attempts
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._processing_key, job.id)
+            if dead:
+                logger.error(f'Job {job.name} {job.id} is dead')
+                pipe.lpush(self._dead_key, job.id)
+                pipe.ltrim(self._dead_key, 0, self._dead_max - 1)
+                # Data of trimmed jobs is left to expire
+                pipe.expire(self._job_prefix + job.id, self._dead_ttl)
+                pipe.expire(self._dead_key, self._dead_ttl)
+            else:
+                delay = self._retry_delay * 2 ** (job.attempts - 1)
+                pipe.zadd(self._delayed_key, {job.id: time.time() + delay})
+            await pipe.execute()
+        return dead
+
+
+class Worker:
+    """
+    Run jobs of the queue, at most `concurrency` of them at once.
+    """
+
+    def __init__(
+            self,
+            queue: JobQueue,
+            *,
+            concurrency: int = app_settings.jobs_concurrency,
+            poll_interval: float = app_settings.jobs_poll_interval
+    ):
+        self._queue = queue
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._poll_interval = poll_interval
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _run_job(self, job: Job) -> None:
+        handler = self._queue.get_handler(job.name)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler of job {job.name}')
+            # Don't outlive the visibility timeout: the job is rerun
+            await asyncio.wait_for(
+                handler.run(job.payload), self._queue.visibility_timeout
+            )
+        except Exception as err:
+            logger.error(f'Job {job.name} {job.id} failed: {err!r}')
+            try:
+                dead = await self._queue.fail(job)
+                if dead and handler and handler.on_dead:
+                    await handler.on_dead(job.payload)
+            except Exception as err:
+                logger.error(f'{err}')
+        else:
+            try:
+                await self._queue.ack(job)
+            except Exception as err:
+                logger.error(f'{err}')
+        finally:
+            self._semaphore.release()
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            await self._semaphore.acquire()
+            try:
+                await self._queue.requeue_due()
+                job = await self._queue.reserve()
+            except Exception as err:
+                logger.error(f'{err}')
+                job = None
+            if job is None:
+                self._semaphore.release()
+                try:
+                    await asyncio.wait_for(stop.wait(), self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        # Let running jobs finish, unfinished ones are rerun later
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+job_queue = JobQueue()
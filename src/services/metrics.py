@@ -0,0 +1,234 @@
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Iterable
+
+from db.db import get_pool_stats
+from db.redis import redis_client
+from services.security import password_hasher
+
+# Seconds, from a cached lookup to a large transfer
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    items = ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"').
+            replace('\n', '\\n')
+        )
+        for name, value in labels.items()
+    )
+    return '{' + items + '}'
+
+
+class Metric:
+    """
+    Base of metrics kept in process and rendered in Prometheus format.
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[tuple, float] = {}
+
+    def _samples(self) -> Iterable[tuple[str, dict, float]]:
+        for labels, value in self._values.items():
+            yield self.name, dict(labels), value
+
+    def render(self) -> list[str]:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        for name, labels, value in self._samples():
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.items())
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Gauge read from a callback returning {labels tuple: value}.
+    """
+    type = 'gauge'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            collect: Callable[[], dict[tuple, float]]
+    ):
+        super().__init__(name, documentation)
+        self._collect = collect
+
+    def _samples(self) -> Iterable[tuple[str, dict, float]]:
+        for labels, value in self._collect().items():
+            yield self.name, dict(labels), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            buckets: tuple = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation)
+        self._buckets = buckets
+        self._counts: dict[tuple, list[int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.items())
+        # Cumulative counts of buckets and "+Inf" as the last one
+        counts = self._counts.setdefault(key, [0] * (len(self._buckets) + 1))
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        self._values[key] = self._values.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> Iterable[tuple[str, dict, float]]:
+        for key, counts in self._counts.items():
+            labels = dict(key)
+            for bound, count in zip(self._buckets + ('+Inf',), counts):
+                yield f'{self.name}_bucket', {**labels, 'le': bound}, count
+            yield f'{self.name}_sum', labels, self._values[key]
+            yield f'{self.name}_count', labels, counts[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    'http_request_duration_seconds',
+    'HTTP requests latency until the last byte of the response.'
+))
+FILE_STAGE_SECONDS = registry.register(Histogram(
+    'file_stage_duration_seconds',
+    'Latency of upload and download stages.'
+))
+FILE_BYTES = registry.register(Counter(
+    'file_bytes_total',
+    'File bytes received from and sent to clients.'
+))
+S3_ERRORS = registry.register(Counter(
+    's3_errors_total',
+    'Failed S3 storage requests.'
+))
+CACHE_REQUESTS = registry.register(Counter(
+    'cache_requests_total',
+    'Cache lookups by tier where the value was found.'
+))
+
+
+async def timed_chunks(
+        chunks: AsyncIterator[bytes], **labels
+) -> AsyncIterator[bytes]:
+    """
+    Pass chunks through, timing the whole stream as a stage.
+    """
+    with FILE_STAGE_SECONDS.time(**labels):
+        async for chunk in chunks:
+            yield chunk
+
+
+def collect_pools() -> dict[tuple, float]:
+    values = {}
+    for pool, stats in (
+            ('db', get_pool_stats()),
+            ('cache', redis_client.get_pool_stats()),
+    ):
+        for state, value in stats.items():
+            values[(('pool', pool), ('state', state))] = value
+    return values
+
+
+def collect_password_hasher() -> dict[tuple, float]:
+    return {
+        (('state', 'in_flight'),): password_hasher.in_flight,
+        (('state', 'queued'),): password_hasher.queue_depth,
+        (('state', 'rejected'),): password_hasher.rejected,
+    }
+
+
+registry.register(Gauge(
+    'pool_connections',
+    'Connections of DB and Redis pools by state.',
+    collect_pools
+))
+registry.register(Gauge(
+    'password_hashing',
+    'Password hashing calls in flight, queued and rejected in total.',
+    collect_password_hasher
+))
+
+
+class MetricsMiddleware:
+    """
+    Observe latency of every request by method, route and status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Route templates keep the labels set small
+            route = scope.get('route')
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope['method'],
+                route=route.path if route else 'unmatched',
+                status=status_code
+            )
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+
+from core.config import app_settings
+from core.logger import LOGGING
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+
+class MultipartUploader:
+    """
+    Upload a stream of chunks to S3 by parts.
+
+    Parts are sent as soon as they are filled, at most `concurrency`
+    of them at a time. Reading of the source stream waits for a free
+    slot, so memory use is bounded by part_size * (concurrency + 1).
+    """
+
+    def __init__(
+            self,
+            client,
+            bucket: str,
+            key: str,
+            *,
+            part_size: int = app_settings.s3_multipart_part_size,
+            concurrency: int = app_settings.s3_multipart_concurrency
+    ):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._part_size = part_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._upload_id = None
+        self._tasks: list[asyncio.Task] = []
+        self.size = 0
+        self.etag = None
+
+    async def _upload_part(self, part_number: int, body: bytes) -> dict:
+        try:
+            response = await self._client.upload_part(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self._semaphore.release()
+
+    async def _send_part(self, body: bytes):
+        if self._upload_id is None:
+            response = await self._client.create_multipart_upload(
+                Bucket=self._bucket, Key=self._key
+            )
+            self._upload_id = response['UploadId']
+
+        await self._semaphore.acquire()
+        # Stop reading the source as soon as any part failed
+        for task in self._tasks:
+            if task.done() and task.exception():
+                self._semaphore.release()
+                raise task.exception()
+        self._tasks.append(asyncio.create_task(
+            self._upload_part(len(self._tasks) + 1, body)
+        ))
+
+    async def upload(self, chunks: AsyncIterator[bytes]) -> int:
+        """
+        Upload all chunks and return the total size in bytes.
+        """
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                self.size += len(chunk)
+                buffer += chunk
+                while len(buffer) >= self._part_size:
+                    await self._send_part(bytes(buffer[:self._part_size]))
+                    del buffer[:self._part_size]
+
+            if self._upload_id is None:
+                # Small file: a single request is enough
+                response = await self._client.put_object(
+                    Bucket=self._bucket, Key=self._key, Body=bytes(buffer)
+                )
+                self.etag = response['ETag']
+                return self.size
+
+            if buffer:
+                await self._send_part(bytes(buffer))
+            parts = await asyncio.gather(*self._tasks)
+            response = await self._client.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+            self.etag = response['ETag']
+            return self.size
+        except BaseException:
+            await self.abort()
+            raise
+
+    async def abort(self):
+        """
+        Cancel parts in flight and drop the uploaded ones.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._upload_id is not None:
+            try:
+                await self._client.abort_multipart_upload(
+                    Bucket=self._bucket,
+                    Key=self._key,
+                    UploadId=self._upload_id
+                )
+            except Exception as err:
+                logger.error(f'{err}')
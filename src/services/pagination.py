@@ -0,0 +1,62 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any
+
+from fastapi import HTTPException, status
+
+# JSON types of the sort key values by the sort order
+CURSOR_VALUE_TYPES = {
+    'created_at': str,
+    'name': str,
+    'size': int,
+    'score': (int, float),
+}
+
+
+def is_json_type(value: Any, types) -> bool:
+    # "true" is not a number here
+    return isinstance(value, types) and not isinstance(value, bool)
+
+
+def encode_cursor(order_by: str, value: Any, id: int) -> str:
+    """
+    Pack the sort key of the last returned row into an opaque cursor.
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    data = json.dumps([order_by, value, id]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor: str, order_by: str) -> tuple[Any, int]:
+    """
+    Unpack the cursor made by "encode_cursor" for the same sort order.
+    """
+    try:
+        cursor_order_by, value, id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode())
+        )
+        if cursor_order_by != order_by or not is_json_type(id, int):
+            raise ValueError
+        # A value of another column type fails in the query
+        if not is_json_type(value, CURSOR_VALUE_TYPES.get(order_by, object)):
+            raise ValueError
+        if order_by == 'created_at':
+            value = datetime.fromisoformat(value)
+    except (binascii.Error, TypeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid cursor'
+        )
+    return value, id
+
+
+def glob_to_like(pattern: str) -> str:
+    """
+    Convert "*" and "?" wildcards to a LIKE pattern escaped with "\\".
+    """
+    for char in ('\\', '%', '_'):
+        pattern = pattern.replace(char, '\\' + char)
+    return pattern.replace('*', '%').replace('?', '_')
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import app_settings
+from core.logger import LOGGING
+from db.db import async_session
+from models.models import File as FileModel
+from services.boto3 import s3_client
+from services.codecs import decode_chunks
+from services.file import file_crud, get_storage_key
+from services.folder import folder_crud
+from services.jobs import job_queue
+from services.usage import usage_crud
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+FileHook = Callable[[FileModel, AsyncSession, object], Awaitable[None]]
+
+SWEEP_KEY = 'processing:sweep_scheduled'
+# Files queued by one query of the sweep
+SWEEP_BATCH_SIZE = 500
+
+# Extra steps run for every uploaded file after its content is checked,
+# e.g. thumbnails or antivirus scan. A hook raises to retry the job.
+file_hooks: list[FileHook] = []
+
+
+async def read_content(s3, file_obj: FileModel) -> tuple[str, int]:
+    """
+    Return SHA-256 and size of the original file content.
+    """
+    s3_obj = await s3.get_object(
+        Bucket=app_settings.bucket, Key=get_storage_key(file_obj)
+    )
+    sha256 = hashlib.sha256()
+    size = 0
+    body = s3_obj['Body']
+    chunks = body.iter_chunks(app_settings.download_chunk_size)
+    async with body:
+        async for chunk in decode_chunks(chunks, file_obj.codec):
+            sha256.update(chunk)
+            size += len(chunk)
+    return sha256.hexdigest(), size
+
+
+async def reconcile_size(
+        db: AsyncSession, file_obj: FileModel, size: int
+) -> None:
+    """
+    Fix the file size and its folders and user totals to the stored one.
+    """
+    logger.warning(
+        f'File {file_obj.path} size {file_obj.size} is {size} in S3'
+    )
+    await folder_crud.remove_files(db, [(file_obj.path, file_obj.size)])
+    await folder_crud.add_files(
+        db, file_obj.user_id, [(file_obj.path, size)]
+    )
+    await usage_crud.add(
+        db, file_obj.user_id, count=0, size=size - file_obj.size
+    )
+    await file_crud.update(db, db_obj=file_obj, obj_in={'size': size})
+
+
+async def mark_failed(payload: dict) -> None:
+    async with async_session() as db:
+        file_obj = await file_crud.get(db=db, id=payload['file_id'])
+        if file_obj is not None:
+            await file_crud.update(
+                db, db_obj=file_obj, obj_in={'processing_status': 'failed'}
+            )
+
+
+@job_queue.handler('process_file', on_dead=mark_failed)
+async def process_file(payload: dict) -> None:
+    async with async_session() as db:
+        file_obj = await file_crud.get(db=db, id=payload['file_id'])
+        if file_obj is None or file_obj.processing_status == 'ready':
+            return
+        await file_crud.update(
+            db, db_obj=file_obj, obj_in={'processing_status': 'processing'}
+        )
+
+        sha256, size = await read_content(s3_client.client, file_obj)
+        if file_obj.sha256 and file_obj.sha256 != sha256:
+            # Retries can't fix the stored content
+            logger.error(f'File {file_obj.path} checksum mismatch')
+            await file_crud.update(
+                db, db_obj=file_obj, obj_in={'processing_status': 'failed'}
+            )
+            return
+        if size != file_obj.size:
+            await reconcile_size(db, file_obj, size)
+
+        for hook in file_hooks:
+            await hook(file_obj, db, s3_client.client)
+
+        # Presigned uploads get their checksum here
+        await file_crud.update(
+            db,
+            db_obj=file_obj,
+            obj_in={'processing_status': 'ready', 'sha256': sha256}
+        )
+
+
+async def schedule_sweep(delay: float) -> bool:
+    """
+    Queue a sweep of pending files unless one is already queued.
+    """
+    ttl = int(delay) + 2 * job_queue.visibility_timeout
+    if not await job_queue.redis.set(SWEEP_KEY, 1, nx=True, ex=ttl):
+        return False
+    return await job_queue.enqueue(
+        'requeue_pending', {'scheduled': True}, delay=delay
+    ) is not None
+
+
+@job_queue.handler('requeue_pending')
+async def requeue_pending(payload: dict) -> None:
+    """
+    Queue processing of files again if they're pending for too long.
+
+    Their job is lost when queueing failed on upload, a file with its
+    job still queued is processed once anyway.
+    """
+    before = datetime.utcnow() - timedelta(
+        seconds=app_settings.processing_pending_timeout
+    )
+    after = 0
+    count = 0
+    while True:
+        async with async_session() as db:
+            file_ids = (await db.scalars(
+                select(FileModel.id).
+                where(FileModel.processing_status == 'pending',
+                      FileModel.created_at < before,
+                      FileModel.id > after).
+                order_by(FileModel.id).
+                limit(SWEEP_BATCH_SIZE)
+            )).all()
+        for file_id in file_ids:
+            if await job_queue.enqueue(
+                    'process_file', {'file_id': file_id}
+            ) is None:
+                raise RuntimeError('Job process_file is not queued')
+        count += len(file_ids)
+        if len(file_ids) < SWEEP_BATCH_SIZE:
+            break
+        after = file_ids[-1]
+    if count:
+        logger.warning(f'Queued processing of {count} pending files again')
+
+    if payload.get('scheduled'):
+        await job_queue.redis.delete(SWEEP_KEY)
+        if app_settings.processing_sweep_interval:
+            await schedule_sweep(app_settings.processing_sweep_interval)
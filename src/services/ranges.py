@@ -0,0 +1,126 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import HTTPException, status
+
+# Larger range sets are ignored and the whole file is returned
+MAX_RANGES = 16
+
+
+def format_http_date(value: datetime) -> str:
+    """
+    Format naive UTC datetime for "Last-Modified" like headers.
+    """
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def parse_http_date(value: str) -> datetime | None:
+    try:
+        return parsedate_to_datetime(value).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    Check "If-None-Match" header with the weak comparison.
+    """
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+def is_not_modified(headers, etag: str, last_modified: datetime) -> bool:
+    """
+    Check conditional GET headers against the file validators.
+    """
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is not None:
+        since = parse_http_date(if_modified_since)
+        if since is not None:
+            modified = last_modified.replace(
+                tzinfo=timezone.utc, microsecond=0
+            )
+            return modified <= since
+    return False
+
+
+def is_range_fresh(headers, etag: str, last_modified: datetime) -> bool:
+    """
+    Check "If-Range" header: ranges are served only for the same file.
+    """
+    if_range = headers.get('if-range')
+    if if_range is None:
+        return True
+    if if_range.startswith(('"', 'W/"')):
+        return not if_range.startswith('W/') and if_range == etag
+    since = parse_http_date(if_range)
+    return since is not None and (
+        last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    )
+
+
+def get_suffix_range(length: str, size: int) -> tuple[int, int] | None:
+    """
+    Return the range of "bytes=-<length>", None if it's empty.
+    """
+    suffix = int(length)
+    if suffix <= 0 or size == 0:
+        return None
+    return max(size - suffix, 0), size - 1
+
+
+def get_open_range(
+        start: str, end: str, size: int
+) -> tuple[int, int] | None:
+    """
+    Return the range of "bytes=<start>-[<end>]", None if it's past the
+    end of the file.
+    """
+    first = int(start)
+    last = int(end) if end else size - 1
+    if end and first > last:
+        raise ValueError(f'Range {start}-{end} is reversed')
+    if first >= size:
+        return None
+    return first, min(last, size - 1)
+
+
+def parse_range_header(header: str, size: int) -> list[tuple[int, int]]:
+    """
+    Return inclusive byte ranges requested by "Range" header.
+
+    An empty list means the header must be ignored, HTTP 416 is raised
+    when none of the ranges can be satisfied.
+    """
+    unit, _, ranges_spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not ranges_spec:
+        return []
+
+    ranges = []
+    for spec in ranges_spec.split(','):
+        start, sep, end = spec.strip().partition('-')
+        if not sep:
+            return []
+        try:
+            if start:
+                byte_range = get_open_range(start, end, size)
+            else:
+                byte_range = get_suffix_range(end, size)
+        except ValueError:
+            return []
+        if byte_range is not None:
+            ranges.append(byte_range)
+
+    if len(ranges) > MAX_RANGES:
+        return []
+    if not ranges:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail='Requested range not satisfiable',
+            headers={'Content-Range': f'bytes */{size}'}
+        )
+    return ranges
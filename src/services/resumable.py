@@ -0,0 +1,320 @@
+import logging
+import math
+import uuid
+
+from fastapi import HTTPException, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import app_settings
+from core.logger import LOGGING
+from schemas.file import FileUpload, UploadSessionResponse
+from services.file import (
+    create_uploaded_file,
+    enqueue_processing,
+    file_crud,
+    get_file_params,
+)
+from services.metrics import FILE_BYTES, FILE_STAGE_SECONDS, S3_ERRORS
+from services.usage import check_quota, usage_crud
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+# S3 limit of parts of one multipart upload
+MAX_PARTS = 10000
+
+
+def get_session_key(upload_id: str) -> str:
+    return f'uploads:{upload_id}'
+
+
+def get_parts_key(upload_id: str) -> str:
+    return f'uploads:{upload_id}:parts'
+
+
+def get_part_size(size: int) -> int:
+    """
+    Return part size fitting the file in the S3 parts limit.
+    """
+    return max(app_settings.s3_multipart_part_size, -(-size // MAX_PARTS))
+
+
+def get_offset(size: int, part_size: int, part_numbers) -> int:
+    """
+    Return length of the uploaded prefix, parts after a gap don't count.
+    """
+    number = 1
+    while number in part_numbers:
+        number += 1
+    return min((number - 1) * part_size, size)
+
+
+async def get_upload_session(redis, upload_id: str, user) -> dict:
+    session = await redis.hgetall(get_session_key(upload_id))
+    if not session or int(session['user_id']) != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Upload not found'
+        )
+    return session
+
+
+async def get_uploaded_parts(redis, upload_id: str) -> dict[int, str]:
+    parts = await redis.hgetall(get_parts_key(upload_id))
+    return {int(number): etag for number, etag in parts.items()}
+
+
+async def delete_upload_session(redis, upload_id: str) -> None:
+    await redis.delete(get_session_key(upload_id), get_parts_key(upload_id))
+
+
+async def create_upload_session(
+        path: str,
+        name: str,
+        size: int,
+        db: AsyncSession,
+        user,
+        s3,
+        redis
+) -> UploadSessionResponse:
+    """
+    Start a resumable upload of the file by parts.
+    """
+    # Prepare "file_name" and "path" params
+    file_name, path = get_file_params(name, f'{user.email}/', path)
+    if not file_name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='File name is required'
+        )
+    if size <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='File size must be positive'
+        )
+    part_size = get_part_size(size)
+    if part_size > app_settings.upload_chunk_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=(
+                'File size must not exceed '
+                f'{app_settings.upload_chunk_max_size * MAX_PARTS} bytes'
+            )
+        )
+    if await file_crud.get_by_path(db=db, path=path):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='File already exists'
+        )
+    check_quota(await usage_crud.get_by_user_id(db, user.id), size)
+
+    upload_id = uuid.uuid4().hex
+    key = f'blobs/uploads/{upload_id}'
+    try:
+        response = await s3.create_multipart_upload(
+            Bucket=app_settings.bucket, Key=key
+        )
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='upload')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
+        )
+
+    session_key = get_session_key(upload_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(session_key, mapping={
+            'user_id': user.id,
+            'path': path,
+            'name': file_name,
+            'size': size,
+            'part_size': part_size,
+            'key': key,
+            's3_upload_id': response['UploadId'],
+        })
+        pipe.expire(session_key, app_settings.upload_session_ttl)
+        await pipe.execute()
+    logger.info(f'Start upload of file {path} from {user.email}')
+    return UploadSessionResponse(
+        id=upload_id,
+        path=path,
+        size=size,
+        offset=0,
+        part_size=part_size,
+        expires_in=app_settings.upload_session_ttl
+    )
+
+
+async def get_upload_offset(upload_id: str, user, redis) -> Response:
+    """
+    Return the uploaded prefix length in "Upload-Offset" header.
+    """
+    session = await get_upload_session(redis, upload_id, user)
+    parts = await get_uploaded_parts(redis, upload_id)
+    offset = get_offset(
+        int(session['size']), int(session['part_size']), parts
+    )
+    return Response(headers={
+        'Upload-Offset': str(offset),
+        'Upload-Length': session['size'],
+        'Cache-Control': 'no-store',
+    })
+
+
+async def upload_chunk(
+        upload_id: str, request: Request, user, s3, redis
+) -> Response:
+    """
+    Upload one part of the file at "Upload-Offset".
+
+    Chunks are S3 parts, so each of them is sent whole and may be sent
+    in parallel with the others or again after a failure. A chunk is
+    read into memory, sessions limit its size.
+    """
+    session = await get_upload_session(redis, upload_id, user)
+    size = int(session['size'])
+    part_size = int(session['part_size'])
+    try:
+        offset = int(request.headers['upload-offset'])
+    except (KeyError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Upload-Offset header is required'
+        )
+    if offset < 0 or offset >= size or offset % part_size:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f'Offset must be a multiple of {part_size} below {size}'
+        )
+
+    expected = min(part_size, size - offset)
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > expected:
+            break
+    if len(body) != expected:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Chunk at offset {offset} must be {expected} bytes'
+        )
+
+    part_number = offset // part_size + 1
+    try:
+        with FILE_STAGE_SECONDS.time(
+                operation='upload_resumable', stage='s3'
+        ):
+            response = await s3.upload_part(
+                Bucket=app_settings.bucket,
+                Key=session['key'],
+                UploadId=session['s3_upload_id'],
+                PartNumber=part_number,
+                Body=bytes(body)
+            )
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='upload')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
+        )
+    FILE_BYTES.inc(len(body), operation='upload')
+
+    parts_key = get_parts_key(upload_id)
+    ttl = app_settings.upload_session_ttl
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(parts_key, part_number, response['ETag'])
+        pipe.expire(parts_key, ttl)
+        pipe.expire(get_session_key(upload_id), ttl)
+        pipe.hkeys(parts_key)
+        *_, part_numbers = await pipe.execute()
+    offset = get_offset(size, part_size, {int(n) for n in part_numbers})
+    return Response(
+        status_code=status.HTTP_204_NO_CONTENT,
+        headers={'Upload-Offset': str(offset)}
+    )
+
+
+async def complete_upload_session(
+        upload_id: str, db: AsyncSession, user, s3, redis
+):
+    """
+    Assemble the uploaded parts and create the file.
+    """
+    session = await get_upload_session(redis, upload_id, user)
+    size = int(session['size'])
+    part_size = int(session['part_size'])
+    parts = await get_uploaded_parts(redis, upload_id)
+    if len(parts) < math.ceil(size / part_size):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Upload is not finished',
+            headers={
+                'Upload-Offset': str(get_offset(size, part_size, parts))
+            }
+        )
+
+    try:
+        with FILE_STAGE_SECONDS.time(
+                operation='upload_resumable', stage='s3_complete'
+        ):
+            await s3.complete_multipart_upload(
+                Bucket=app_settings.bucket,
+                Key=session['key'],
+                UploadId=session['s3_upload_id'],
+                MultipartUpload={'Parts': [
+                    {'PartNumber': number, 'ETag': etag}
+                    for number, etag in sorted(parts.items())
+                ]}
+            )
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='upload')
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Something went wrong'
+        )
+    # Only one of concurrent requests creates the file
+    if not await redis.delete(get_session_key(upload_id)):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Upload is already completed'
+        )
+    await redis.delete(get_parts_key(upload_id))
+    logger.info(f'Upload file {session["path"]} from {user.email}')
+
+    # Its checksum is computed by processing job
+    file_obj = await create_uploaded_file(
+        db,
+        s3,
+        FileUpload(user_id=user.id,
+                   path=session['path'],
+                   name=session['name'],
+                   size=size,
+                   key=session['key']),
+        session['key'],
+        'upload_resumable'
+    )
+    await enqueue_processing([file_obj])
+    return file_obj
+
+
+async def abort_upload_session(
+        upload_id: str, user, s3, redis
+) -> Response:
+    """
+    Drop the upload session and its uploaded parts.
+    """
+    session = await get_upload_session(redis, upload_id, user)
+    await delete_upload_session(redis, upload_id)
+    try:
+        await s3.abort_multipart_upload(
+            Bucket=app_settings.bucket,
+            Key=session['key'],
+            UploadId=session['s3_upload_id']
+        )
+    except Exception as err:
+        logger.error(f'{err}')
+        S3_ERRORS.inc(operation='upload')
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,75 @@
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.db import get_session
+from models.models import File as FileModel
+from schemas.file import FilesSearch, UserFilesResponse
+from services.cache import metadata_cache
+from services.file import (
+    file_crud,
+    get_cache_name,
+    get_filter_clauses,
+    load_files_page,
+)
+from services.pagination import decode_cursor, encode_cursor
+from services.security import manager
+
+
+def get_search_clause(search: FilesSearch):
+    """
+    Return case-insensitive substring or prefix match of the text.
+    """
+    column = getattr(FileModel, search.field)
+    if search.match == 'prefix':
+        return column.istartswith(search.q, autoescape=True)
+    return column.icontains(search.q, autoescape=True)
+
+
+async def load_fuzzy_page(
+        search: FilesSearch, db: AsyncSession, user
+) -> UserFilesResponse:
+    after = None
+    if search.cursor:
+        after = decode_cursor(search.cursor, 'score')
+
+    # One extra row tells whether there is a next page
+    rows = await file_crud.get_page_by_similarity(
+        db,
+        user.id,
+        search.field,
+        search.q,
+        *get_filter_clauses(search),
+        after=after,
+        limit=search.limit + 1
+    )
+    next_cursor = None
+    if len(rows) > search.limit:
+        rows = rows[:search.limit]
+        last, score = rows[-1]
+        next_cursor = encode_cursor('score', score, last.id)
+    return UserFilesResponse(
+        account_id=user.id,
+        files=[file_obj for file_obj, _ in rows],
+        next_cursor=next_cursor
+    )
+
+
+async def search_files(
+        search: FilesSearch,
+        db: AsyncSession = Depends(get_session),
+        user=Depends(manager)
+) -> UserFilesResponse:
+    async def load():
+        if search.match == 'fuzzy':
+            files_page = await load_fuzzy_page(search, db, user)
+        else:
+            files_page = await load_files_page(
+                search, db, user, get_search_clause(search)
+            )
+        return files_page.model_dump(mode='json')
+
+    return UserFilesResponse.model_validate(
+        await metadata_cache.get_or_load(
+            user.id, get_cache_name('search', search), load
+        )
+    )
@@ -1,6 +1,17 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException, status
 from fastapi_login import LoginManager
+from passlib.context import CryptContext
 
 from core.config import app_settings
+from core.logger import LOGGING
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
 
 manager = LoginManager(
     secret=app_settings.secret,
@@ -8,16 +19,98 @@ manager = LoginManager(
     default_expiry=app_settings.token_expires,
 )
 
+# Hashes with fewer rounds are upgraded on the next login
+pwd_context = CryptContext(
+    schemes=['bcrypt'],
+    bcrypt__default_rounds=app_settings.bcrypt_rounds,
+    bcrypt__min_rounds=app_settings.bcrypt_rounds,
+)
+
+
+class PasswordHasher:
+    """
+    Run bcrypt on a dedicated thread pool, off the event loop.
+
+    At most `workers` hashes run at once and `queue_size` more wait for
+    a thread. Requests over that limit are rejected with HTTP 429
+    instead of piling up behind a login burst.
+    """
+
+    def __init__(
+            self,
+            *,
+            workers: int = app_settings.password_hash_workers,
+            queue_size: int = app_settings.password_hash_queue_size
+    ):
+        self._workers = workers
+        self._limit = workers + queue_size
+        self._executor = None
+        self.in_flight = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self.in_flight - self._workers, 0)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._workers, thread_name_prefix='bcrypt'
+            )
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self.in_flight >= self._limit:
+            self.rejected += 1
+            logger.warning('Password hashing queue is full')
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail='Too many requests, try again later',
+                headers={'Retry-After': '1'}
+            )
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), func, *args
+            )
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify_and_update(
+            self, password: str, hashed_password: str
+    ) -> tuple[bool, Optional[str]]:
+        """
+        Check the password, return a new hash if the stored one is weak.
+        """
+        return await self._run(
+            pwd_context.verify_and_update, password, hashed_password
+        )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
+
 
-def hash_password(plaintext_password: str):
+async def hash_password(plaintext_password: str) -> str:
     """
     Return the hash of a password.
     """
-    return manager.pwd_context.hash(plaintext_password)
+    return await password_hasher.hash(plaintext_password)
 
 
-def verify_password(password_input: str, hashed_password: str):
+async def verify_password(
+        password_input: str, hashed_password: str
+) -> tuple[bool, Optional[str]]:
     """
-    Check if the provided password matches.
+    Check if the provided password matches, return the upgraded hash.
     """
-    return manager.pwd_context.verify(password_input, hashed_password)
+    return await password_hasher.verify_and_update(
+        password_input, hashed_password
+    )
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+
+from core.config import app_settings
+from core.logger import LOGGING
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+T = TypeVar('T')
+
+# Results of earlier calls are dropped with taking the lock, so waiters
+# never get them
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    redis.call('DEL', KEYS[2])
+    return 1
+end
+return 0
+"""
+# Delete the lock only if it's still held by the token
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one.
+
+    Callers of a key in flight get the result or the exception of the
+    first call, nothing is kept once it's done. A cancelled caller
+    doesn't cancel the call for the others.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def _done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # Nobody may be waiting after cancellation
+        if not future.cancelled():
+            future.exception()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._done(key, future))
+        return await asyncio.shield(future)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class RedisSingleFlight:
+    """
+    Single flight across processes with a Redis lock.
+
+    The lock holder runs the call and shares its JSON-ready result
+    through Redis for `lock_timeout` seconds, the other processes wait
+    for it. If the holder is gone, a waiter runs the call itself.
+    Calls of one process are coalesced before taking the lock.
+    """
+
+    def __init__(
+            self,
+            prefix: str = 'singleflight',
+            *,
+            lock_timeout: float = app_settings.singleflight_lock_timeout,
+            poll_interval: float = app_settings.singleflight_poll_interval
+    ):
+        self.redis = None
+        self._prefix = prefix
+        self._lock_timeout = lock_timeout
+        self._lock_timeout_ms = int(lock_timeout * 1000)
+        self._poll_interval = poll_interval
+        self._local = SingleFlight()
+        self._lock = None
+        self._release = None
+
+    def init(self, redis) -> None:
+        self.redis = redis
+        self._lock = redis.register_script(ACQUIRE_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+
+    async def _acquire(
+            self, lock_key: str, result_key: str, token: str
+    ) -> tuple[bool, Optional[str]]:
+        """
+        Take the lock or wait for the result of its holder.
+        """
+        deadline = time.monotonic() + self._lock_timeout
+        while not await self._lock(
+                keys=[lock_key, result_key],
+                args=[token, self._lock_timeout_ms]
+        ):
+            await asyncio.sleep(self._poll_interval)
+            # Checked before the lock, which is free once it's shared
+            data = await self.redis.get(result_key)
+            if data is not None or time.monotonic() > deadline:
+                return False, data
+        return True, None
+
+    async def _share(self, result_key: str, result: Any) -> None:
+        try:
+            await self.redis.set(
+                result_key, json.dumps(result), px=self._lock_timeout_ms
+            )
+        except Exception as err:
+            logger.error(f'{err}')
+
+    async def _unlock(self, lock_key: str, token: str) -> None:
+        try:
+            await self._release(keys=[lock_key], args=[token])
+        except Exception as err:
+            logger.error(f'{err}')
+
+    async def _run(self, key: str, func: Callable[[], Awaitable[Any]]):
+        lock_key = f'{self._prefix}:{key}:lock'
+        result_key = f'{self._prefix}:{key}:result'
+        token = uuid.uuid4().hex
+        try:
+            acquired, data = await self._acquire(lock_key, result_key, token)
+        except Exception as err:
+            logger.error(f'{err}')
+            return await func()
+        if data is not None:
+            return json.loads(data)
+        if not acquired:
+            # The holder is stuck, don't wait for it any longer
+            return await func()
+
+        try:
+            result = await func()
+            # Shared before unlock, so waiters never run the func again
+            await self._share(result_key, result)
+            return result
+        finally:
+            await self._unlock(lock_key, token)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]):
+        """
+        Return result of the func run once for the key by all processes.
+        """
+        if self.redis is None:
+            return await self._local.do(key, func)
+        return await self._local.do(key, lambda: self._run(key, func))
@@ -0,0 +1,183 @@
+import logging
+from typing import Any, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import app_settings
+from core.logger import LOGGING
+from db.db import async_session
+from models.models import File as FileModel
+from models.models import Usage as UsageModel
+from models.models import User as UserModel
+from schemas.usage import UsageResponse
+from services.cache import metadata_cache
+from services.jobs import job_queue
+
+from .base import RepositoryDB
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+
+def get_quota(usage: Optional[UsageModel]) -> Optional[int]:
+    """
+    Return the user quota in bytes or None if it's unlimited.
+    """
+    if usage is not None and usage.quota is not None:
+        return usage.quota
+    return app_settings.storage_quota or None
+
+
+def check_quota(usage: Optional[UsageModel], size: int = 0) -> None:
+    """
+    Raise HTTP 413 if `size` more bytes don't fit in the user quota.
+    """
+    used = usage.size if usage is not None else 0
+    quota = get_quota(usage)
+    if quota is not None and used + size > quota:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='Storage quota exceeded'
+        )
+
+
+class RepositoryUsage(RepositoryDB[UsageModel, Any, Any]):
+    """
+    Per-user totals of files.
+
+    Totals are changed in the caller transaction together with the
+    files rows, reconciliation recounts them from the files.
+    """
+
+    async def get_by_user_id(
+            self, db: AsyncSession, user_id: int
+    ) -> Optional[UsageModel]:
+        statement = select(self._model).where(self._model.user_id == user_id)
+        results = await db.execute(statement=statement)
+        return results.scalar_one_or_none()
+
+    async def _change(
+            self, db: AsyncSession, user_id: int, count: int, size: int
+    ) -> Optional[UsageModel]:
+        statement = (
+            update(self._model).
+            where(self._model.user_id == user_id).
+            values(files_count=self._model.files_count + count,
+                   size=self._model.size + size).
+            returning(self._model).
+            execution_options(populate_existing=True)
+        )
+        results = await db.execute(statement=statement)
+        return results.scalar_one_or_none()
+
+    async def add(
+            self, db: AsyncSession, user_id: int, *, count: int, size: int
+    ) -> UsageModel:
+        """
+        Change the user totals without commit and return them.
+        """
+        usage = await self._change(db, user_id, count, size)
+        if usage is not None:
+            return usage
+        usage = self._model(user_id=user_id, files_count=count, size=size)
+        try:
+            async with db.begin_nested():
+                db.add(usage)
+        except IntegrityError:
+            # Created by a concurrent upload
+            usage = await self._change(db, user_id, count, size)
+        return usage
+
+    async def reconcile(
+            self, db: AsyncSession, user_ids: List[int]
+    ) -> List[int]:
+        """
+        Recount totals of the users from their files and commit.
+
+        Return ids of the users whose totals were wrong.
+        """
+        # Uploads of the users wait for the new totals
+        statement = (
+            select(self._model).
+            where(self._model.user_id.in_(user_ids)).
+            order_by(self._model.user_id).
+            with_for_update()
+        )
+        usages = {
+            usage.user_id: usage
+            for usage in (await db.scalars(statement)).all()
+        }
+        statement = (
+            select(FileModel.user_id,
+                   func.count(),
+                   func.coalesce(func.sum(FileModel.size), 0)).
+            where(FileModel.user_id.in_(user_ids)).
+            group_by(FileModel.user_id)
+        )
+        totals = {
+            user_id: (count, size)
+            for user_id, count, size in await db.execute(statement)
+        }
+
+        recounted = []
+        for user_id in user_ids:
+            count, size = totals.get(user_id, (0, 0))
+            usage = usages.get(user_id)
+            if usage is None:
+                if not count:
+                    continue
+                # A concurrent first upload fails the job, it's retried
+                usage = self._model(user_id=user_id)
+                db.add(usage)
+            elif (usage.files_count, usage.size) == (count, size):
+                continue
+            usage.files_count = count
+            usage.size = size
+            recounted.append(user_id)
+        await db.commit()
+        return recounted
+
+
+usage_crud = RepositoryUsage(UsageModel)
+
+
+async def get_usage(db: AsyncSession, user) -> UsageResponse:
+    async def load():
+        usage = await usage_crud.get_by_user_id(db, user.id)
+        return UsageResponse(
+            files_count=usage.files_count if usage else 0,
+            size=usage.size if usage else 0,
+            quota=get_quota(usage)
+        ).model_dump()
+
+    return UsageResponse.model_validate(
+        await metadata_cache.get_or_load(user.id, 'usage', load)
+    )
+
+
+@job_queue.handler('reconcile_usage')
+async def reconcile_usage(payload: dict) -> None:
+    """
+    Recount usage of a batch of users and queue the next batch.
+    """
+    batch_size = app_settings.usage_reconcile_batch_size
+    async with async_session() as db:
+        statement = (
+            select(UserModel.id).
+            where(UserModel.id > payload.get('after', 0)).
+            order_by(UserModel.id).
+            limit(batch_size)
+        )
+        user_ids = (await db.scalars(statement)).all()
+        if not user_ids:
+            return
+        recounted = await usage_crud.reconcile(db, user_ids)
+
+    for user_id in recounted:
+        logger.warning(f'Usage of user {user_id} is recounted')
+        await metadata_cache.invalidate(user_id)
+    if len(user_ids) == batch_size:
+        await job_queue.enqueue('reconcile_usage', {'after': user_ids[-1]})
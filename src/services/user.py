@@ -1,39 +1,74 @@
+from contextlib import asynccontextmanager
 from typing import Optional
 
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from db.db import get_session
 from models import User
 from schemas.user import UserCreate
-from services.security import hash_password, manager
+from services.cache import user_cache
+from services.security import hash_password, manager, verify_password
 
 
-@manager.user_loader(session_provider=get_session)
-async def get_user(
-    email: str,
-    db: Optional[AsyncSession] = None,
-    session_provider: Optional[AsyncSession] = None
-) -> Optional[User]:
+async def get_user(email: str, db: AsyncSession) -> Optional[User]:
     """
     Return the user with the corresponding email.
     """
-    if db is None:
-        db = await anext(session_provider())
     query = select(User).where(User.email == email)
     user = (await db.scalars(query)).first()
     return user
 
 
+@manager.user_loader(session_provider=get_session)
+async def load_user(email: str, session_provider) -> Optional[User]:
+    """
+    Return the authenticated user principal, cached without password.
+    """
+    async def load():
+        async with asynccontextmanager(session_provider)() as db:
+            user = await get_user(email, db)
+        if user is None:
+            return None
+        return {'id': user.id, 'email': user.email}
+
+    data = await user_cache.get_or_load(email, load)
+    return User(**data) if data else None
+
+
 async def create_user(db: AsyncSession, user: UserCreate) -> User:
     """
     Create a new entry in the database user table.
     """
     user_data = user.model_dump()
-    user_data['hashed_password'] = hash_password(user.password)
+    user_data['hashed_password'] = await hash_password(user.password)
     user_data.pop('password')
     db_user = User(**user_data)
     db.add(db_user)
     await db.commit()
     await db.refresh(db_user)
+    await user_cache.invalidate(db_user.email)
     return db_user
+
+
+async def authenticate_user(
+        db: AsyncSession, email: str, password: str
+) -> Optional[User]:
+    """
+    Return the user if the password matches, upgrading a weak hash.
+    """
+    user = await get_user(email, db)
+    if user is None:
+        return None
+    verified, new_hash = await verify_password(password, user.hashed_password)
+    if not verified:
+        return None
+    if new_hash:
+        await db.execute(
+            update(User).
+            where(User.id == user.id).
+            values(hashed_password=new_hash)
+        )
+        await db.commit()
+    return user
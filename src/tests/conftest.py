@@ -1,11 +1,27 @@
-from unittest import mock
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
 
+from models import Base
+from services import base
 
-def mock_cache():
-    mock.patch(
-        'fastapi_cache.decorator.cache', lambda *args, **kwargs: lambda f: f
-    ).start()
 
+@pytest_asyncio.fixture
+async def engine(tmp_path):
+    """
+    SQLite database with all tables, dropped after the test.
+    """
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path}/test.db')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
 
-def pytest_sessionstart(session):
-    mock_cache()
+
+@pytest_asyncio.fixture
+async def db(engine, monkeypatch):
+    session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    # Shared lookups open sessions of their own
+    monkeypatch.setattr(base, 'async_session', session)
+    async with session() as db:
+        yield db
@@ -81,4 +81,6 @@ def test_get_files_info(cache):
     )
 
     assert response.status_code == 200
-    assert response.json() == {'account_id': 1, 'files': []}
+    assert response.json() == {
+        'account_id': 1, 'files': [], 'next_cursor': None
+    }
@@ -0,0 +1,52 @@
+import io
+import tarfile
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from services.archive import ArchiveEntry, iter_archive
+
+FILES = {'a.txt': b'a' * 1000, 'dir/b.bin': bytes(range(256)) * 10}
+
+
+async def iter_chunks(data: bytes):
+    for i in range(0, len(data), 100):
+        yield data[i:i + 100]
+
+
+async def iter_entries():
+    for name, data in FILES.items():
+        yield ArchiveEntry(
+            name=name,
+            size=len(data),
+            modified=datetime(2024, 1, 6, 11, 49, 56),
+            chunks=iter_chunks(data)
+        )
+
+
+async def build_archive(archive_format: str) -> bytes:
+    return b''.join([
+        chunk async for chunk in iter_archive(iter_entries(), archive_format)
+    ])
+
+
+@pytest.mark.asyncio
+async def test_zip_archive():
+    archive = zipfile.ZipFile(io.BytesIO(await build_archive('zip')))
+
+    assert archive.testzip() is None
+    assert {name: archive.read(name) for name in archive.namelist()} == FILES
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('archive_format', ['tar', 'tgz'])
+async def test_tar_archive(archive_format):
+    archive = tarfile.open(
+        fileobj=io.BytesIO(await build_archive(archive_format))
+    )
+
+    assert {
+        name: archive.extractfile(name).read()
+        for name in archive.getnames()
+    } == FILES
@@ -0,0 +1,209 @@
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from models import Blob, File, Folder, Usage, User
+from schemas.file import FilesMove, FileUpload, PresignedUploadComplete
+from services import bulk
+from services.bulk import (
+    check_move,
+    delete_s3_objects,
+    get_new_path,
+    get_operation,
+    get_used_keys,
+    run_move,
+    start_operation,
+)
+from services.file import complete_upload, file_crud, presign_upload
+from services.jobs import job_queue
+
+USER = SimpleNamespace(id=1, email='a@example.com')
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email=USER.email, hashed_password='x'))
+    await db.commit()
+    return db
+
+
+async def create_files(db, *paths, sha256='a' * 64):
+    return await file_crud.create_multi(db, objs_in=[
+        FileUpload(user_id=1,
+                   path=path,
+                   name=path.rsplit('/', 1)[-1],
+                   size=10,
+                   sha256=sha256,
+                   key=f'blobs/{sha256}')
+        for path in paths
+    ])
+
+
+async def get_folders(db) -> dict:
+    folders = (await db.scalars(select(Folder))).all()
+    return {folder.path: folder.files_count for folder in folders}
+
+
+def test_get_new_path():
+    file_obj = File(path='a@example.com/a/b/c.txt', name='c.txt')
+
+    assert get_new_path(
+        file_obj, {'prefix': 'a@example.com/a/', 'to': 'a@example.com/d/'}
+    ) == 'a@example.com/d/b/c.txt'
+    assert get_new_path(
+        file_obj, {'to': 'a@example.com/d/'}
+    ) == 'a@example.com/d/c.txt'
+    assert get_new_path(
+        file_obj, {'to': 'a@example.com/e.txt'}
+    ) == 'a@example.com/e.txt'
+
+
+@pytest.mark.parametrize('data', [
+    {'paths': ['a@example.com/a.txt'], 'to': 'b@example.com/'},
+    {'ids': [1, 2], 'to': 'a@example.com/b.txt'},
+    {'prefix': 'a@example.com/a/', 'ids': [1], 'to': 'a@example.com/b/'},
+    {'prefix': 'a@example.com/a/', 'to': 'a@example.com/b'},
+    {'prefix': 'a@example.com/a/', 'to': 'a@example.com/a/b/'},
+    {'to': 'a@example.com/b/'},
+])
+def test_check_move_rejects(data):
+    with pytest.raises(HTTPException):
+        check_move(FilesMove(**data), USER)
+
+
+@pytest.mark.asyncio
+async def test_delete_multi(db):
+    await create_files(db, 'a@example.com/a/1.txt', 'a@example.com/a/2.txt')
+    await create_files(db, 'a@example.com/b/3.txt', sha256='b' * 64)
+    file_objs = (await db.scalars(
+        select(File).where(File.path.startswith('a@example.com/a/'))
+    )).all()
+
+    keys = await file_crud.delete_multi(db, db_objs=file_objs)
+    await db.commit()
+
+    assert keys == ['blobs/' + 'a' * 64]
+    assert await get_folders(db) == {
+        'a@example.com/': 1, 'a@example.com/a/': 0, 'a@example.com/b/': 1
+    }
+    blobs = (await db.scalars(select(Blob.sha256))).all()
+    assert blobs == ['b' * 64]
+    usage = await db.get(Usage, 1)
+    assert (usage.files_count, usage.size) == (1, 10)
+    assert await get_used_keys(db, keys + ['blobs/' + 'b' * 64]) == {
+        'blobs/' + 'b' * 64
+    }
+
+
+@pytest.mark.asyncio
+async def test_move_multi(db):
+    file_obj, = await create_files(db, 'a@example.com/a/1.txt')
+    # Files stored by their path keep it as the key
+    file_obj.key = None
+    await db.commit()
+
+    await file_crud.move_multi(
+        db, moves=[(file_obj, 'a@example.com/b/c/2.txt')]
+    )
+    await db.commit()
+
+    file_obj = (await db.scalars(select(File))).one()
+    await db.refresh(file_obj)
+    assert (file_obj.path, file_obj.name, file_obj.key) == (
+        'a@example.com/b/c/2.txt', '2.txt', 'a@example.com/a/1.txt'
+    )
+    folder = await db.get(Folder, file_obj.folder_id)
+    assert folder.path == 'a@example.com/b/c/'
+    assert await get_folders(db) == {
+        'a@example.com/': 1,
+        'a@example.com/a/': 0,
+        'a@example.com/b/': 1,
+        'a@example.com/b/c/': 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_upload_to_vacated_path_keeps_moved_content(db):
+    objects = {'a@example.com/a/1.txt': b'moved'}
+
+    class FakeS3:
+        async def generate_presigned_url(self, operation, Params, ExpiresIn):
+            # The client uploads right away
+            objects[Params['Key']] = b'new'
+            return ''
+
+        async def head_object(self, Bucket, Key):
+            return {'ContentLength': len(objects[Key])}
+
+    file_obj, = await create_files(db, 'a@example.com/a/1.txt')
+    file_obj.key = None
+    await db.commit()
+    await file_crud.move_multi(db, moves=[(file_obj, 'a@example.com/b.txt')])
+    await db.commit()
+
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    upload = await presign_upload('a/1.txt', '', 1, db, USER, FakeS3(), redis)
+    new_obj = await complete_upload(
+        PresignedUploadComplete(id=upload.id), db, USER, FakeS3(), redis
+    )
+
+    moved_obj = await file_crud.get(db, file_obj.id)
+    await db.refresh(moved_obj)
+    assert moved_obj.key == 'a@example.com/a/1.txt'
+    assert new_obj.path == 'a@example.com/a/1.txt'
+    assert new_obj.key == f'blobs/uploads/{upload.id}'
+    assert objects[moved_obj.key] == b'moved'
+
+
+@pytest.mark.asyncio
+async def test_delete_s3_objects_by_batches():
+    requests = []
+
+    class FakeS3:
+        async def delete_objects(self, Bucket, Delete):
+            requests.append(len(Delete['Objects']))
+            return {}
+
+    await delete_s3_objects(FakeS3(), [str(i) for i in range(2500)])
+
+    assert sorted(requests) == [500, 1000, 1000]
+
+
+@pytest.mark.asyncio
+async def test_delete_s3_objects_raises_on_errors():
+    class FakeS3:
+        async def delete_objects(self, Bucket, Delete):
+            return {'Errors': [{'Key': '1', 'Code': 'AccessDenied'}]}
+
+    with pytest.raises(RuntimeError):
+        await delete_s3_objects(FakeS3(), ['1'])
+
+
+@pytest.mark.asyncio
+async def test_retried_batch_is_counted_once(db, engine, monkeypatch):
+    await create_files(db, 'a@example.com/a/1.txt', 'a@example.com/a/2.txt')
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(job_queue, 'redis', redis)
+    monkeypatch.setattr(bulk, 'async_session', sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False
+    ))
+    data = FilesMove(ids=[1, 2], to='a@example.com/b/')
+    operation = await start_operation('move', data.model_dump(), USER, redis)
+    payload = {
+        **data.model_dump(), 'operation_id': operation.id, 'user_id': 1
+    }
+
+    # The job failed after the commit and is run again
+    await run_move(payload)
+    await run_move(payload)
+
+    operation = await get_operation(operation.id, USER, redis)
+    assert (operation.status, operation.processed, operation.skipped) == (
+        'done', 2, 0
+    )
@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+
+from services.cache import LRUCache, MetadataCache, UserCache
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    async def execute(self):
+        return [
+            await getattr(self.redis, name)(*args)
+            for name, args in self.commands
+        ]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def pttl(self, key):
+        return self.ttls.get(key, -1) if key in self.data else -2
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        if ex is not None:
+            self.ttls[key] = ex * 1000
+        return True
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        async def acquire(keys, args):
+            return await self.set(keys[0], args[0], nx=True)
+
+        async def release(keys, args):
+            await self.delete(keys[0])
+
+        return acquire if 'NX' in script else release
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=-1)
+    cache.set('a', 1)
+
+    assert cache.get('a') is None
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_loads_once():
+    cache = MetadataCache(ttl=60, local_size=10)
+    cache.init(FakeRedis())
+    calls = []
+
+    async def load():
+        calls.append(1)
+        return {'id': 1}
+
+    assert await cache.get_or_load(1, 'file:1', load) == {'id': 1}
+    assert await cache.get_or_load(1, 'file:1', load) == {'id': 1}
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_coalesces_misses():
+    cache = MetadataCache(ttl=60, local_size=10)
+    cache.init(FakeRedis())
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'id': 1}
+
+    values = await asyncio.gather(
+        *(cache.get_or_load(1, 'file:1', load) for _ in range(5))
+    )
+
+    assert values == [{'id': 1}] * 5
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_refreshes_early():
+    redis = FakeRedis()
+    cache = MetadataCache(ttl=60, local_size=10, early_refresh=0.2)
+    cache.init(redis)
+    values = iter([{'size': 1}, {'size': 2}])
+
+    async def load():
+        return next(values)
+
+    assert await cache.get_or_load(1, 'files', load) == {'size': 1}
+    key = next(key for key in redis.data if key.endswith(':files'))
+    cache._local.clear()
+    # Far from the expiry the entry is kept
+    redis.ttls[key] = 50 * 1000
+    assert await cache.get_or_load(1, 'files', load) == {'size': 1}
+    cache._local.clear()
+    # The last moment before the expiry is always refreshed
+    redis.ttls[key] = 0
+    assert await cache.get_or_load(1, 'files', load) == {'size': 2}
+    assert redis.ttls[key] == 60 * 1000
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_invalidate_user():
+    redis = FakeRedis()
+    cache = MetadataCache(ttl=60, local_size=10)
+    cache.init(redis)
+    # Another process sharing the same Redis
+    other_cache = MetadataCache(ttl=60, local_size=10)
+    other_cache.init(redis)
+    values = iter([{'size': 1}, {'size': 2}, {'size': 3}])
+
+    async def load():
+        return next(values)
+
+    assert await cache.get_or_load(1, 'files', load) == {'size': 1}
+    assert await cache.get_or_load(2, 'files', load) == {'size': 2}
+    await other_cache.invalidate(1)
+
+    assert await cache.get_or_load(1, 'files', load) == {'size': 3}
+    assert await cache.get_or_load(2, 'files', load) == {'size': 2}
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_skips_missing_values():
+    cache = MetadataCache(ttl=60, local_size=10)
+    cache.init(FakeRedis())
+
+    async def load():
+        return None
+
+    assert await cache.get_or_load(1, 'file:1', load) is None
+    keys = {key for key in cache.redis.data if key.startswith('metadata:')}
+    assert keys == {'metadata:1:version'}
+
+
+@pytest.mark.asyncio
+async def test_user_cache_invalidate():
+    cache = UserCache(ttl=60, local_ttl=60, local_size=10)
+    cache.init(FakeRedis())
+    values = iter([{'id': 1}, {'id': 2}])
+
+    async def load():
+        return next(values)
+
+    assert await cache.get_or_load('a@example.com', load) == {'id': 1}
+    assert await cache.get_or_load('a@example.com', load) == {'id': 1}
+    await cache.invalidate('a@example.com')
+
+    assert await cache.get_or_load('a@example.com', load) == {'id': 2}
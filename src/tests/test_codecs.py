@@ -0,0 +1,83 @@
+import gzip
+import random
+
+import pytest
+
+from services.codecs import (
+    StreamEncoder,
+    accepts_encoding,
+    choose_codec,
+    decode_chunks,
+)
+
+TEXT = b'2024-02-17 INFO request served in 12ms\n' * 1000
+
+
+async def iter_chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def read_all(chunks) -> bytes:
+    return b''.join([chunk async for chunk in chunks])
+
+
+@pytest.mark.parametrize('content_type, name, sample, expected', [
+    ('text/csv', 'a.csv', TEXT, 'gzip'),
+    ('application/octet-stream', 'app.log', TEXT, 'gzip'),
+    ('image/png', 'a.png', TEXT, None),
+    ('application/zip', 'a.zip', TEXT, None),
+    ('text/plain', 'a.txt', b'short', None),
+    (None, 'data', TEXT, 'gzip'),
+    (None, 'data', random.Random(0).randbytes(10000), None),
+])
+def test_choose_codec(content_type, name, sample, expected):
+    assert choose_codec(content_type, name, sample) == expected
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate, br', True),
+    ('br;q=1.0, gzip;q=0.5', True),
+    ('gzip;q=0', False),
+    ('*', True),
+    ('identity', False),
+    ('', False),
+    (None, False),
+])
+def test_accepts_encoding(header, expected):
+    assert accepts_encoding(header, 'gzip') == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('chunk_size', [100, 64 * 1024, 1024 * 1024])
+async def test_encode_text(chunk_size):
+    encoder = StreamEncoder('text/plain', 'app.log', sample_size=4096)
+    stored = await read_all(encoder.encode(iter_chunks(TEXT, chunk_size)))
+
+    assert encoder.codec == 'gzip'
+    assert encoder.size == len(TEXT)
+    assert len(stored) < len(TEXT) / 5
+    assert gzip.decompress(stored) == TEXT
+    decoded = await read_all(decode_chunks(iter_chunks(stored, 1000), 'gzip'))
+    assert decoded == TEXT
+
+
+@pytest.mark.asyncio
+async def test_encode_random_bytes():
+    data = random.Random(0).randbytes(200000)
+    encoder = StreamEncoder(None, 'data.bin', sample_size=4096)
+    stored = await read_all(encoder.encode(iter_chunks(data, 1000)))
+
+    assert encoder.codec is None
+    assert encoder.size == len(data)
+    assert stored == data
+    decoded = await read_all(decode_chunks(iter_chunks(stored, 1000), None))
+    assert decoded == data
+
+
+@pytest.mark.asyncio
+async def test_encode_empty():
+    encoder = StreamEncoder('text/plain', 'empty.txt')
+    assert await read_all(encoder.encode(iter_chunks(b'', 10))) == b''
+    assert encoder.codec is None
+    assert encoder.size == 0
@@ -0,0 +1,154 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+
+from models import File
+from services import file
+from services.disk_cache import DiskCache
+
+
+def make_fetch(content: bytes, calls: list, delay: float = 0):
+    async def fetch(path):
+        calls.append(path)
+        await asyncio.sleep(delay)
+        with open(path, 'wb') as file:
+            file.write(content)
+    return fetch
+
+
+@pytest.mark.asyncio
+async def test_hit_after_miss(tmp_path):
+    cache = DiskCache(str(tmp_path), 100)
+    await cache.start()
+    calls = []
+    path = await cache.get('a', make_fetch(b'aaa', calls))
+    cache.release(path)
+    assert await cache.get('a', make_fetch(b'aaa', calls)) == path
+    cache.release(path)
+
+    assert len(calls) == 1
+    with open(path, 'rb') as file:
+        assert file.read() == b'aaa'
+    assert cache.size == 3
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_fetch_once(tmp_path):
+    cache = DiskCache(str(tmp_path), 100)
+    calls = []
+    fetch = make_fetch(b'aaa', calls, delay=0.05)
+    paths = await asyncio.gather(*(cache.get('a', fetch) for _ in range(10)))
+    assert len(calls) == 1
+    assert len(set(paths)) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_fetch_is_not_cached(tmp_path):
+    cache = DiskCache(str(tmp_path), 100)
+
+    async def fail(path):
+        with open(path, 'wb') as file:
+            file.write(b'partial')
+        raise OSError('S3 is gone')
+
+    with pytest.raises(OSError):
+        await cache.get('a', fail)
+    assert cache.size == 0
+    assert not any(files for _, _, files in os.walk(tmp_path))
+
+    calls = []
+    await cache.get('a', make_fetch(b'aaa', calls))
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), 10)
+    calls = []
+    paths = {}
+    for key in 'abc':
+        paths[key] = await cache.get(key, make_fetch(b'x' * 4, calls))
+        cache.release(paths[key])
+        if key == 'b':
+            # "a" is used again, so "b" is the oldest one
+            cache.release(await cache.get('a', make_fetch(b'', calls)))
+
+    assert cache.size == 8
+    assert not os.path.exists(paths['b'])
+    assert os.path.exists(paths['a']) and os.path.exists(paths['c'])
+
+
+@pytest.mark.asyncio
+async def test_pinned_files_are_not_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path), 5)
+    calls = []
+    pinned = await cache.get('a', make_fetch(b'x' * 4, calls))
+    other = await cache.get('b', make_fetch(b'x' * 4, calls))
+    assert os.path.exists(pinned)
+    cache.release(other)
+
+    cache.release(pinned)
+    cache.release(await cache.get('c', make_fetch(b'x' * 4, calls)))
+    assert not os.path.exists(pinned)
+    assert cache.size <= 5
+
+
+@pytest.mark.asyncio
+async def test_fetched_files_are_pinned_before_others_evict(tmp_path):
+    cache = DiskCache(str(tmp_path), 5)
+    calls = []
+    cache.release(await cache.get('b', make_fetch(b'x' * 4, calls)))
+
+    async def use_b_once_a_is_cached():
+        while len(cache._entries) < 2:
+            await asyncio.sleep(0)
+        return await cache.get('b', make_fetch(b'', calls))
+
+    # "b" is used before the fetch of "a" returns
+    path, _ = await asyncio.gather(
+        cache.get('a', make_fetch(b'x' * 4, calls, delay=0.01)),
+        use_b_once_a_is_cached()
+    )
+
+    assert os.path.exists(path)
+
+
+@pytest.mark.asyncio
+async def test_stage_file_releases_failed_response(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path), 100)
+    monkeypatch.setattr(file, 'disk_cache', cache)
+
+    class FakeS3:
+        async def download_file(self, bucket, key, path):
+            with open(path, 'wb') as local_file:
+                local_file.write(b'aaa')
+
+    async def send(message):
+        raise OSError('Client is gone')
+
+    file_obj = File(id=1, name='1.txt', path='a@example.com/1.txt', size=3,
+                    created_at=datetime(2024, 1, 1))
+    response = await file.stage_file(file_obj, FakeS3())
+    assert cache._pins
+
+    with pytest.raises(OSError):
+        await response({'type': 'http', 'method': 'GET'}, None, send)
+    assert not cache._pins
+
+
+@pytest.mark.asyncio
+async def test_start_indexes_cached_files(tmp_path):
+    cache = DiskCache(str(tmp_path), 100)
+    path = await cache.get('a', make_fetch(b'aaa', []))
+    with open(f'{path}.123.tmp', 'wb') as file:
+        file.write(b'partial')
+
+    restarted = DiskCache(str(tmp_path), 100)
+    await restarted.start()
+    assert restarted.size == 3
+    assert not os.path.exists(f'{path}.123.tmp')
+    calls = []
+    assert await restarted.get('a', make_fetch(b'aaa', calls)) == path
+    assert calls == []
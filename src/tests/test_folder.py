@@ -0,0 +1,99 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+
+from models import Folder, User
+from services.folder import folder_crud, get_ancestors
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email='a@example.com', hashed_password='x'))
+    await db.commit()
+    return db
+
+
+async def get_folders(db) -> dict:
+    folders = (await db.scalars(select(Folder))).all()
+    return {
+        folder.path: (folder.files_count, folder.size) for folder in folders
+    }
+
+
+def test_get_ancestors():
+    assert get_ancestors('a@example.com/a/b/c.txt') == [
+        'a@example.com/', 'a@example.com/a/', 'a@example.com/a/b/'
+    ]
+    assert get_ancestors('a@example.com/a/') == ['a@example.com/']
+
+
+@pytest.mark.asyncio
+async def test_add_files(db):
+    folder_ids = await folder_crud.add_files(db, 1, [
+        ('a@example.com/a/1.txt', 10),
+        ('a@example.com/a/b/2.txt', 20),
+        ('a@example.com/3.txt', 5),
+    ])
+    await db.commit()
+
+    assert await get_folders(db) == {
+        'a@example.com/': (3, 35),
+        'a@example.com/a/': (2, 30),
+        'a@example.com/a/b/': (1, 20),
+    }
+    folders = {
+        folder.path: folder for folder in
+        (await db.scalars(select(Folder))).all()
+    }
+    assert folder_ids == [
+        folders['a@example.com/a/'].id,
+        folders['a@example.com/a/b/'].id,
+        folders['a@example.com/'].id,
+    ]
+    assert folders['a@example.com/a/b/'].parent_id == (
+        folders['a@example.com/a/'].id
+    )
+    assert folders['a@example.com/a/b/'].name == 'b'
+
+
+@pytest.mark.asyncio
+async def test_remove_files(db):
+    files = [('a@example.com/a/1.txt', 10), ('a@example.com/a/2.txt', 20)]
+    await folder_crud.add_files(db, 1, files)
+    await folder_crud.remove_files(db, files[:1])
+    await db.commit()
+
+    assert await get_folders(db) == {
+        'a@example.com/': (1, 20), 'a@example.com/a/': (1, 20)
+    }
+
+
+@pytest.mark.asyncio
+async def test_move_files(db):
+    await folder_crud.add_files(db, 1, [
+        ('a@example.com/a/1.txt', 10), ('a@example.com/a/2.txt', 20)
+    ])
+    folder_ids = await folder_crud.move_files(db, 1, [
+        ('a@example.com/a/1.txt', 'a@example.com/b/c/1.txt', 10)
+    ])
+    await db.commit()
+
+    assert await get_folders(db) == {
+        'a@example.com/': (2, 30),
+        'a@example.com/a/': (1, 20),
+        'a@example.com/b/': (1, 10),
+        'a@example.com/b/c/': (1, 10),
+    }
+    folder = await db.get(Folder, folder_ids[0])
+    assert folder.path == 'a@example.com/b/c/'
+
+
+@pytest.mark.asyncio
+async def test_add_files_long_folder_name(db):
+    name = 'a' * 200
+    await folder_crud.add_files(db, 1, [(f'a@example.com/{name}/1.txt', 1)])
+    await db.commit()
+
+    folder = await folder_crud.get_by_path(db, f'a@example.com/{name}/')
+    assert folder.name == name
+    assert Folder.name.type.length == Folder.path.type.length
@@ -0,0 +1,185 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from botocore.exceptions import ClientError
+from sqlalchemy import select
+
+from core.config import app_settings
+from models import Blob, File, User
+from services import inventory
+from services.inventory import (
+    StoredObject,
+    check_keys,
+    fail_files,
+    get_missing_keys,
+    get_stale_keys,
+    iter_bucket_pages,
+    iter_db_pages,
+    merge_keys,
+    read_ahead,
+)
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email='a@example.com', hashed_password='x'))
+    db.add(Blob(id=1, sha256='a' * 64, key='blobs/aa', size=10,
+                stored_size=4, ref_count=2))
+    # Files of a blob share its key
+    for name in ('1.txt', '2.txt'):
+        db.add(File(user_id=1, name=name, size=10, key='blobs/aa',
+                    blob_id=1, path=f'a@example.com/{name}'))
+    # Stored by the path
+    db.add(File(user_id=1, name='3.txt', size=3, path='a@example.com/3.txt'))
+    db.add(File(user_id=1, name='4.txt', size=5, key='blobs/uploads/1',
+                path='a@example.com/4.txt'))
+    await db.commit()
+    return db
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+async def collect(iterator) -> list:
+    return [item async for item in iterator]
+
+
+def get_objects(*keys) -> list[StoredObject]:
+    return [StoredObject(key, 1) for key in keys]
+
+
+@pytest.mark.asyncio
+async def test_merge_keys():
+    pairs = await collect(merge_keys(
+        iterate(get_objects('a', 'c', 'd', 'f')),
+        iterate(get_objects('b', 'c', 'e', 'f', 'g'))
+    ))
+
+    assert [
+        (obj and obj.key, row and row.key) for obj, row in pairs
+    ] == [
+        ('a', None), (None, 'b'), ('c', 'c'), ('d', None),
+        (None, 'e'), ('f', 'f'), (None, 'g'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_read_ahead_flattens_pages():
+    async def pages():
+        yield [1, 2]
+        yield [3]
+
+    assert await collect(read_ahead(pages())) == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_iter_bucket_pages_continues_listing():
+    requests = []
+
+    class FakeS3:
+        async def list_objects_v2(self, **kwargs):
+            requests.append(kwargs)
+            if 'ContinuationToken' not in kwargs:
+                return {
+                    'Contents': [{'Key': 'b', 'Size': 1, 'LastModified': 0}],
+                    'IsTruncated': True,
+                    'NextContinuationToken': 'next',
+                }
+            return {'Contents': [{'Key': 'c', 'Size': 2, 'LastModified': 0}]}
+
+    pages = await collect(iter_bucket_pages(FakeS3(), 'a'))
+
+    assert pages == [[StoredObject('b', 1, 0)], [StoredObject('c', 2, 0)]]
+    assert requests[0]['StartAfter'] == 'a'
+    assert requests[1]['ContinuationToken'] == 'next'
+
+
+@pytest.mark.asyncio
+async def test_iter_db_pages(db, monkeypatch):
+    monkeypatch.setattr(app_settings, 'inventory_batch_size', 2)
+
+    pages = await collect(iter_db_pages(db))
+
+    assert [obj for page in pages for obj in page] == [
+        StoredObject('a@example.com/3.txt', 3),
+        StoredObject('blobs/aa', 4),
+        StoredObject('blobs/uploads/1', 5),
+    ]
+    pages = await collect(iter_db_pages(db, 'blobs/aa'))
+    assert pages == [[StoredObject('blobs/uploads/1', 5)]]
+
+
+@pytest.mark.asyncio
+async def test_get_missing_keys():
+    class FakeS3:
+        async def head_object(self, Bucket, Key):
+            if Key == 'gone':
+                raise ClientError(
+                    {'Error': {'Code': '404'}}, 'HeadObject'
+                )
+            return {}
+
+    assert await get_missing_keys(FakeS3(), ['here', 'gone']) == ['gone']
+
+
+NOW = datetime.now(timezone.utc)
+
+
+class HeadS3:
+    """
+    Return objects modified at the given times, 404 for the others.
+    """
+    def __init__(self, **modified):
+        self.modified = modified
+        self.deleted = []
+
+    async def head_object(self, Bucket, Key):
+        if Key not in self.modified:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'LastModified': self.modified[Key]}
+
+    async def delete_objects(self, Bucket, Delete):
+        self.deleted += [item['Key'] for item in Delete['Objects']]
+        return {}
+
+
+@pytest.mark.asyncio
+async def test_get_stale_keys():
+    s3 = HeadS3(old=NOW - timedelta(hours=2), new=NOW)
+
+    assert await get_stale_keys(
+        s3, ['old', 'new', 'gone'], NOW - timedelta(hours=1)
+    ) == ['old']
+
+
+@pytest.mark.asyncio
+async def test_check_keys_skips_reuploaded_orphans(db, monkeypatch):
+    monkeypatch.setattr(inventory, 'async_session', lambda: db)
+    s3 = HeadS3(**{'old': NOW - timedelta(hours=2), 'new': NOW,
+                   'blobs/aa': NOW - timedelta(hours=2)})
+    monkeypatch.setattr(inventory.s3_client, 'client', s3)
+    counts = Counter()
+
+    await check_keys(['old', 'new', 'blobs/aa'], [], counts, True,
+                     NOW - timedelta(hours=1))
+
+    assert s3.deleted == ['old']
+    assert counts['orphan_objects'] == 2
+    assert counts['deleted_objects'] == 1
+
+
+@pytest.mark.asyncio
+async def test_fail_files(db):
+    assert await fail_files(db, ['blobs/aa', 'a@example.com/3.txt']) == 3
+    assert await fail_files(db, ['blobs/aa']) == 0
+
+    statuses = (await db.execute(
+        select(File.name, File.processing_status).order_by(File.name)
+    )).all()
+    assert [status for _, status in statuses] == [
+        'failed', 'failed', 'failed', 'pending'
+    ]
@@ -0,0 +1,189 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from services.jobs import Job, JobHandler, JobQueue, Worker
+
+
+class FakeQueue:
+    visibility_timeout = 1
+
+    def __init__(self, handlers, jobs, max_attempts=2):
+        self.handlers = handlers
+        self.ready = list(jobs)
+        self.max_attempts = max_attempts
+        self.acked = []
+        self.dead = []
+
+    def get_handler(self, name):
+        return self.handlers.get(name)
+
+    async def requeue_due(self):
+        return 0
+
+    async def reserve(self):
+        if not self.ready:
+            return None
+        job = self.ready.pop(0)
+        return job._replace(attempts=job.attempts + 1)
+
+    async def ack(self, job):
+        self.acked.append(job.id)
+
+    async def fail(self, job):
+        if job.attempts >= self.max_attempts:
+            self.dead.append(job.id)
+            return True
+        self.ready.append(job)
+        return False
+
+
+async def run_worker(queue, concurrency=2):
+    stop = asyncio.Event()
+    task = asyncio.create_task(
+        Worker(queue, concurrency=concurrency, poll_interval=0.01).run(stop)
+    )
+    await asyncio.sleep(0.2)
+    stop.set()
+    await task
+
+
+@pytest.mark.asyncio
+async def test_worker_limits_concurrency():
+    running = []
+    peak = []
+
+    async def handler(payload):
+        running.append(payload)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.remove(payload)
+
+    queue = FakeQueue(
+        {'job': JobHandler(handler)},
+        [Job(str(i), 'job', {'i': i}, 0) for i in range(6)]
+    )
+    await run_worker(queue, concurrency=2)
+
+    assert sorted(queue.acked) == [str(i) for i in range(6)]
+    assert max(peak) == 2
+
+
+@pytest.mark.asyncio
+async def test_worker_retries_and_reports_dead_jobs():
+    calls = []
+    dead = []
+
+    async def handler(payload):
+        calls.append(payload)
+        raise RuntimeError('failed')
+
+    async def on_dead(payload):
+        dead.append(payload)
+
+    queue = FakeQueue(
+        {'job': JobHandler(handler, on_dead)},
+        [Job('1', 'job', {'file_id': 1}, 0), Job('2', 'unknown', {}, 0)]
+    )
+    await run_worker(queue)
+
+    assert calls == [{'file_id': 1}, {'file_id': 1}]
+    assert dead == [{'file_id': 1}]
+    assert sorted(queue.dead) == ['1', '2']
+    assert queue.acked == []
+
+
+@pytest.fixture
+def redis():
+    # Scripts run by lupa
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+def get_queue(redis, **kwargs) -> JobQueue:
+    queue = JobQueue('test', visibility_timeout=60, max_attempts=2,
+                     retry_delay=60, **kwargs)
+    queue.init(redis)
+    return queue
+
+
+def travel(monkeypatch, seconds: float) -> None:
+    now = time.time() + seconds
+    monkeypatch.setattr(time, 'time', lambda: now)
+
+
+@pytest.mark.asyncio
+async def test_queue_runs_jobs_in_order(redis):
+    queue = get_queue(redis)
+    first = await queue.enqueue('job', {'i': 1})
+    await queue.enqueue('job', {'i': 2})
+
+    job = await queue.reserve()
+    assert job == Job(first, 'job', {'i': 1}, 1)
+    assert await redis.zscore('test:processing', first) > time.time()
+    await queue.ack(job)
+
+    assert (await queue.reserve()).payload == {'i': 2}
+    assert await queue.reserve() is None
+    assert not await redis.exists(f'test:job:{first}')
+
+
+@pytest.mark.asyncio
+async def test_queue_returns_expired_and_delayed_jobs(redis, monkeypatch):
+    queue = get_queue(redis)
+    reserved = await queue.enqueue('job', {})
+    delayed = await queue.enqueue('job', {}, delay=30)
+    await queue.reserve()
+    assert await queue.requeue_due() == 0
+
+    travel(monkeypatch, 61)
+    assert await queue.requeue_due() == 2
+    jobs = [await queue.reserve(), await queue.reserve()]
+    assert [(job.id, job.attempts) for job in jobs] == [
+        (reserved, 2), (delayed, 1)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_queue_skips_jobs_without_data(redis):
+    queue = get_queue(redis)
+    job_id = await queue.enqueue('job', {})
+    await redis.delete(f'test:job:{job_id}')
+
+    assert await queue.reserve() is None
+    assert await redis.zcard('test:processing') == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_retries_with_backoff(redis, monkeypatch):
+    queue = get_queue(redis)
+    await queue.enqueue('job', {})
+
+    job = await queue.reserve()
+    assert not await queue.fail(job)
+    assert await queue.reserve() is None
+    travel(monkeypatch, 61)
+    await queue.requeue_due()
+    job = await queue.reserve()
+    assert job.attempts == 2
+
+    assert await queue.fail(job)
+    assert await redis.lrange('test:dead', 0, -1) == [job.id]
+    assert await redis.zcard('test:processing') == 0
+    assert await redis.zcard('test:delayed') == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_limits_dead_jobs(redis):
+    queue = get_queue(redis, dead_max=2, dead_ttl=100)
+    job_ids = []
+    for _ in range(3):
+        job_ids.append(await queue.enqueue('job', {}))
+        job = await queue.reserve()
+        await queue.fail(job._replace(attempts=2))
+
+    assert await redis.lrange('test:dead', 0, -1) == job_ids[:0:-1]
+    assert 0 < await redis.ttl('test:dead') <= 100
+    for job_id in job_ids:
+        assert 0 < await redis.ttl(f'test:job:{job_id}') <= 100
@@ -0,0 +1,35 @@
+from services.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_render_counter_and_gauge():
+    registry = Registry()
+    counter = registry.register(Counter('bytes_total', 'Bytes.'))
+    registry.register(Gauge(
+        'connections', 'Connections.', lambda: {(('state', 'idle'),): 2}
+    ))
+    counter.inc(3, operation='upload')
+    counter.inc(4, operation='upload')
+
+    assert registry.render() == (
+        '# HELP bytes_total Bytes.\n'
+        '# TYPE bytes_total counter\n'
+        'bytes_total{operation="upload"} 7\n'
+        '# HELP connections Connections.\n'
+        '# TYPE connections gauge\n'
+        'connections{state="idle"} 2\n'
+    )
+
+
+def test_render_histogram_buckets():
+    histogram = Histogram('latency', 'Latency.', buckets=(0.1, 1))
+    histogram.observe(0.05, route='/files')
+    histogram.observe(0.5, route='/files')
+    histogram.observe(5, route='/files')
+
+    assert histogram.render()[2:] == [
+        'latency_bucket{route="/files",le="0.1"} 1',
+        'latency_bucket{route="/files",le="1"} 2',
+        'latency_bucket{route="/files",le="+Inf"} 3',
+        'latency_sum{route="/files"} 5.55',
+        'latency_count{route="/files"} 3',
+    ]
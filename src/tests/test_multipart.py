@@ -0,0 +1,63 @@
+import pytest
+
+from services.multipart import MultipartUploader
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.parts = {}
+        self.objects = {}
+
+    async def create_multipart_upload(self, Bucket, Key):
+        return {'UploadId': 'upload-id'}
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[PartNumber] = Body
+        return {'ETag': f'"etag-{PartNumber}"'}
+
+    async def complete_multipart_upload(
+            self, Bucket, Key, UploadId, MultipartUpload
+    ):
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        self.objects[Key] = b''.join(self.parts[n] for n in numbers)
+        return {'ETag': '"etag-multipart"'}
+
+    async def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+        return {'ETag': '"etag-single"'}
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.parts.clear()
+
+
+async def iter_chunks(data: bytes, chunk_size: int):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_by_parts():
+    client = FakeS3Client()
+    data = bytes(range(256)) * 40
+    uploader = MultipartUploader(
+        client, 'bucket', 'key', part_size=1000, concurrency=2
+    )
+
+    size = await uploader.upload(iter_chunks(data, 333))
+
+    assert size == len(data)
+    assert len(client.parts) == 11
+    assert client.objects['key'] == data
+    assert uploader.etag == '"etag-multipart"'
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_small_file():
+    client = FakeS3Client()
+    uploader = MultipartUploader(client, 'bucket', 'key', part_size=1000)
+
+    size = await uploader.upload(iter_chunks(b'small', 2))
+
+    assert size == 5
+    assert client.parts == {}
+    assert client.objects['key'] == b'small'
@@ -0,0 +1,73 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+
+from models import File, User
+from services.file import file_crud
+from services.pagination import decode_cursor, encode_cursor
+
+
+def make_cursor(*data) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email='a@example.com', hashed_password='x'))
+    for i, name in enumerate(['b', 'a', 'c', 'a']):
+        db.add(File(id=i + 1, user_id=1, name=name, size=i % 2,
+                    path=f'a@example.com/{i}'))
+    await db.commit()
+    return db
+
+
+@pytest.mark.parametrize('order_by, value', [
+    ('created_at', datetime(2024, 1, 2, 3, 4, 5)),
+    ('name', 'report.txt'),
+    ('size', 0),
+    ('score', 0.25),
+])
+def test_cursor_round_trip(order_by, value):
+    assert decode_cursor(encode_cursor(order_by, value, 7), order_by) == (
+        value, 7
+    )
+
+
+@pytest.mark.parametrize('order_by, cursor', [
+    ('name', 'not base64!'),
+    ('name', base64.urlsafe_b64encode(b'not json').decode()),
+    ('name', make_cursor('name', 'a')),
+    ('name', make_cursor('size', 1, 2)),
+    ('name', make_cursor('name', 1, 2)),
+    ('name', make_cursor('name', 'a', '2')),
+    ('name', make_cursor('name', 'a', True)),
+    ('size', make_cursor('size', '1', 2)),
+    ('size', make_cursor('size', False, 2)),
+    ('created_at', make_cursor('created_at', 'yesterday', 2)),
+    ('created_at', make_cursor('created_at', 1, 2)),
+    ('score', make_cursor('score', 'high', 2)),
+])
+def test_decode_tampered_cursor(order_by, cursor):
+    with pytest.raises(HTTPException) as err:
+        decode_cursor(cursor, order_by)
+    assert err.value.status_code == 400
+
+
+async def get_names(db, **kwargs) -> list[tuple[str, int]]:
+    file_objs = await file_crud.get_page_by_user_id(
+        db, 1, order_by='name', limit=2, **kwargs
+    )
+    return [(file_obj.name, file_obj.id) for file_obj in file_objs]
+
+
+@pytest.mark.asyncio
+async def test_get_page_descending(db):
+    assert await get_names(db, descending=True) == [('c', 3), ('b', 1)]
+    assert await get_names(db, descending=True, after=('b', 1)) == [
+        ('a', 4), ('a', 2)
+    ]
+    assert await get_names(db, after=('a', 2)) == [('a', 4), ('b', 1)]
@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from core.config import app_settings
+from models import File, User
+from schemas.file import PresignedUploadComplete
+from services.file import complete_upload, presign_upload
+
+USER = SimpleNamespace(id=1, email='a@example.com')
+OTHER_USER = SimpleNamespace(id=2, email='b@example.com')
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    async def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f'https://s3/{Params["Key"]}'
+
+    async def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise RuntimeError('Not Found')
+        return {'ContentLength': len(self.objects[Key])}
+
+    async def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email=USER.email, hashed_password='x'))
+    await db.commit()
+    return db
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+async def presign(db, s3, redis, path='docs/a.txt'):
+    upload = await presign_upload(path, '', 1, db, USER, s3, redis)
+    key = upload.urls[0].removeprefix('https://s3/')
+    return upload, key
+
+
+@pytest.mark.asyncio
+async def test_presign_gives_every_upload_its_own_key(db, redis):
+    s3 = FakeS3()
+    first, first_key = await presign(db, s3, redis)
+    second, second_key = await presign(db, s3, redis)
+
+    assert first.path == second.path == 'a@example.com/docs/a.txt'
+    assert first_key == f'blobs/uploads/{first.id}'
+    assert second_key == f'blobs/uploads/{second.id}'
+
+
+@pytest.mark.asyncio
+async def test_complete_creates_file_once(db, redis):
+    s3 = FakeS3()
+    first, first_key = await presign(db, s3, redis)
+    second, second_key = await presign(db, s3, redis)
+    s3.objects[first_key] = b'first'
+    s3.objects[second_key] = b'second!'
+
+    file_obj = await complete_upload(
+        PresignedUploadComplete(id=first.id), db, USER, s3, redis
+    )
+    assert (file_obj.path, file_obj.key, file_obj.size) == (
+        'a@example.com/docs/a.txt', first_key, 5
+    )
+    with pytest.raises(HTTPException) as err:
+        await complete_upload(
+            PresignedUploadComplete(id=first.id), db, USER, s3, redis
+        )
+    assert err.value.status_code == 404
+
+    # The losing upload of the path only drops its own object
+    with pytest.raises(HTTPException) as err:
+        await complete_upload(
+            PresignedUploadComplete(id=second.id), db, USER, s3, redis
+        )
+    await db.rollback()
+    assert err.value.status_code == 409
+    assert list(s3.objects) == [first_key]
+
+
+@pytest.mark.asyncio
+async def test_complete_checks_owner_and_upload(db, redis):
+    s3 = FakeS3()
+    upload, key = await presign(db, s3, redis)
+
+    with pytest.raises(HTTPException) as err:
+        await complete_upload(
+            PresignedUploadComplete(id=upload.id), db, OTHER_USER, s3, redis
+        )
+    assert err.value.status_code == 404
+    # Not uploaded yet, the upload can still be completed later
+    with pytest.raises(HTTPException) as err:
+        await complete_upload(
+            PresignedUploadComplete(id=upload.id), db, USER, s3, redis
+        )
+    assert err.value.status_code == 400
+    assert await redis.exists(f'presigned:{upload.id}')
+    with pytest.raises(HTTPException) as err:
+        await complete_upload(
+            PresignedUploadComplete(id='unknown'), db, USER, s3, redis
+        )
+    assert err.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_complete_over_quota_keeps_other_files(db, redis, monkeypatch):
+    s3 = FakeS3()
+    upload, key = await presign(db, s3, redis)
+    s3.objects[key] = b'x' * 10
+    s3.objects['a@example.com/docs/a.txt'] = b'stored by path'
+    monkeypatch.setattr(app_settings, 'storage_quota', 5)
+
+    with pytest.raises(HTTPException) as err:
+        await complete_upload(
+            PresignedUploadComplete(id=upload.id), db, USER, s3, redis
+        )
+    await db.rollback()
+
+    assert err.value.status_code == 413
+    assert list(s3.objects) == ['a@example.com/docs/a.txt']
+    assert (await db.scalars(select(File))).all() == []
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+import pytest_asyncio
+
+from core.config import app_settings
+from models import File, User
+from services import processing
+from services.jobs import JobQueue
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email='a@example.com', hashed_password='x'))
+    old = datetime.utcnow() - timedelta(
+        seconds=app_settings.processing_pending_timeout + 60
+    )
+    for id, status, created_at in (
+            (1, 'pending', old),
+            (2, 'pending', datetime.utcnow()),
+            (3, 'ready', old),
+            (4, 'pending', old),
+            (5, 'processing', old),
+    ):
+        db.add(File(id=id, user_id=1, name=f'{id}.txt', size=1,
+                    path=f'a@example.com/{id}.txt', created_at=created_at,
+                    processing_status=status))
+    await db.commit()
+    return db
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    queue = JobQueue('test')
+    queue.init(fakeredis.FakeAsyncRedis(decode_responses=True))
+    monkeypatch.setattr(processing, 'job_queue', queue)
+    return queue
+
+
+async def get_queued(queue) -> list[tuple[str, dict]]:
+    jobs = []
+    while (job := await queue.reserve()) is not None:
+        jobs.append((job.name, job.payload))
+    return jobs
+
+
+@pytest.mark.asyncio
+async def test_requeue_pending(db, queue, monkeypatch):
+    monkeypatch.setattr(processing, 'async_session', lambda: db)
+    monkeypatch.setattr(processing, 'SWEEP_BATCH_SIZE', 1)
+
+    await processing.requeue_pending({})
+
+    assert await get_queued(queue) == [
+        ('process_file', {'file_id': 1}), ('process_file', {'file_id': 4})
+    ]
+
+
+@pytest.mark.asyncio
+async def test_scheduled_sweep_schedules_next_one(db, queue, monkeypatch):
+    monkeypatch.setattr(processing, 'async_session', lambda: db)
+    assert await processing.schedule_sweep(60)
+    assert not await processing.schedule_sweep(60)
+
+    await processing.requeue_pending({'scheduled': True})
+
+    assert await queue.redis.zcard('test:delayed') == 2
+    assert await queue.redis.exists(processing.SWEEP_KEY)
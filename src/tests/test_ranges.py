@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from services.ranges import (
+    format_http_date,
+    is_not_modified,
+    is_range_fresh,
+    parse_range_header,
+)
+
+LAST_MODIFIED = datetime(2024, 1, 6, 11, 49, 56, 812808)
+ETAG = '"1-100-1704541796"'
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-9', [(0, 9)]),
+    ('bytes=90-', [(90, 99)]),
+    ('bytes=-10', [(90, 99)]),
+    ('bytes=95-200', [(95, 99)]),
+    ('bytes=0-1, 10-19', [(0, 1), (10, 19)]),
+    ('bytes=9-0', []),
+    ('bytes=abc', []),
+    ('items=0-9', []),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 100) == expected
+
+
+def test_parse_range_header_not_satisfiable():
+    with pytest.raises(HTTPException) as exc_info:
+        parse_range_header('bytes=100-', 100)
+    assert exc_info.value.status_code == 416
+    assert exc_info.value.headers == {'Content-Range': 'bytes */100'}
+
+
+@pytest.mark.parametrize('headers, expected', [
+    ({}, False),
+    ({'if-none-match': ETAG}, True),
+    ({'if-none-match': f'"other", W/{ETAG}'}, True),
+    ({'if-none-match': '"other"'}, False),
+    ({'if-modified-since': format_http_date(LAST_MODIFIED)}, True),
+    ({'if-modified-since': 'Fri, 05 Jan 2024 00:00:00 GMT'}, False),
+    ({'if-modified-since': 'garbage'}, False),
+])
+def test_is_not_modified(headers, expected):
+    assert is_not_modified(headers, ETAG, LAST_MODIFIED) is expected
+
+
+@pytest.mark.parametrize('headers, expected', [
+    ({}, True),
+    ({'if-range': ETAG}, True),
+    ({'if-range': f'W/{ETAG}'}, False),
+    ({'if-range': '"other"'}, False),
+    ({'if-range': format_http_date(LAST_MODIFIED)}, True),
+])
+def test_is_range_fresh(headers, expected):
+    assert is_range_fresh(headers, ETAG, LAST_MODIFIED) is expected
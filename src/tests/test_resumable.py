@@ -0,0 +1,184 @@
+import asyncio
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import app_settings
+from models import File, User
+from services.resumable import (
+    MAX_PARTS,
+    complete_upload_session,
+    create_upload_session,
+    get_offset,
+    get_part_size,
+    upload_chunk,
+)
+
+USER = SimpleNamespace(id=1, email='a@example.com')
+
+
+@pytest.mark.parametrize('part_numbers, expected', [
+    (set(), 0),
+    ({1}, 10),
+    ({1, 2}, 20),
+    ({2, 3}, 0),
+    ({1, 3}, 10),
+    ({1, 2, 3}, 25),
+])
+def test_get_offset(part_numbers, expected):
+    assert get_offset(25, 10, part_numbers) == expected
+
+
+def test_get_part_size():
+    part_size = app_settings.s3_multipart_part_size
+    assert get_part_size(1) == part_size
+    assert get_part_size(part_size * MAX_PARTS) == part_size
+
+    # Up to the S3 object size limit of 5 TiB
+    for size in (part_size * MAX_PARTS + 1, 5 * 1024 ** 4):
+        assert get_part_size(size) > part_size
+        assert get_part_size(size) * MAX_PARTS >= size
+
+
+class FakeS3:
+    """
+    Multipart uploads kept in memory.
+    """
+    def __init__(self):
+        self.parts = {}
+        self.objects = {}
+
+    async def create_multipart_upload(self, Bucket, Key):
+        return {'UploadId': 'upload'}
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[PartNumber] = Body
+        return {'ETag': f'"{PartNumber}"'}
+
+    async def complete_multipart_upload(
+            self, Bucket, Key, UploadId, MultipartUpload
+    ):
+        self.objects[Key] = b''.join(
+            self.parts[part['PartNumber']]
+            for part in MultipartUpload['Parts']
+        )
+
+    async def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class FakeRequest:
+    def __init__(self, offset: int, body: bytes):
+        self.headers = {'upload-offset': str(offset)}
+        self.body = body
+
+    async def stream(self):
+        for start in range(0, len(self.body), 3):
+            yield self.body[start:start + 3]
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email=USER.email, hashed_password='x'))
+    await db.commit()
+    return db
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+@pytest.fixture
+def part_size(monkeypatch):
+    monkeypatch.setattr(app_settings, 's3_multipart_part_size', 10)
+    return 10
+
+
+@pytest.mark.asyncio
+async def test_upload_by_chunks(db, redis, part_size):
+    s3 = FakeS3()
+    upload = await create_upload_session('docs/a.txt', '', 25, db, USER, s3,
+                                         redis)
+    assert (upload.path, upload.offset, upload.part_size) == (
+        'a@example.com/docs/a.txt', 0, part_size
+    )
+
+    # Chunks may come in any order
+    response = await upload_chunk(
+        upload.id, FakeRequest(20, b'c' * 5), USER, s3, redis
+    )
+    assert response.headers['Upload-Offset'] == '0'
+    with pytest.raises(HTTPException) as err:
+        await complete_upload_session(upload.id, db, USER, s3, redis)
+    assert err.value.status_code == 409
+    for offset, chunk in ((0, b'a' * 10), (10, b'b' * 10)):
+        response = await upload_chunk(
+            upload.id, FakeRequest(offset, chunk), USER, s3, redis
+        )
+    assert response.headers['Upload-Offset'] == '25'
+
+    file_obj = await complete_upload_session(upload.id, db, USER, s3, redis)
+    assert (file_obj.path, file_obj.size) == ('a@example.com/docs/a.txt', 25)
+    assert s3.objects[file_obj.key] == b'a' * 10 + b'b' * 10 + b'c' * 5
+    assert await redis.keys() == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('offset, body, status_code', [
+    (5, b'a' * 10, 409),
+    (30, b'a' * 10, 409),
+    (0, b'a' * 9, 400),
+    (0, b'a' * 11, 400),
+    (20, b'a' * 10, 400),
+])
+async def test_upload_wrong_chunk(db, redis, part_size, offset, body,
+                                  status_code):
+    s3 = FakeS3()
+    upload = await create_upload_session('a.txt', '', 25, db, USER, s3, redis)
+
+    with pytest.raises(HTTPException) as err:
+        await upload_chunk(
+            upload.id, FakeRequest(offset, body), USER, s3, redis
+        )
+    assert err.value.status_code == status_code
+    assert s3.parts == {}
+
+
+@pytest.mark.asyncio
+async def test_upload_session_limits_chunk_size(db, redis, part_size,
+                                                monkeypatch):
+    monkeypatch.setattr(app_settings, 'upload_chunk_max_size', 20)
+    await create_upload_session('a.txt', '', 20 * MAX_PARTS, db, USER,
+                                FakeS3(), redis)
+
+    with pytest.raises(HTTPException) as err:
+        await create_upload_session('b.txt', '', 20 * MAX_PARTS + 1, db, USER,
+                                    FakeS3(), redis)
+    assert err.value.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_complete_upload_session_once(db, engine, redis, part_size):
+    s3 = FakeS3()
+    upload = await create_upload_session('a.txt', '', 5, db, USER, s3, redis)
+    await upload_chunk(upload.id, FakeRequest(0, b'a' * 5), USER, s3, redis)
+
+    async def complete():
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            return await complete_upload_session(
+                upload.id, db, USER, s3, redis
+            )
+
+    results = await asyncio.gather(complete(), complete(),
+                                   return_exceptions=True)
+
+    file_obj, = [result for result in results if isinstance(result, File)]
+    err, = [result for result in results if isinstance(result, Exception)]
+    assert err.status_code == 409
+    # The other request doesn't delete the object of the file
+    assert s3.objects[file_obj.key] == b'a' * 5
@@ -0,0 +1,148 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import Select
+
+from models import File, User
+from schemas.file import FilesSearch
+from services.file import file_crud, load_files_page
+from services.search import get_search_clause, load_fuzzy_page
+
+USER = SimpleNamespace(id=1, email='a@example.com')
+NAMES = ['Report_2023.pdf', 'report-draft.txt', 'notes.md', '100%_done.txt']
+
+
+def get_search(**kwargs) -> FilesSearch:
+    values = {
+        'limit': 100, 'cursor': None, 'path_prefix': None, 'name': None,
+        'size_min': None, 'size_max': None, 'created_from': None,
+        'created_to': None, 'order_by': 'name', 'order': 'asc',
+        'match': 'substring', 'field': 'name',
+    }
+    values.update(kwargs)
+    return FilesSearch(**values)
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email=USER.email, hashed_password='x'))
+    db.add(User(id=2, email='b@example.com', hashed_password='x'))
+    for i, name in enumerate(NAMES):
+        db.add(File(user_id=1, name=name, size=i,
+                    path=f'{USER.email}/docs/{name}'))
+    db.add(File(user_id=2, name='report.txt', size=1,
+                path='b@example.com/report.txt'))
+    await db.commit()
+    return db
+
+
+async def find(db, **kwargs) -> list[str]:
+    search = get_search(**kwargs)
+    page = await load_files_page(
+        search, db, USER, get_search_clause(search)
+    )
+    return [file.name for file in page.files]
+
+
+@pytest.mark.asyncio
+async def test_search_substring(db):
+    assert await find(db, q='REPORT') == [
+        'Report_2023.pdf', 'report-draft.txt'
+    ]
+    # LIKE wildcards are matched literally
+    assert await find(db, q='%_') == ['100%_done.txt']
+    assert await find(db, q='docs/n', field='path') == ['notes.md']
+
+
+@pytest.mark.asyncio
+async def test_search_prefix_with_filters(db):
+    assert await find(db, q='rep', match='prefix') == [
+        'Report_2023.pdf', 'report-draft.txt'
+    ]
+    assert await find(db, q='rep', match='prefix', size_min=1) == [
+        'report-draft.txt'
+    ]
+    assert await find(db, q='draft', match='prefix') == []
+
+
+@pytest.mark.asyncio
+async def test_search_pages(db):
+    page = await load_files_page(
+        get_search(q='t', limit=2), db, USER,
+        get_search_clause(get_search(q='t'))
+    )
+    assert [file.name for file in page.files] == [
+        '100%_done.txt', 'Report_2023.pdf'
+    ]
+    search = get_search(q='t', limit=2, cursor=page.next_cursor)
+    page = await load_files_page(search, db, USER, get_search_clause(search))
+    assert [file.name for file in page.files] == [
+        'notes.md', 'report-draft.txt'
+    ]
+    assert page.next_cursor is None
+
+
+def test_search_clause_uses_ilike():
+    clause = get_search_clause(get_search(q='rep', match='prefix'))
+    sql = str(clause.compile(dialect=postgresql.dialect()))
+    assert 'ILIKE' in sql
+
+
+@pytest.mark.asyncio
+async def test_fuzzy_statement_compiles_for_postgres():
+    class CaptureDB:
+        async def execute(self, statement: Select):
+            self.statement = statement
+            return SimpleNamespace(all=lambda: [])
+
+    db = CaptureDB()
+    await file_crud.get_page_by_similarity(
+        db, 1, 'name', 'rep', after=(0.5, 7), limit=3
+    )
+
+    compiled = db.statement.compile(dialect=postgresql.dialect())
+    sql = ' '.join(str(compiled).split())
+    score = 'word_similarity(%(word_similarity_2)s, files.name)'
+    # "%" of the operator is escaped for the driver
+    assert '(%(param_1)s <%% files.name)' in sql
+    assert f'{score} AS word_similarity_1' in sql
+    assert f'({score}, files.id) < (%(param_2)s, %(param_3)s)' in sql
+    assert sql.endswith(f'ORDER BY {score} DESC, files.id DESC LIMIT '
+                        '%(param_4)s')
+    assert compiled.params['word_similarity_2'] == 'rep'
+    assert compiled.params['param_1'] == 'rep'
+    assert (compiled.params['param_2'], compiled.params['param_3']) == (
+        0.5, 7
+    )
+
+
+@pytest.mark.asyncio
+async def test_fuzzy_cursor_round_trip(monkeypatch):
+    pages = []
+    score = 1 / 3
+
+    async def get_page_by_similarity(db, user_id, name, text, *clauses,
+                                     after, limit):
+        pages.append(after)
+        return [
+            (File(id=id, name=f'{id}.txt', path=f'{id}.txt', size=1,
+                  created_at=datetime(2024, 1, 1), is_downloadable=True,
+                  processing_status='ready'), score)
+            for id in (3, 2)
+        ]
+
+    monkeypatch.setattr(
+        file_crud, 'get_page_by_similarity', get_page_by_similarity
+    )
+    search = get_search(q='rep', match='fuzzy', limit=1)
+    page = await load_fuzzy_page(search, None, USER)
+    await load_fuzzy_page(
+        get_search(q='rep', match='fuzzy', limit=1, cursor=page.next_cursor),
+        None, USER
+    )
+
+    # The score isn't rounded on the way
+    assert pages == [None, (score, 3)]
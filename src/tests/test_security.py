@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from services.security import PasswordHasher, pwd_context
+
+
+@pytest.mark.asyncio
+async def test_verify_upgrades_weak_hash():
+    hasher = PasswordHasher(workers=1, queue_size=0)
+    weak_hash = pwd_context.hash('password', rounds=4)
+
+    verified, new_hash = await hasher.verify_and_update(
+        'password', weak_hash
+    )
+
+    assert verified
+    assert new_hash and pwd_context.verify('password', new_hash)
+    assert not pwd_context.needs_update(new_hash)
+    assert await hasher.verify_and_update('wrong', weak_hash) == (
+        False, None
+    )
+    hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hasher_rejects_when_saturated():
+    hasher = PasswordHasher(workers=1, queue_size=1)
+    weak_hash = pwd_context.hash('password', rounds=4)
+
+    results = await asyncio.gather(
+        *(hasher.verify_and_update('wrong', weak_hash) for _ in range(3)),
+        return_exceptions=True
+    )
+
+    assert results[:2] == [(False, None), (False, None)]
+    assert isinstance(results[2], HTTPException)
+    assert results[2].status_code == 429
+    assert hasher.rejected == 1
+    assert hasher.in_flight == 0
+    hasher.shutdown()
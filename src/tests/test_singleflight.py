@@ -0,0 +1,233 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from models import User
+from services import base
+from services.base import RepositoryDB
+from services.singleflight import RedisSingleFlight, SingleFlight
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def register_script(self, script):
+        async def acquire(keys, args):
+            if keys[0] in self.data:
+                return 0
+            self.data[keys[0]] = args[0]
+            self.data.pop(keys[1], None)
+            return 1
+
+        async def release(keys, args):
+            if self.data.get(keys[0]) == args[0]:
+                del self.data[keys[0]]
+
+        return acquire if 'NX' in script else release
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result():
+    flight = SingleFlight()
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    results = await asyncio.gather(*(flight.do('a', func) for _ in range(10)))
+
+    assert results == [1] * 10
+    assert len(flight) == 0
+    assert await flight.do('a', func) == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exception():
+    flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(0.01)
+        raise ValueError('broken')
+
+    results = await asyncio.gather(
+        flight.do('a', func), flight.do('a', func), return_exceptions=True
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_caller():
+    flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(0.02)
+        return 'done'
+
+    first = asyncio.create_task(flight.do('a', func))
+    second = asyncio.create_task(flight.do('a', func))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == 'done'
+
+
+@pytest.mark.asyncio
+async def test_redis_single_flight_across_processes():
+    redis = FakeRedis()
+    # Two processes sharing the same Redis
+    flights = []
+    for _ in range(2):
+        flight = RedisSingleFlight('test', lock_timeout=1, poll_interval=0.01)
+        flight.init(redis)
+        flights.append(flight)
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {'calls': len(calls)}
+
+    results = await asyncio.gather(
+        *(flights[i % 2].do('a', func) for i in range(6))
+    )
+
+    assert results == [{'calls': 1}] * 6
+    assert 'test:a:lock' not in redis.data
+    # A new flight doesn't get the previous result
+    assert await flights[1].do('a', func) == {'calls': 2}
+
+
+@pytest.mark.asyncio
+async def test_redis_single_flight_runs_after_lock_timeout():
+    redis = FakeRedis()
+    redis.data['test:a:lock'] = 'stuck'
+    flight = RedisSingleFlight('test', lock_timeout=0.05, poll_interval=0.01)
+    flight.init(redis)
+
+    async def func():
+        return 1
+
+    assert await flight.do('a', func) == 1
+
+
+@pytest.fixture
+def engine(engine, monkeypatch):
+    monkeypatch.setattr(base, 'async_session', get_session(engine))
+    return engine
+
+
+def get_session(engine):
+    return sessionmaker(engine, class_=AsyncSession)
+
+
+@pytest_asyncio.fixture
+async def user(engine):
+    async with get_session(engine)() as db:
+        db.add(User(id=1, email='a@example.com', hashed_password='x'))
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_repository_get_coalesces_lookups(engine, user):
+    session = get_session(engine)
+
+    repository = RepositoryDB(User)
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    sessions = [session() for _ in range(5)]
+    event.listen(engine.sync_engine, 'before_cursor_execute', count)
+    users = await asyncio.gather(
+        *(repository.get(db, 1) for db in sessions)
+    )
+    event.remove(engine.sync_engine, 'before_cursor_execute', count)
+
+    assert len(statements) == 1
+    assert len({id(user) for user in users}) == 5
+    for db, user in zip(sessions, users):
+        assert user in db
+        assert user.email == 'a@example.com'
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_repository_get_survives_cancelled_leader(engine, user):
+    session = get_session(engine)
+    repository = RepositoryDB(User)
+    leader_db, db = session(), session()
+
+    leader = asyncio.create_task(repository.get(leader_db, 1))
+    while not base.lookups:
+        await asyncio.sleep(0)
+    follower = asyncio.create_task(repository.get(db, 1))
+    await asyncio.sleep(0)
+    # The request of the leader is gone with its session
+    leader.cancel()
+    await leader_db.close()
+
+    user = await follower
+    assert user.email == 'a@example.com'
+    assert user in db
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_repository_get_shares_lookups_in_transaction(engine, user):
+    session = get_session(engine)
+    repository = RepositoryDB(User)
+    async with session() as db:
+        # Like the auth lookup of a request
+        await db.execute(select(User.id))
+        assert db.in_transaction()
+
+        loads = []
+
+        async def load():
+            loads.append(1)
+            await asyncio.sleep(0.01)
+
+        lookup = asyncio.create_task(base.lookups.do(('users', 'id', 1), load))
+        await asyncio.sleep(0)
+        user = await repository.get(db, 1)
+        await lookup
+
+    assert loads == [1]
+    assert user is None
+
+
+@pytest.mark.asyncio
+async def test_repository_get_sees_own_changes(engine, user):
+    session = get_session(engine)
+    repository = RepositoryDB(User)
+    async with session() as db:
+        await db.execute(
+            update(User).where(User.id == 1).values(email='b@example.com')
+        )
+        assert base.has_changes(db)
+        assert (await repository.get(db, 1)).email == 'b@example.com'
+
+        await db.rollback()
+        assert not base.has_changes(db)
+        assert (await repository.get(db, 1)).email == 'a@example.com'
@@ -0,0 +1,141 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from models import Blob, User
+from schemas.file import FileUpload
+from services.blob import blob_crud, get_blob_key
+from services.file import create_uploaded_file, upload_file
+
+SHA256 = 'a' * 64
+USER = SimpleNamespace(id=1, email='a@example.com')
+
+
+class FakeS3:
+    def __init__(self, *keys):
+        self.objects = dict.fromkeys(keys, b'')
+
+    async def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+@pytest_asyncio.fixture
+async def db(db):
+    db.add(User(id=1, email='a@example.com', hashed_password='x'))
+    await db.commit()
+    return db
+
+
+def get_upload(path: str, key: str, codec=None) -> FileUpload:
+    return FileUpload(user_id=1, name=path.rsplit('/', 1)[-1], path=path,
+                      size=2000, sha256=SHA256, key=key, codec=codec,
+                      stored_size=2000 if codec is None else 100)
+
+
+def test_get_blob_key_is_unique():
+    key = get_blob_key(SHA256)
+    assert key.startswith(f'blobs/aa/{SHA256}/')
+    assert get_blob_key(SHA256) != key
+
+
+@pytest.mark.asyncio
+async def test_concurrent_upload_keeps_stored_codec(db):
+    # Both uploads missed the blob, the first one stored it gzipped
+    gzip_key = get_blob_key(SHA256)
+    raw_key = get_blob_key(SHA256)
+    s3 = FakeS3(gzip_key, raw_key)
+    await create_uploaded_file(
+        db, s3, get_upload('a@example.com/1.txt', gzip_key, 'gzip'),
+        gzip_key, 'upload'
+    )
+
+    file_obj = await create_uploaded_file(
+        db, s3, get_upload('a@example.com/2.zip', raw_key), raw_key, 'upload'
+    )
+
+    assert (file_obj.key, file_obj.codec, file_obj.stored_size) == (
+        gzip_key, 'gzip', 100
+    )
+    assert list(s3.objects) == [gzip_key]
+    blob = await db.get(Blob, file_obj.blob_id)
+    assert (blob.key, blob.codec, blob.ref_count) == (gzip_key, 'gzip', 2)
+
+
+@pytest.mark.asyncio
+async def test_failed_upload_deletes_its_object(db):
+    key = get_blob_key(SHA256)
+    s3 = FakeS3(key)
+    await create_uploaded_file(
+        db, s3, get_upload('a@example.com/1.txt', key), key, 'upload'
+    )
+    copy_key = get_blob_key(SHA256)
+    s3.objects[copy_key] = b''
+
+    with pytest.raises(Exception):
+        # The path is taken
+        await create_uploaded_file(
+            db, s3, get_upload('a@example.com/1.txt', copy_key), copy_key,
+            'upload'
+        )
+    await db.rollback()
+
+    assert list(s3.objects) == [key]
+
+
+@pytest.mark.asyncio
+async def test_skipped_upload_needs_stored_blob(db):
+    # Released by a delete, an upload without its own copy can't
+    # create a blob pointing at nothing
+    with pytest.raises(LookupError):
+        await create_uploaded_file(
+            db, FakeS3(), get_upload('a@example.com/1.txt', None), None,
+            'upload'
+        )
+    await db.rollback()
+    assert await db.get(Blob, 1) is None
+
+
+def get_upload_file(content: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(content), size=len(content),
+                      filename='1.bin', headers=Headers())
+
+
+@pytest.mark.asyncio
+async def test_upload_isnt_in_transaction_during_transfer(db):
+    transactions = []
+
+    class PutS3(FakeS3):
+        async def put_object(self, Bucket, Key, Body):
+            transactions.append(db.in_transaction())
+            self.objects[Key] = Body
+            return {'ETag': '"1"'}
+
+    s3 = PutS3()
+    file_obj = await upload_file(get_upload_file(b'abc'), '', db, USER, s3)
+
+    assert transactions == [False]
+    assert s3.objects[file_obj.key] == b'abc'
+
+
+@pytest.mark.asyncio
+async def test_upload_of_released_content(db, monkeypatch):
+    class PutS3(FakeS3):
+        async def put_object(self, Bucket, Key, Body):
+            self.objects[Key] = Body
+            return {'ETag': '"1"'}
+
+    async def get_multi_by_sha256(db, sha256_list):
+        # Found before a delete released it
+        return [Blob(sha256=sha256_list[0])]
+
+    monkeypatch.setattr(blob_crud, 'get_multi_by_sha256', get_multi_by_sha256)
+    s3 = PutS3()
+    file_obj = await upload_file(get_upload_file(b'abc'), '', db, USER, s3)
+
+    assert s3.objects[file_obj.key] == b'abc'
+    blob = await db.get(Blob, file_obj.blob_id)
+    assert (blob.key, blob.ref_count) == (file_obj.key, 1)
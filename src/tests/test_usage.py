@@ -0,0 +1,60 @@
+import pytest
+from fastapi import HTTPException
+
+from core.config import app_settings
+from models import File, Usage, User
+from services.usage import check_quota, get_quota, usage_crud
+
+
+@pytest.fixture
+def storage_quota(monkeypatch):
+    monkeypatch.setattr(app_settings, 'storage_quota', 100)
+
+
+def test_get_quota(storage_quota):
+    assert get_quota(None) == 100
+    assert get_quota(Usage(size=0, quota=500)) == 500
+
+
+def test_get_quota_unlimited(monkeypatch):
+    monkeypatch.setattr(app_settings, 'storage_quota', 0)
+    assert get_quota(None) is None
+    check_quota(Usage(size=10 ** 12), 10 ** 12)
+
+
+def test_check_quota(storage_quota):
+    check_quota(None, 100)
+    check_quota(Usage(size=60), 40)
+    with pytest.raises(HTTPException) as exc_info:
+        check_quota(Usage(size=60), 41)
+    assert exc_info.value.status_code == 413
+    check_quota(Usage(size=60, quota=1000), 500)
+
+
+@pytest.mark.asyncio
+async def test_add_and_reconcile(db):
+    db.add_all([
+        User(id=1, email='a@example.com', hashed_password=''),
+        User(id=2, email='b@example.com', hashed_password=''),
+        User(id=3, email='c@example.com', hashed_password=''),
+    ])
+    db.add_all([
+        File(user_id=1, name='a', path='a@example.com/a', size=10),
+        File(user_id=1, name='b', path='a@example.com/b', size=20),
+        File(user_id=2, name='c', path='b@example.com/c', size=5),
+    ])
+    await db.commit()
+
+    usage = await usage_crud.add(db, 1, count=2, size=30)
+    assert (usage.files_count, usage.size) == (2, 30)
+    usage = await usage_crud.add(db, 1, count=1, size=7)
+    assert (usage.files_count, usage.size) == (3, 37)
+    await db.commit()
+
+    assert await usage_crud.reconcile(db, [1, 2, 3]) == [1, 2]
+    usage = await usage_crud.get_by_user_id(db, 1)
+    assert (usage.files_count, usage.size) == (2, 30)
+    usage = await usage_crud.get_by_user_id(db, 2)
+    assert (usage.files_count, usage.size) == (1, 5)
+    assert await usage_crud.get_by_user_id(db, 3) is None
+    assert await usage_crud.reconcile(db, [1, 2, 3]) == []
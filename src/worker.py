@@ -0,0 +1,116 @@
+"""
+Run background jobs of the Redis queue.
+
+Usage (from the "src" dir):
+    python worker.py --processes 2
+    python worker.py --reconcile-usage
+    python worker.py --reconcile-storage [--fix]
+
+Storage inventory also runs every "inventory_interval" seconds if set,
+files left "pending" are queued again every "processing_sweep_interval".
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+
+from core.config import app_settings
+from core.logger import LOGGING
+from db.redis import redis_client
+from services import (  # noqa: F401 registers handlers
+    bulk,
+    inventory,
+    processing,
+    usage,
+)
+from services.boto3 import s3_client
+from services.cache import metadata_cache
+from services.jobs import Worker, job_queue
+
+logging.basicConfig = LOGGING
+logger = logging.getLogger()
+
+
+async def run_worker(concurrency: int) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await redis_client.start()
+    metadata_cache.init(redis_client.client)
+    job_queue.init(redis_client.client)
+    await s3_client.start()
+    if app_settings.inventory_interval:
+        await inventory.schedule(app_settings.inventory_interval)
+    if app_settings.processing_sweep_interval:
+        await processing.schedule_sweep(app_settings.processing_sweep_interval)
+    logger.info('Worker started.')
+    try:
+        await Worker(job_queue, concurrency=concurrency).run(stop)
+    finally:
+        await s3_client.stop()
+        await redis_client.stop()
+        logger.info('Worker stopped.')
+
+
+async def enqueue(name: str, payload: dict) -> None:
+    await redis_client.start()
+    job_queue.init(redis_client.client)
+    try:
+        if await job_queue.enqueue(name, payload) is None:
+            raise SystemExit(f'Job {name} is not queued')
+    finally:
+        await redis_client.stop()
+
+
+def main(concurrency: int) -> None:
+    asyncio.run(run_worker(concurrency))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument(
+        '--concurrency', type=int, default=app_settings.jobs_concurrency
+    )
+    parser.add_argument(
+        '--reconcile-usage',
+        action='store_true',
+        help='Queue recount of users storage usage and exit'
+    )
+    parser.add_argument(
+        '--reconcile-storage',
+        action='store_true',
+        help='Queue comparison of the bucket with the database and exit'
+    )
+    parser.add_argument(
+        '--fix',
+        action='store_true',
+        help='Delete orphan objects and mark files missing theirs as failed'
+    )
+    args = parser.parse_args()
+
+    if args.reconcile_usage:
+        asyncio.run(enqueue('reconcile_usage', {}))
+        raise SystemExit
+    if args.reconcile_storage:
+        asyncio.run(enqueue('reconcile_storage', {'fix': args.fix}))
+        raise SystemExit
+
+    processes = [
+        multiprocessing.Process(target=main, args=(args.concurrency,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop_processes(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGINT, stop_processes)
+    signal.signal(signal.SIGTERM, stop_processes)
+    for process in processes:
+        process.join()